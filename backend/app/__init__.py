@@ -18,11 +18,37 @@ def create_app(config_name=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    from app.utils.log import configure_logging
+    configure_logging(app)
+    
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
     CORS(app, origins=['http://localhost:3000'], supports_credentials=True, expose_headers=['Content-Disposition'])
 
+    from app.services.groq_client import groq_clients
+    groq_clients.init_app(app)
+    from app.services.vision_scheduler import vision_scheduler
+    vision_scheduler.init_app(app)
+    from app.services.availability import availability_index
+    availability_index.init_app(app)
+    from app.services.transit import transit_matrix
+    transit_matrix.init_app(app)
+    from app.services.recommendation_cache import recommendation_cache
+    recommendation_cache.init_app(app)
+    from app.services.inspection_jobs import inspection_queue
+    inspection_queue.init_app(app)
+    from app.services.inspection_cache import inspection_cache
+    inspection_cache.init_app(app)
+    from app.services.local_inspection import local_inspection
+    local_inspection.init_app(app)
+    from app.services.quality_gate import quality_gate
+    quality_gate.init_app(app)
+    from app.services.completion_sweeper import completion_sweeper
+    completion_sweeper.init_app(app)
+    from app.services.reservation_ledger import reservation_ledger
+    reservation_ledger.init_app(app)
+
     with app.app_context():
         # Import models so they are registered with SQLAlchemy
         from app.models.user import User
@@ -12,6 +12,100 @@ class Config:
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-secret-key-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = 86400  # 24 hours
     GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
+    # Shared Groq HTTP client: keep-alive pool size, idle expiry and timeouts (seconds)
+    GROQ_POOL_MAX_CONNECTIONS = int(os.getenv('GROQ_POOL_MAX_CONNECTIONS', 20))
+    GROQ_POOL_MAX_KEEPALIVE = int(os.getenv('GROQ_POOL_MAX_KEEPALIVE', 10))
+    GROQ_KEEPALIVE_EXPIRY = float(os.getenv('GROQ_KEEPALIVE_EXPIRY', 30))
+    GROQ_CONNECT_TIMEOUT = float(os.getenv('GROQ_CONNECT_TIMEOUT', 5))
+    GROQ_READ_TIMEOUT = float(os.getenv('GROQ_READ_TIMEOUT', 60))
+    GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', 2))
+    # Open a pooled connection in the background at app start
+    GROQ_WARMUP = os.getenv('GROQ_WARMUP', 'true').lower() == 'true'
+    # Alternative API endpoint, e.g. a local fake_groq_server.py
+    GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', '')
+
+    # Vision call scheduling (per API key): rate limit, retries and circuit breaker
+    VISION_RATE_PER_MINUTE = float(os.getenv('VISION_RATE_PER_MINUTE', 30))
+    VISION_BURST = int(os.getenv('VISION_BURST', 5))
+    VISION_MAX_RETRIES = int(os.getenv('VISION_MAX_RETRIES', 3))
+    VISION_BACKOFF_BASE = float(os.getenv('VISION_BACKOFF_BASE', 1.0))
+    VISION_BACKOFF_MAX = float(os.getenv('VISION_BACKOFF_MAX', 30))
+    VISION_BREAKER_THRESHOLD = int(os.getenv('VISION_BREAKER_THRESHOLD', 5))
+    VISION_BREAKER_RESET_SECONDS = float(os.getenv('VISION_BREAKER_RESET_SECONDS', 60))
+    # Longer rate-limit waits put the job back in the queue instead of blocking a worker
+    VISION_MAX_WAIT_SECONDS = float(os.getenv('VISION_MAX_WAIT_SECONDS', 30))
+    
+    # Sourcing availability index (seconds before a cached product is reloaded)
+    AVAILABILITY_INDEX_TTL = int(os.getenv('AVAILABILITY_INDEX_TTL', 300))
+    # Allocation strategy: 'greedy' (fixed walk) or 'weighted' (cost/lead-time solver)
+    SOURCING_STRATEGY = os.getenv('SOURCING_STRATEGY', 'greedy')
+    # Warehouse-to-city transit times CSV (empty = app/data/transit_times.csv)
+    TRANSIT_MATRIX_PATH = os.getenv('TRANSIT_MATRIX_PATH', '')
+    # Computed recommendations kept per worker (LRU, invalidated by availability version)
+    RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 10000))
+    # Reservation concurrency: 'locking' (SELECT ... FOR UPDATE), 'optimistic' (version CAS + retries)
+    # or 'ledger' (append-only reservation ledger, stock rows updated by compaction)
+    RESERVATION_MODE = os.getenv('RESERVATION_MODE', 'locking')
+    RESERVATION_MAX_ATTEMPTS = int(os.getenv('RESERVATION_MAX_ATTEMPTS', 5))
+    RESERVATION_RETRY_BASE_MS = int(os.getenv('RESERVATION_RETRY_BASE_MS', 20))
+    RESERVATION_RETRY_MAX_MS = int(os.getenv('RESERVATION_RETRY_MAX_MS', 500))
+    RESERVATION_LEDGER_COMPACT_BATCH = int(os.getenv('RESERVATION_LEDGER_COMPACT_BATCH', 5000))
+    # Ledger mode: seconds between background compactions (0 = off, run reservation_ledger_tool.py compact)
+    RESERVATION_LEDGER_COMPACT_SECONDS = float(os.getenv('RESERVATION_LEDGER_COMPACT_SECONDS', 30))
+    # Background sweep moving requests whose sources are all ready to READY_FOR_ALLOCATION:
+    # interval in seconds (0 = off), requests per batch, batches per sweep
+    COMPLETION_SWEEP_SECONDS = float(os.getenv('COMPLETION_SWEEP_SECONDS', 300))
+    COMPLETION_SWEEP_BATCH = int(os.getenv('COMPLETION_SWEEP_BATCH', 500))
+    COMPLETION_SWEEP_MAX_BATCHES = int(os.getenv('COMPLETION_SWEEP_MAX_BATCHES', 20))
+    # Largest batch accepted by POST /requests/simulate
+    SIMULATION_MAX_LINES = int(os.getenv('SIMULATION_MAX_LINES', 5000))
+    # Largest requestIds list accepted by POST /requests/recommendations/batch
+    RECOMMENDATION_BATCH_MAX_IDS = int(os.getenv('RECOMMENDATION_BATCH_MAX_IDS', 1000))
+    
+    # Background inspection queue: in-process worker threads per app process
+    # (0 = only run jobs from inspection_worker.py), idle poll interval, seconds
+    # before a RUNNING job is considered abandoned (raised at startup to the longest a vision
+    # call can take with retries, so a running job is never claimed twice), attempts before ERROR
+    INSPECTION_WORKERS = int(os.getenv('INSPECTION_WORKERS', 2))
+    INSPECTION_POLL_SECONDS = float(os.getenv('INSPECTION_POLL_SECONDS', 2.0))
+    INSPECTION_JOB_TIMEOUT = int(os.getenv('INSPECTION_JOB_TIMEOUT', 600))
+    INSPECTION_MAX_ATTEMPTS = int(os.getenv('INSPECTION_MAX_ATTEMPTS', 3))
+    # Images of one reservation sent per vision-model call (1 = one call per image; model limit is 5)
+    INSPECTION_BATCH_SIZE = int(os.getenv('INSPECTION_BATCH_SIZE', 4))
+    # Inspection backend: 'groq' (hosted vision model) or 'local' (offline CPU heuristics + optional Tesseract OCR)
+    INSPECTION_BACKEND = os.getenv('INSPECTION_BACKEND', 'groq')
+    INSPECTION_LOCAL_WORKERS = int(os.getenv('INSPECTION_LOCAL_WORKERS', 2))
+    INSPECTION_LOCAL_TIMEOUT = float(os.getenv('INSPECTION_LOCAL_TIMEOUT', 60))
+    # Ask the vision model for JSON mode output (turned off automatically for models that reject it)
+    INSPECTION_JSON_MODE = os.getenv('INSPECTION_JSON_MODE', 'true').lower() == 'true'
+    # Reuse of AI results for re-uploaded photos (TTL 0 disables; distance is max dHash bits for
+    # a near-duplicate within the same request, 0 = exact SHA-256 matches only)
+    INSPECTION_CACHE_TTL_DAYS = int(os.getenv('INSPECTION_CACHE_TTL_DAYS', 30))
+    INSPECTION_CACHE_MAX_ENTRIES = int(os.getenv('INSPECTION_CACHE_MAX_ENTRIES', 50000))
+    INSPECTION_DEDUP_MAX_DISTANCE = int(os.getenv('INSPECTION_DEDUP_MAX_DISTANCE', 4))
+    # Photos are EXIF-rotated, shrunk to this longest edge and re-encoded before the model call
+    # (0 = send the uploaded file as-is); format is JPEG or WEBP
+    INSPECTION_IMAGE_MAX_EDGE = int(os.getenv('INSPECTION_IMAGE_MAX_EDGE', 1280))
+    INSPECTION_IMAGE_FORMAT = os.getenv('INSPECTION_IMAGE_FORMAT', 'JPEG')
+    INSPECTION_IMAGE_QUALITY = int(os.getenv('INSPECTION_IMAGE_QUALITY', 85))
+
+    # Upload-time photo checks: reject blurry, badly exposed, tiny or duplicate photos with a 422
+    INSPECTION_QUALITY_GATE = os.getenv('INSPECTION_QUALITY_GATE', 'true').lower() == 'true'
+    INSPECTION_MIN_SHORT_EDGE = int(os.getenv('INSPECTION_MIN_SHORT_EDGE', 480))
+    INSPECTION_MIN_SHARPNESS = float(os.getenv('INSPECTION_MIN_SHARPNESS', 40))  # Laplacian variance at 512px
+    INSPECTION_MIN_BRIGHTNESS = float(os.getenv('INSPECTION_MIN_BRIGHTNESS', 40))
+    INSPECTION_MAX_BRIGHTNESS = float(os.getenv('INSPECTION_MAX_BRIGHTNESS', 235))
+    INSPECTION_MAX_CLIPPED = float(os.getenv('INSPECTION_MAX_CLIPPED', 0.5))  # Share of pixels near black or white
+    
+    # Structured logging for the app.* loggers (see app/utils/log.py): default level, per-module
+    # overrides ("app.routes.warehouses=DEBUG,..."), 'text' (logfmt) or 'json' lines, and whether
+    # records are written by a background thread instead of the calling one
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_QUEUE = os.getenv('LOG_QUEUE', 'true').lower() == 'true'
+    # Share of high-volume debug events (per stock row, per completion check) that are logged
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))
     
     # File upload settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
@@ -2,16 +2,18 @@ from app.models.user import User, Role
 from app.models.product import Product
 from app.models.warehouse import Warehouse, Stock
 from app.models.supplier import Supplier, SupplierStock
-from app.models.request import ProductRequest, Reservation, RequestStatus
-from app.models.inspection import InspectionImage, InspectionResult
+from app.models.request import ProductRequest, Reservation, ReservationBatch, RequestStatus
+from app.models.inspection import InspectionImage, InspectionResult, InspectionJob, InspectionJobStatus, InspectionResultCache
 from app.models.shipment import Shipment, ShipmentStatus
+from app.models.ledger import ReservationLedgerEntry, ReservationBalance, LedgerReason
 
 __all__ = [
     'User', 'Role',
     'Product',
     'Warehouse', 'Stock',
     'Supplier', 'SupplierStock',
-    'ProductRequest', 'Reservation', 'RequestStatus',
-    'InspectionImage', 'InspectionResult',
-    'Shipment', 'ShipmentStatus'
+    'ProductRequest', 'Reservation', 'ReservationBatch', 'RequestStatus',
+    'InspectionImage', 'InspectionResult', 'InspectionJob', 'InspectionJobStatus', 'InspectionResultCache',
+    'Shipment', 'ShipmentStatus',
+    'ReservationLedgerEntry', 'ReservationBalance', 'LedgerReason'
 ]
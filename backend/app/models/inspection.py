@@ -31,6 +31,10 @@ class InspectionImage(db.Model):
     file_path = db.Column(db.String(500), nullable=False)
     file_size = db.Column(db.Integer)  # bytes
     mime_type = db.Column(db.String(100))
+
+    # Content fingerprints for duplicate detection (see app/utils/images.py)
+    content_sha256 = db.Column(db.String(64), index=True)
+    perceptual_hash = db.Column(db.String(16))  # 64-bit dHash, hex
     
     # Image type
     image_type = db.Column(db.String(50))  # 'package', 'label', 'contents', 'damage'
@@ -53,6 +57,7 @@ class InspectionImage(db.Model):
     
     # Raw AI response
     ai_raw_response = db.Column(db.Text)
+    result_cached = db.Column(db.Boolean, default=False)  # Result reused from an identical/near-identical upload
     
     # Manual override
     overridden = db.Column(db.Boolean, default=False)
@@ -100,9 +105,96 @@ class InspectionImage(db.Model):
             'isExpired': self.is_expired,
             'sealIntact': self.seal_intact,
             'spoilageDetected': self.spoilage_detected,
+            'resultCached': bool(self.result_cached),
             'overridden': self.overridden,
             'overrideResult': self.override_result.value if self.override_result else None,
             'overrideReason': self.override_reason,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'processedAt': self.processed_at.isoformat() if self.processed_at else None
         }
+
+
+class InspectionJobStatus(Enum):
+    """Background inspection job states"""
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+
+class InspectionJob(db.Model):
+    """
+    Durable queue entry for the AI analysis of one uploaded image.
+
+    Workers claim QUEUED jobs whose available_at has passed (and RUNNING jobs
+    whose lock has gone stale) with a conditional UPDATE, so several worker
+    threads or processes can share the table.
+    """
+    __tablename__ = 'inspection_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('inspection_images.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    status = db.Column(db.Enum(InspectionJobStatus), nullable=False, default=InspectionJobStatus.QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # Not claimed before this (retry backoff)
+
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # Relationships
+    image = db.relationship('InspectionImage')
+
+    __table_args__ = (
+        db.Index('ix_inspection_jobs_claim', 'status', 'available_at'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'imageId': self.image_id,
+            'status': self.status.value if self.status else None,
+            'attempts': self.attempts,
+            'maxAttempts': self.max_attempts,
+            'lastError': self.last_error,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'startedAt': self.started_at.isoformat() if self.started_at else None,
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class InspectionResultCache(db.Model):
+    """
+    Parsed AI inspection results keyed by image content.
+
+    An entry is reused for uploads with the same SHA-256 (any request) or a
+    perceptual hash within a few bits (same request), as long as the image
+    type and prompt version match and it has not expired.
+    """
+    __tablename__ = 'inspection_result_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_sha256 = db.Column(db.String(64), nullable=False)
+    perceptual_hash = db.Column(db.String(16))
+    image_type = db.Column(db.String(50), nullable=False)
+    prompt_version = db.Column(db.String(32), nullable=False)  # Changes whenever the model or prompt changes
+    request_id = db.Column(db.Integer, db.ForeignKey('product_requests.id', ondelete='SET NULL'), nullable=True)
+
+    result_json = db.Column(db.Text, nullable=False)  # analyze_image() result dict
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('content_sha256', 'image_type', 'prompt_version', name='uq_inspection_result_cache_key'),
+        db.Index('ix_inspection_result_cache_request', 'request_id', 'image_type', 'prompt_version'),
+    )
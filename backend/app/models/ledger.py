@@ -0,0 +1,84 @@
+from enum import Enum
+from datetime import datetime
+from app import db
+
+
+class LedgerReason(Enum):
+    """Why a reserved quantity changed"""
+    OPENING = 'OPENING'            # Balance carried over when the ledger was initialised
+    RESERVE = 'RESERVE'            # Dealer confirmed sourcing recommendation
+    REPLACE = 'REPLACE'            # Procurement moved a blocked reservation to another warehouse
+    CANCEL = 'CANCEL'              # Dealer cancelled the request
+    REJECT = 'REJECT'              # Procurement rejected the request
+    AUTO_RESOLVE = 'AUTO_RESOLVE'  # Blocked request switched to full import
+    RECEIVED = 'RECEIVED'          # Shipment delivered, stock consumed
+    ADJUST = 'ADJUST'              # Warehouse operator overrode available quantity
+
+
+class ReservationLedgerEntry(db.Model):
+    """
+    Append-only log of reserved quantity changes.
+
+    Every change to a warehouse's reserved quantity is recorded here as a
+    signed delta. stock_applied is True when the change was also written to
+    Stock.reserved_quantity at the time (locking/optimistic modes); ledger
+    mode leaves it False and compaction projects it onto the stock row.
+    """
+    __tablename__ = 'reservation_ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    stock_id = db.Column(db.Integer, db.ForeignKey('stocks.id', ondelete='SET NULL'), nullable=True, index=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('product_requests.id'), nullable=True, index=True)
+
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.Enum(LedgerReason), nullable=False)
+    stock_applied = db.Column(db.Boolean, nullable=False, default=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    compacted_at = db.Column(db.DateTime, nullable=True, index=True)  # Folded into reservation_balances
+
+    # Relationships
+    stock = db.relationship('Stock')
+
+    __table_args__ = (
+        db.Index('ix_reservation_ledger_key', 'warehouse_id', 'product_id'),
+    )
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'warehouseId': self.warehouse_id,
+            'productId': self.product_id,
+            'stockId': self.stock_id,
+            'requestId': self.request_id,
+            'delta': self.delta,
+            'reason': self.reason.value if self.reason else None,
+            'stockApplied': self.stock_applied,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'compactedAt': self.compacted_at.isoformat() if self.compacted_at else None
+        }
+
+
+class ReservationBalance(db.Model):
+    """Materialised reserved quantity per (warehouse, product), maintained by ledger compaction"""
+    __tablename__ = 'reservation_balances'
+
+    warehouse_id = db.Column(db.Integer, db.ForeignKey('warehouses.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0)
+    last_entry_id = db.Column(db.Integer, nullable=False, default=0)  # Highest ledger id folded in
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'warehouseId': self.warehouse_id,
+            'productId': self.product_id,
+            'reservedQuantity': self.reserved_quantity,
+            'lastEntryId': self.last_entry_id,
+            'updatedAt': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -1,5 +1,7 @@
 from enum import Enum
 from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from app import db
 
 
@@ -75,6 +77,10 @@ class ProductRequest(db.Model):
     dealer_notes = db.Column(db.Text)
     procurement_notes = db.Column(db.Text)
     
+    # Joint Wait source counters, maintained on flush (see _count_ready_sources)
+    sources_total = db.Column(db.Integer, default=0)  # Reservations with quantity > 0
+    sources_ready = db.Column(db.Integer, default=0)  # ... of which ready for logistics
+    
     # Audit
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -96,6 +102,13 @@ class ProductRequest(db.Model):
         random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
         self.request_number = f"REQ-{timestamp}-{random_suffix}"
     
+    @property
+    def sources_pending(self):
+        """Sources still not ready; 0 means the request can move to logistics"""
+        if self.sources_total is None or self.sources_ready is None:
+            return None
+        return self.sources_total - self.sources_ready
+    
     def to_dict(self, include_relations=True):
         """Convert to dictionary"""
         data = {
@@ -114,6 +127,8 @@ class ProductRequest(db.Model):
             'estimatedDeliveryDate': self.estimated_delivery_date.isoformat() if self.estimated_delivery_date else None,
             'dealerNotes': self.dealer_notes,
             'procurementNotes': self.procurement_notes,
+            'sourcesTotal': self.sources_total,
+            'sourcesReady': self.sources_ready,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'updatedAt': self.updated_at.isoformat() if self.updated_at else None,
             'confirmedAt': self.confirmed_at.isoformat() if self.confirmed_at else None,
@@ -163,6 +178,10 @@ class Reservation(db.Model):
     procurement_resolved_at = db.Column(db.DateTime)
     procurement_resolution_notes = db.Column(db.Text)
     
+    # What this reservation currently contributes to the request's source counters:
+    # None = not counted (quantity <= 0), False = counted, not ready, True = counted and ready
+    counted_as_ready = db.Column(db.Boolean, nullable=True)
+    
     # For replacements
     is_replacement = db.Column(db.Boolean, default=False)
     original_reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.id'), nullable=True)
@@ -175,6 +194,95 @@ class Reservation(db.Model):
     warehouse = db.relationship('Warehouse', back_populates='reservations')
     supplier = db.relationship('Supplier', back_populates='reservations')
     original_reservation = db.relationship('Reservation', remote_side=[id])
+    batches = db.relationship('ReservationBatch', back_populates='reservation',
+                              cascade='all, delete-orphan', order_by='ReservationBatch.id')
+    
+    def is_source_ready(self) -> bool:
+        """
+        Check if this reservation/source is ready.
+        
+        Warehouse source is ready when:
+        - is_picked = True AND
+        - (ai_confirmed = True OR procurement_resolved = True) AND
+        - is_blocked = False
+        
+        Supplier source is ready when:
+        - reservation_status in [SUPPLIER_CONFIRMED, READY]
+        """
+        # Blocked reservations are not ready (they need replacement)
+        if self.is_blocked:
+            return False
+        
+        # Warehouse source
+        if self.warehouse_id:
+            # Must be picked
+            if not self.is_picked:
+                return False
+            
+            # Must have AI confirmation or procurement resolution
+            if self.ai_confirmed or self.procurement_resolved:
+                return True
+            
+            # Check reservation status
+            return self.reservation_status in [
+                ReservationStatus.AI_CONFIRMED,
+                ReservationStatus.READY,
+                ReservationStatus.PROCUREMENT_RESOLVED
+            ]
+        
+        # Supplier source
+        if self.supplier_id:
+            # Supplier must confirm availability
+            if self.reservation_status in [
+                ReservationStatus.SUPPLIER_CONFIRMED,
+                ReservationStatus.READY
+            ]:
+                return True
+            
+            # Legacy check for older reservations
+            return bool(self.procurement_resolved)
+        
+        # Unknown source type
+        return False
+    
+    @classmethod
+    def source_ready_clause(cls):
+        """SQL version of is_source_ready(), for set-based queries (NULL counts as not ready)"""
+        return db.and_(
+            db.func.coalesce(cls.is_blocked, False) == False,
+            db.or_(
+                db.and_(
+                    cls.warehouse_id.isnot(None),
+                    cls.is_picked == True,
+                    db.or_(
+                        cls.ai_confirmed == True,
+                        cls.procurement_resolved == True,
+                        cls.reservation_status.in_([
+                            ReservationStatus.AI_CONFIRMED,
+                            ReservationStatus.READY,
+                            ReservationStatus.PROCUREMENT_RESOLVED
+                        ])
+                    )
+                ),
+                db.and_(
+                    cls.warehouse_id.is_(None),
+                    cls.supplier_id.isnot(None),
+                    db.or_(
+                        cls.reservation_status.in_([
+                            ReservationStatus.SUPPLIER_CONFIRMED,
+                            ReservationStatus.READY
+                        ]),
+                        cls.procurement_resolved == True
+                    )
+                )
+            )
+        )
+    
+    def source_contribution(self):
+        """Value for counted_as_ready given the reservation's current fields"""
+        if self.quantity is None or self.quantity <= 0:
+            return None  # Fully replaced reservations don't count
+        return self.is_source_ready()
     
     def to_dict(self, include_request=True):
         """Convert to dictionary"""
@@ -214,10 +322,87 @@ class Reservation(db.Model):
             'isReplacement': self.is_replacement,
             'createdAt': self.created_at.isoformat() if self.created_at else None,
             'warehouse': warehouse_data,
-            'supplier': supplier_data
+            'supplier': supplier_data,
+            'batches': [b.to_dict() for b in self.batches] if self.warehouse_id else []
         }
 
         if include_request:
             data['request'] = self.request.to_dict(include_relations=False) if self.request else None
 
         return data
+
+
+class ReservationBatch(db.Model):
+    """Stock batch a local reservation draws from, picked first-expiry-first-out"""
+    __tablename__ = 'reservation_batches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    reservation_id = db.Column(db.Integer, db.ForeignKey('reservations.id', ondelete='CASCADE'), nullable=False, index=True)
+    stock_id = db.Column(db.Integer, db.ForeignKey('stocks.id', ondelete='SET NULL'), nullable=True, index=True)
+
+    # Copied from the stock row so the record survives batch edits/deletion
+    batch_number = db.Column(db.String(100))
+    expiry_date = db.Column(db.Date)
+
+    quantity = db.Column(db.Integer, nullable=False)
+    released_quantity = db.Column(db.Integer, nullable=False, default=0)  # Released or consumed since
+
+    # Relationships
+    reservation = db.relationship('Reservation', back_populates='batches')
+    stock = db.relationship('Stock')
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'reservationId': self.reservation_id,
+            'stockId': self.stock_id,
+            'batchNumber': self.batch_number,
+            'expiryDate': self.expiry_date.isoformat() if self.expiry_date else None,
+            'quantity': self.quantity,
+            'releasedQuantity': self.released_quantity
+        }
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_ready_sources(session, flush_context, instances):
+    """
+    Keep ProductRequest.sources_total/sources_ready in step with reservations.
+
+    Every new, changed or deleted reservation is re-evaluated; when its
+    contribution flips, the difference is applied to its request in the same
+    flush. Persistent requests get an in-SQL increment so concurrent workers
+    finishing different sources of one request don't overwrite each other.
+    """
+    deltas = {}  # request -> [total delta, ready delta]
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, Reservation):
+            continue
+        before = obj.counted_as_ready
+        after = None if obj in session.deleted else obj.source_contribution()
+        if after == before:
+            continue
+        if obj not in session.deleted:
+            obj.counted_as_ready = after
+
+        product_request = obj.request
+        if product_request is None or product_request in session.deleted:
+            continue
+        delta = deltas.setdefault(product_request, [0, 0])
+        delta[0] += (after is not None) - (before is not None)
+        delta[1] += (after is True) - (before is True)
+
+    for product_request, (total_delta, ready_delta) in deltas.items():
+        _bump_counter(product_request, 'sources_total', total_delta)
+        _bump_counter(product_request, 'sources_ready', ready_delta)
+
+
+def _bump_counter(product_request, name, delta):
+    if not delta:
+        return
+    state = inspect(product_request)
+    if state.pending or state.attrs[name].history.added:
+        # Not in the database yet, or already set in this unit of work
+        setattr(product_request, name, (getattr(product_request, name) or 0) + delta)
+    else:
+        setattr(product_request, name, getattr(ProductRequest, name) + delta)
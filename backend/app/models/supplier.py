@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import func
+from sqlalchemy import event, func
 from app import db
 
 
@@ -77,6 +77,9 @@ class SupplierStock(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Optimistic concurrency: bumped on every availability change
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     supplier = db.relationship('Supplier', back_populates='stocks')
     product = db.relationship('Product', back_populates='supplier_stocks')
@@ -112,3 +115,12 @@ class SupplierStock(db.Model):
             'supplier': self.supplier.to_dict() if self.supplier else None,
             'product': self.product.to_dict() if self.product else None
         }
+
+
+@event.listens_for(SupplierStock, 'before_update')
+def _bump_supplier_stock_version(mapper, connection, target):
+    """Bump version in the UPDATE itself so concurrent writers see the change"""
+    state = db.inspect(target)
+    if any(state.attrs[name].history.has_changes()
+           for name in ('available_quantity', 'is_active', 'custom_lead_time_days', 'supplier_id', 'product_id')):
+        target.version = SupplierStock.version + 1
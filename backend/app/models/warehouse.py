@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy import event
 from app import db
 
 
@@ -76,6 +77,9 @@ class Stock(db.Model):
     
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Optimistic concurrency: bumped on every quantity/reservation change
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     warehouse = db.relationship('Warehouse', back_populates='stocks')
     product = db.relationship('Product', back_populates='stocks')
@@ -83,6 +87,7 @@ class Stock(db.Model):
     # Unique constraint
     __table_args__ = (
         db.UniqueConstraint('warehouse_id', 'product_id', 'batch_number', name='uq_warehouse_product_batch'),
+        db.Index('ix_stocks_product_expiry', 'product_id', 'expiry_date'),  # FEFO batch selection
     )
     
     @property
@@ -107,3 +112,11 @@ class Stock(db.Model):
             'warehouse': self.warehouse.to_dict() if self.warehouse else None,
             'product': self.product.to_dict() if self.product else None
         }
+
+
+@event.listens_for(Stock, 'before_update')
+def _bump_stock_version(mapper, connection, target):
+    """Bump version in the UPDATE itself so concurrent writers see the change"""
+    state = db.inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('quantity', 'reserved_quantity', 'warehouse_id', 'product_id')):
+        target.version = Stock.version + 1
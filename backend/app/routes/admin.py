@@ -5,6 +5,8 @@ from app.models.user import User, Role
 from app.models.request import ProductRequest, RequestStatus
 from app.models.warehouse import Warehouse
 from app.models.supplier import Supplier
+from app.services.completion_sweeper import completion_sweeper
+from app.services.reservation_ledger import reservation_ledger
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -228,5 +230,23 @@ def get_stats():
         },
         'suppliers': {
             'total': total_suppliers
-        }
+        },
+        'completionSweep': completion_sweeper.stats(),
+        'ledgerCompaction': reservation_ledger.stats()
+    })
+
+
+@admin_bp.route('/completion-sweep', methods=['POST'])
+@jwt_required()
+def run_completion_sweep():
+    """Move requests whose sources are all ready to READY_FOR_ALLOCATION now (Admin only)"""
+    claims = get_jwt()
+    if claims['role'] != 'ADMIN':
+        return jsonify({'message': 'Admin access required'}), 403
+    
+    fixed = completion_sweeper.sweep()
+    return jsonify({
+        'message': f'Moved {fixed} request(s) to READY_FOR_ALLOCATION',
+        'fixed': fixed,
+        'stats': completion_sweeper.stats()
     })
@@ -2,14 +2,15 @@ import os
 import uuid
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from werkzeug.utils import secure_filename
 from datetime import datetime
 from app import db
-from app.models.inspection import InspectionImage, InspectionResult
-from app.models.request import ProductRequest, Reservation, RequestStatus, ReservationStatus
+from app.models.inspection import InspectionImage, InspectionResult, InspectionJob
+from app.models.request import ProductRequest, Reservation, RequestStatus
 from app.models.user import User
-from app.services.groq_ai import GroqAIService
-from app.services.source_completion import SourceCompletionService
+from app.services.inspection_jobs import inspection_queue
+from app.services.inspection_cache import inspection_cache
+from app.services.quality_gate import quality_gate
+from app.utils.images import ingest_upload
 
 inspection_bp = Blueprint('inspection', __name__)
 
@@ -23,7 +24,14 @@ def allowed_file(filename):
 @inspection_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_image():
-    """Upload inspection image"""
+    """
+    Upload inspection image(s).
+
+    Several 'file' parts (with matching 'imageType' values) may be sent in one
+    request; their analysis jobs are queued together so the worker can inspect
+    them in a single batched model call. A single file returns the image as
+    before; several return {'images': [...]}.
+    """
     claims = get_jwt()
     
     if claims['role'] != 'WAREHOUSE_OPERATOR':
@@ -32,16 +40,22 @@ def upload_image():
     if 'file' not in request.files:
         return jsonify({'message': 'No file provided'}), 400
     
-    file = request.files['file']
-    if file.filename == '':
+    files = request.files.getlist('file')
+    if any(file.filename == '' for file in files):
         return jsonify({'message': 'No file selected'}), 400
     
-    if not allowed_file(file.filename):
+    if not all(allowed_file(file.filename) for file in files):
         return jsonify({'message': 'Invalid file type. Allowed: png, jpg, jpeg, webp'}), 400
+
+    max_files = current_app.config.get('INSPECTION_BATCH_SIZE', 4)
+    if len(files) > max(max_files, 1):
+        return jsonify({'message': f'At most {max(max_files, 1)} images per upload'}), 400
     
     request_id = request.form.get('requestId')
     reservation_id = request.form.get('reservationId')
-    image_type = request.form.get('imageType', 'package')
+    image_types = request.form.getlist('imageType')
+    if len(image_types) != len(files):
+        image_types = [image_types[0] if image_types else 'package'] * len(files)
 
     if not request_id:
         return jsonify({'message': 'requestId is required'}), 400
@@ -82,29 +96,80 @@ def upload_image():
         if reservation and reservation.warehouse_id != user.assigned_warehouse_id:
             return jsonify({'message': 'Unauthorized: reservation does not belong to your warehouse'}), 403
 
-    # Generate unique filename
-    ext = file.filename.rsplit('.', 1)[1].lower()
-    filename = f"{uuid.uuid4()}.{ext}"
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-
-    # Save file
-    file.save(file_path)
-    file_size = os.path.getsize(file_path)
+    inspections = []
+    saved_paths = []
+    rejected = []
+    seen_hashes = {}
+    for file, image_type in zip(files, image_types):
+        # Generate unique filename
+        ext = file.filename.rsplit('.', 1)[1].lower()
+        filename = f"{uuid.uuid4()}.{ext}"
+        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+        # Stream to disk once, hashing, validating and preparing the model payload on the way
+        try:
+            ingested = ingest_upload(
+                file.stream,
+                file_path,
+                max_bytes=current_app.config.get('MAX_CONTENT_LENGTH'),
+                max_edge=current_app.config.get('INSPECTION_IMAGE_MAX_EDGE', 1280),
+                image_format=current_app.config.get('INSPECTION_IMAGE_FORMAT', 'JPEG'),
+                quality=current_app.config.get('INSPECTION_IMAGE_QUALITY', 85)
+            )
+        except ValueError as e:
+            db.session.rollback()
+            for path in saved_paths:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            return jsonify({'message': f'{file.filename}: {str(e)}'}), 400
+        saved_paths.extend([file_path, ingested.prepared_path])
+
+        # Reject unusable photos now rather than after a model call
+        problems = quality_gate.problems(ingested.quality)
+        if ingested.sha256 in seen_hashes:
+            problems.append(('duplicate', f"same photo as {seen_hashes[ingested.sha256]} in this upload"))
+        else:
+            earlier = quality_gate.duplicate_of(ingested.sha256, request_id, reservation_id, image_type)
+            if earlier:
+                problems.append(('duplicate', f"already uploaded as image #{earlier.id}, still being analysed"))
+        seen_hashes.setdefault(ingested.sha256, file.filename)
+        quality_gate.record([code for code, _ in problems])
+        if problems:
+            rejected.append({
+                'filename': file.filename,
+                'reasons': [code for code, _ in problems],
+                'message': '; '.join(message for _, message in problems),
+                'quality': ingested.quality
+            })
+            continue
+
+        # Create inspection record
+        inspection = InspectionImage(
+            request_id=request_id,
+            reservation_id=reservation_id,
+            uploaded_by_id=int(get_jwt_identity()),
+            filename=filename,
+            file_path=file_path,
+            file_size=ingested.size,
+            mime_type=ingested.mime_type,
+            content_sha256=ingested.sha256,
+            perceptual_hash=ingested.perceptual_hash,
+            image_type=image_type,
+            result=InspectionResult.PROCESSING
+        )
+        db.session.add(inspection)
+        inspections.append(inspection)
 
-    # Create inspection record
-    inspection = InspectionImage(
-        request_id=request_id,
-        reservation_id=reservation_id,
-        uploaded_by_id=int(get_jwt_identity()),
-        filename=filename,
-        file_path=file_path,
-        file_size=file_size,
-        mime_type=file.content_type,
-        image_type=image_type,
-        result=InspectionResult.PROCESSING
-    )
-    
-    db.session.add(inspection)
+    if rejected:
+        db.session.rollback()
+        for path in saved_paths:
+            if path and os.path.exists(path):
+                os.remove(path)
+        details = ' | '.join(f"{r['filename']}: {r['message']}" for r in rejected)
+        return jsonify({
+            'message': f'Photo rejected, please retake: {details}',
+            'rejected': rejected
+        }), 422
 
     user_warehouse_id = user.assigned_warehouse_id
     
@@ -114,155 +179,16 @@ def upload_image():
     if warehouse_all_picked and product_request.status == RequestStatus.PICKING:
         product_request.status = RequestStatus.INSPECTION_PENDING
 
+    # AI analysis runs in the background inspection queue
+    jobs = [inspection_queue.enqueue(inspection) for inspection in inspections]
+
     db.session.commit()
-    
-    # Run AI analysis asynchronously (for now, sync)
-    try:
-        groq_service = GroqAIService()
-        ai_result = groq_service.analyze_image(file_path, image_type)
-        
-        inspection.result = InspectionResult(ai_result['result'])
-        inspection.confidence_score = ai_result['confidence']
-        inspection.damage_detected = ai_result.get('damage_detected', False)
-        inspection.damage_type = ai_result.get('damage_type')
-        inspection.damage_severity = ai_result.get('damage_severity')
-        inspection.expiry_detected = ai_result.get('expiry_detected', False)
-        inspection.is_expired = ai_result.get('is_expired', False)
-        inspection.seal_intact = ai_result.get('seal_intact')
-        inspection.spoilage_detected = ai_result.get('spoilage_detected', False)
-        inspection.ai_raw_response = ai_result.get('raw_response', '')
-        inspection.processed_at = datetime.utcnow()
-        
-        if ai_result.get('detected_expiry_date'):
-            inspection.detected_expiry_date = datetime.fromisoformat(ai_result['detected_expiry_date']).date()
-        
-        # Update reservation if blocked (when there's a specific reservation)
-        if reservation_id and ai_result['result'] in ['DAMAGED', 'EXPIRED']:
-            reservation = Reservation.query.get(reservation_id)
-            if reservation:
-                reservation.is_blocked = True
-                reservation.block_reason = ai_result['result']
-                reservation.reservation_status = ReservationStatus.AI_DAMAGED
-        
-        # Initialize source completion service for Joint Wait model
-        source_completion = SourceCompletionService()
-        
-        if ai_result['result'] in ['DAMAGED', 'EXPIRED']:
-            all_reservations = Reservation.query.filter_by(request_id=request_id).all()
-            
-            warehouses_in_request = set(r.warehouse_id for r in all_reservations if r.warehouse_id)
-            
-            warehouses_all_inspected = set()
-            for warehouse_id in warehouses_in_request:
-                warehouse_reservations = [r for r in all_reservations if r.warehouse_id == warehouse_id]
-                
-                warehouse_inspected_count = InspectionImage.query.filter(
-                    InspectionImage.request_id == request_id,
-                    InspectionImage.reservation_id.in_([r.id for r in warehouse_reservations]),
-                    InspectionImage.result.in_([
-                        InspectionResult.OK,
-                        InspectionResult.DAMAGED,
-                        InspectionResult.EXPIRED
-                    ])
-                ).count()
-                
-                if warehouse_inspected_count == len(warehouse_reservations):
-                    warehouses_all_inspected.add(warehouse_id)
-            
-            all_blocked = Reservation.query.filter_by(
-                request_id=request_id,
-                is_blocked=True
-            ).count()
-
-            total_reservations = Reservation.query.filter_by(request_id=request_id).count()
-
-            if all_blocked == total_reservations and total_reservations > 0:
-                product_request.status = RequestStatus.BLOCKED
-                print(f"[INSPECTION] Request {product_request.id} marked as BLOCKED - all reservations damaged")
-            else:
-                # JOINT WAIT: Set to PARTIALLY_BLOCKED, let procurement handle
-                # Procurement will use SourceCompletionService after resolution
-                product_request.status = RequestStatus.PARTIALLY_BLOCKED
-                print(f"[INSPECTION] Request {product_request.id} marked as PARTIALLY_BLOCKED - {all_blocked}/{total_reservations} reservations blocked")
-
-        elif ai_result['result'] == 'LOW_CONFIDENCE':
-            # LOW_CONFIDENCE requires procurement review
-            # Update reservation status to indicate low confidence
-            if reservation_id:
-                reservation = Reservation.query.get(reservation_id)
-                if reservation:
-                    reservation.reservation_status = ReservationStatus.AI_LOW_CONFIDENCE
-            
-            product_request.status = RequestStatus.PARTIALLY_BLOCKED
-            print(f"[INSPECTION] Request {product_request.id} has LOW_CONFIDENCE result - flagged for procurement review")
-
-        elif ai_result['result'] == 'OK':
-            # JOINT WAIT MODEL: Mark this reservation as AI-confirmed
-            # Then trigger completion check to see if ALL sources are ready
-            
-            # Mark this reservation as picked and AI-confirmed
-            if reservation_id:
-                reservation = Reservation.query.get(reservation_id)
-                if reservation:
-                    # Auto-mark as picked when AI confirms (uploading = already picked)
-                    if not reservation.is_picked:
-                        reservation.is_picked = True
-                        reservation.picked_at = datetime.utcnow()
-                        print(f"[INSPECTION] Reservation {reservation_id} auto-marked as picked")
-                    
-                    reservation.ai_confirmed = True
-                    reservation.ai_confirmation_date = datetime.utcnow()
-                    reservation.reservation_status = ReservationStatus.AI_CONFIRMED
-                    print(f"[INSPECTION] Reservation {reservation_id} marked as AI_CONFIRMED")
-            
-            # Check if this action completed picking for the warehouse (re-check for auto-pick scenarios)
-            # Fetch fresh list or trust identity map
-            warehouse_reservations = [r for r in product_request.reservations if r.warehouse_id == user_warehouse_id]
-            warehouse_all_picked = all(r.is_picked for r in warehouse_reservations) if warehouse_reservations else False
-            
-            if warehouse_all_picked and product_request.status == RequestStatus.PICKING:
-                product_request.status = RequestStatus.INSPECTION_PENDING
-                print(f"[INSPECTION] Request {request_id} picking complete for warehouse - set to INSPECTION_PENDING")
-            
-            # Commit current changes first
-            db.session.commit()
-            
-            # JOINT WAIT: Use SourceCompletionService to check if ALL sources are ready
-            # This will transition to READY_FOR_ALLOCATION only when all sources complete
-            all_ready = source_completion.check_all_sources_ready(int(request_id))
-            
-            if all_ready:
-                print(f"[INSPECTION] Request {request_id} ALL SOURCES READY - transitioned to READY_FOR_ALLOCATION")
-            else:
-                # Some sources still pending - update status to waiting
-                if product_request.status == RequestStatus.INSPECTION_PENDING:
-                    product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
-                    db.session.commit()
-                print(f"[INSPECTION] Request {request_id} waiting for other sources to complete")
-        
-        db.session.commit()
-        
-    except Exception as e:
-        print(f"[UPLOAD_ERROR] {str(e)}")
-        db.session.rollback()
-        
-        # Try to record the error on the inspection object if it exists
-        try:
-            # We need to fetch it again because rollback detached it
-            if 'inspection' in locals() and inspection.id:
-                insp = InspectionImage.query.get(inspection.id)
-                if insp:
-                    insp.result = InspectionResult.ERROR
-                    insp.ai_raw_response = str(e)
-                    db.session.commit()
-        except Exception as inner_e:
-            print(f"[UPLOAD_ERROR_RECOVERY_FAILED] {str(inner_e)}")
-
-        return jsonify({'message': f'Processing error: {str(e)}'}), 500
-    
-    # Refresh inspection object to ensure it's bound to session
-    db.session.refresh(inspection)
-    return jsonify(inspection.to_dict()), 201
+    inspection_queue.notify()
+
+    uploaded = [{**inspection.to_dict(), 'job': job.to_dict()} for inspection, job in zip(inspections, jobs)]
+    if len(uploaded) == 1:
+        return jsonify(uploaded[0]), 202
+    return jsonify({'images': uploaded}), 202
 
 
 @inspection_bp.route('/<int:image_id>/result', methods=['GET'])
@@ -273,6 +199,29 @@ def get_result(image_id):
     return jsonify(inspection.to_dict())
 
 
+@inspection_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    """Get background analysis job status"""
+    job = InspectionJob.query.get_or_404(job_id)
+    return jsonify({**job.to_dict(), 'inspection': job.image.to_dict() if job.image else None})
+
+
+@inspection_bp.route('/jobs/stats', methods=['GET'])
+@jwt_required()
+def get_job_stats():
+    """Inspection queue depth by status, result cache hit rate, upload rejections, vision API call and reply parsing metrics"""
+    claims = get_jwt()
+    if claims['role'] not in ['PROCUREMENT_MANAGER', 'ADMIN']:
+        return jsonify({'message': 'Procurement manager or admin access required'}), 403
+    from app.services.groq_client import groq_clients
+    from app.services.vision_scheduler import vision_scheduler
+    from app.services.model_output import model_output
+    return jsonify({**inspection_queue.stats(), 'resultCache': inspection_cache.stats(),
+                    'groqClients': groq_clients.stats(), 'visionScheduler': vision_scheduler.stats(),
+                    'modelOutput': model_output.stats(), 'qualityGate': quality_gate.stats()})
+
+
 @inspection_bp.route('/request/<int:request_id>', methods=['GET'])
 @jwt_required()
 def get_request_images(request_id):
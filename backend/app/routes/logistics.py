@@ -5,8 +5,12 @@ from app import db
 from app.models.request import ProductRequest, Reservation, RequestStatus
 from app.models.shipment import Shipment, ShipmentStatus
 from app.models.warehouse import Stock
+from app.services.reservation_ledger import reservation_ledger
+from app.models.ledger import LedgerReason
+from app.utils.log import get_logger
 
 logistics_bp = Blueprint('logistics', __name__)
+log = get_logger(__name__)
 
 
 @logistics_bp.route('/ready-for-allocation', methods=['GET'])
@@ -175,7 +179,17 @@ def update_shipment_status(shipment_id):
 
             # Release stock reservations and reduce actual stock quantities for completed sales
             for res in product_request.reservations:
-                if res.warehouse_id and not res.is_blocked:  # Only for successful reservations
+                if res.warehouse_id and not res.is_blocked and res.batches:
+                    # Consume exactly the batches the reservation was made from
+                    for stock, quantity in reservation_ledger.release_reservation(
+                        res, product_request.product_id, LedgerReason.RECEIVED
+                    ):
+                        stock.quantity = max(0, stock.quantity - quantity)
+                        log.info('stock_reduced', request_id=product_request.id, warehouse_id=res.warehouse_id,
+                                 product_id=product_request.product_id, stock_id=stock.id, batch=stock.batch_number,
+                                 quantity=quantity)
+                elif res.warehouse_id and not res.is_blocked:  # Only for successful reservations
+                    # Reservation predates batch tracking
                     # Find stock record - prefer records with available quantity first, then any matching record
                     stock = Stock.query.filter(
                         Stock.warehouse_id == res.warehouse_id,
@@ -192,9 +206,10 @@ def update_shipment_status(shipment_id):
 
                     if stock:
                         # Release the reservation and reduce actual stock
-                        stock.reserved_quantity = max(0, stock.reserved_quantity - res.quantity)
+                        reservation_ledger.release(stock, res.quantity, LedgerReason.RECEIVED, product_request.id)
                         stock.quantity = max(0, stock.quantity - res.quantity)
-                        print(f"[STOCK_REDUCTION] Reduced stock for warehouse {res.warehouse_id}, product {product_request.product_id}: reserved -{res.quantity}, quantity -{res.quantity}")
+                        log.info('stock_reduced', request_id=product_request.id, warehouse_id=res.warehouse_id,
+                                 product_id=product_request.product_id, stock_id=stock.id, quantity=res.quantity)
     
     db.session.commit()
     return jsonify(shipment.to_dict())
@@ -2,14 +2,19 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime
 from app import db
-from app.models.request import ProductRequest, Reservation, RequestStatus, ReservationStatus
+from app.models.request import ProductRequest, Reservation, ReservationBatch, RequestStatus, ReservationStatus
 from app.models.warehouse import Warehouse, Stock
 from app.models.supplier import Supplier, SupplierStock
 from app.models.inspection import InspectionImage, InspectionResult
-from app.services.source_completion import SourceCompletionService
+from app.services.source_completion import SourceCompletionService, COMPLETION_STATUSES
+from app.services.reservation_ledger import reservation_ledger
+from app.models.ledger import LedgerReason
 
 procurement_bp = Blueprint('procurement', __name__)
 
+# Most requests one GET /completion-status call returns
+COMPLETION_STATUS_MAX_REQUESTS = 500
+
 
 @procurement_bp.route('/pending', methods=['GET'])
 @jwt_required()
@@ -50,179 +55,163 @@ def resolve_issue(request_id):
     
     action = data.get('action')
     
-    if action == 'approve':
-        # Approve import/sourcing decision
-        product_request.status = RequestStatus.RESERVED
-        product_request.confirmed_at = datetime.utcnow()
-        product_request.procurement_notes = data.get('notes')
-        
-    elif action == 'replace':
-        # Replace blocked stock from another warehouse
-        # NOTE: Replacement creates a NEW reservation that must complete its own pickup/inspection
-        blocked_reservation_id = data.get('blockedReservationId')
-        new_warehouse_id = data.get('newWarehouseId')
-        quantity = data.get('quantity')
-
-        blocked_reservation = Reservation.query.get(blocked_reservation_id)
-        if not blocked_reservation:
-            return jsonify({'message': 'Blocked reservation not found'}), 404
-
-        # Release stock reservation from the original blocked warehouse
-        if blocked_reservation.warehouse_id:
-            original_stock = Stock.query.filter_by(
-                warehouse_id=blocked_reservation.warehouse_id,
-                product_id=product_request.product_id
-            ).first()
-            if original_stock:
-                original_stock.reserved_quantity = max(0, original_stock.reserved_quantity - quantity)
-
-        # Mark blocked reservation as BLOCKED status (will be replaced)
-        blocked_reservation.reservation_status = ReservationStatus.BLOCKED
-        blocked_reservation.procurement_resolved = True
-        blocked_reservation.procurement_resolved_at = datetime.utcnow()
-        blocked_reservation.procurement_resolution_notes = f"Replaced with warehouse {new_warehouse_id}"
-        
-        # Reduce blocked reservation quantity or delete if fully replaced
-        blocked_reservation.quantity -= quantity
-        if blocked_reservation.quantity <= 0:
-            # Soft delete: keep record but zero out quantity and mark as resolved
-            blocked_reservation.quantity = 0
-            blocked_reservation.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
-            # Do NOT delete, as it is referenced by new_reservation.original_reservation_id
-            # db.session.delete(blocked_reservation)
-
-        # Create new reservation from replacement warehouse
-        # NOTE: This new reservation starts at PENDING - must complete its own pickup + AI check
-        new_reservation = Reservation(
-            request_id=request_id,
-            warehouse_id=new_warehouse_id,
-            quantity=quantity,
-            is_local=True,
-            is_replacement=True,
-            original_reservation_id=blocked_reservation_id,
-            reservation_status=ReservationStatus.PENDING  # New source starts at PENDING
-        )
-        db.session.add(new_reservation)
-
-        # Update stock reservation for the new warehouse
-        new_stock = Stock.query.filter_by(
-            warehouse_id=new_warehouse_id,
-            product_id=product_request.product_id
-        ).first()
-        if new_stock:
-            new_stock.reserved_quantity += quantity
-
-        # Set request to WAITING_FOR_ALL_PICKUPS
-        # The new reservation must complete pickup + AI before logistics can begin
-        product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
-        product_request.procurement_notes = f"Replacement from warehouse {new_warehouse_id} assigned. Waiting for new source to complete pickup: {data.get('notes', '')}"
-        
-        # Trigger completion check (will stay in WAITING - new source not ready yet)
-        db.session.commit()
-        SourceCompletionService().check_all_sources_ready(request_id)
-        
-    elif action == 'import':
-        # Import shortfall from supplier with intelligent status assignment
-        supplier_id = data.get('supplierId')
-        quantity = data.get('quantity')
-
-        # Handle blocked reservation if specified
-        blocked_reservation_id = data.get('blockedReservationId')
-        if blocked_reservation_id:
-            blocked_reservation = Reservation.query.get(blocked_reservation_id)
-            if blocked_reservation:
+    # All changes below, including the Joint Wait completion check, commit once
+    source_completion = SourceCompletionService()
+    try:
+        with source_completion.transaction():
+            if action == 'approve':
+                # Approve import/sourcing decision
+                product_request.status = RequestStatus.RESERVED
+                product_request.confirmed_at = datetime.utcnow()
+                product_request.procurement_notes = data.get('notes')
+            
+            elif action == 'replace':
+                # Replace blocked stock from another warehouse
+                # NOTE: Replacement creates a NEW reservation that must complete its own pickup/inspection
+                blocked_reservation_id = data.get('blockedReservationId')
+                new_warehouse_id = data.get('newWarehouseId')
+                quantity = data.get('quantity')
+
+                blocked_reservation = Reservation.query.get(blocked_reservation_id)
+                if not blocked_reservation:
+                    return jsonify({'message': 'Blocked reservation not found'}), 404
+
+                # Release stock reservation from the original blocked warehouse
+                if blocked_reservation.warehouse_id:
+                    reservation_ledger.release_reservation(
+                        blocked_reservation, product_request.product_id, LedgerReason.REPLACE, quantity=quantity
+                    )
+
+                # Mark blocked reservation as BLOCKED status (will be replaced)
                 blocked_reservation.reservation_status = ReservationStatus.BLOCKED
                 blocked_reservation.procurement_resolved = True
                 blocked_reservation.procurement_resolved_at = datetime.utcnow()
-                blocked_reservation.procurement_resolution_notes = f"Replaced with import from supplier {supplier_id}"
-
-                # Soft delete blocked reservation
-                blocked_reservation.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
-                blocked_reservation.quantity = 0
-
-        # Use intelligent supplier reservation creation
-        sourcing_service = SourcingService()
-        new_reservation = sourcing_service.create_manual_supplier_reservation(
-            product_request, supplier_id, quantity
-        )
-
-        # Set replacement flag if applicable
-        if blocked_reservation_id:
-            new_reservation.is_replacement = True
-            new_reservation.original_reservation_id = blocked_reservation_id
-
-        # Determine status message based on auto-confirmation
-        supplier = Supplier.query.get(supplier_id)
-        if new_reservation.reservation_status == ReservationStatus.SUPPLIER_CONFIRMED:
-            status_msg = f"Auto-approved import from trusted supplier {supplier.name if supplier else supplier_id}"
-        else:
-            status_msg = f"Import from supplier {supplier.name if supplier else supplier_id} assigned. Waiting for supplier confirmation"
-
-        # Set request to WAITING_FOR_ALL_PICKUPS
-        # Note: If supplier was auto-confirmed, this might transition immediately
-        product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
-        product_request.procurement_notes = f"{status_msg}: {data.get('notes', '')}"
-
-        # Trigger completion check (may transition to READY_FOR_ALLOCATION if auto-confirmed)
-        db.session.commit()
-        SourceCompletionService().check_all_sources_ready(request_id)
-        
-    elif action == 'accept_damage':
-        # Accept damaged/low confidence items and proceed anyway
-        # Mark all blocked reservations as procurement-resolved
-        source_completion = SourceCompletionService()
-        
-        for res in product_request.reservations:
-            if res.is_blocked or res.reservation_status in [
-                ReservationStatus.AI_DAMAGED,
-                ReservationStatus.AI_LOW_CONFIDENCE
-            ]:
-                # Mark as procurement resolved - this counts as "ready"
-                res.is_blocked = False
-                res.block_reason = None
-                res.procurement_resolved = True
-                res.procurement_resolved_at = datetime.utcnow()
-                res.procurement_resolution_notes = f"Damage/issue accepted by manager: {data.get('notes', '')}"
-                res.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
-        
-        product_request.procurement_notes = f"Damage/issue accepted by manager: {data.get('notes', '')}"
-        
-        # Commit changes and then check if all sources are ready
-        db.session.commit()
-        
-        # Use SourceCompletionService to check if all sources ready
-        # This will transition to READY_FOR_ALLOCATION if all sources are complete
-        all_ready = source_completion.check_all_sources_ready(request_id)
-        
-        if not all_ready:
-            # Some sources still not ready, update status
-            product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
-            db.session.commit()
-        
-    elif action == 'reject':
-        # Release all stock reservations for this request
-        for reservation in product_request.reservations:
-            if reservation.warehouse_id:
-                stock = Stock.query.filter_by(
-                    warehouse_id=reservation.warehouse_id,
-                    product_id=product_request.product_id
-                ).first()
-                if stock:
-                    stock.reserved_quantity = max(0, stock.reserved_quantity - reservation.quantity)
-
-        # Reject the request
-        product_request.status = RequestStatus.CANCELLED
-        product_request.procurement_notes = data.get('notes')
-        
-    elif action == 'request_reupload':
-        # Request warehouse to re-upload images
-        product_request.status = RequestStatus.PICKING
-        product_request.procurement_notes = f"Re-upload requested: {data.get('notes', '')}"
-        
-    else:
-        return jsonify({'message': 'Invalid action'}), 400
+                blocked_reservation.procurement_resolution_notes = f"Replaced with warehouse {new_warehouse_id}"
+            
+                # Reduce blocked reservation quantity or delete if fully replaced
+                blocked_reservation.quantity -= quantity
+                if blocked_reservation.quantity <= 0:
+                    # Soft delete: keep record but zero out quantity and mark as resolved
+                    blocked_reservation.quantity = 0
+                    blocked_reservation.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
+                    # Do NOT delete, as it is referenced by new_reservation.original_reservation_id
+                    # db.session.delete(blocked_reservation)
+
+                # Create new reservation from replacement warehouse
+                # NOTE: This new reservation starts at PENDING - must complete its own pickup + AI check
+                new_reservation = Reservation(
+                    request_id=request_id,
+                    warehouse_id=new_warehouse_id,
+                    quantity=quantity,
+                    is_local=True,
+                    is_replacement=True,
+                    original_reservation_id=blocked_reservation_id,
+                    reservation_status=ReservationStatus.PENDING  # New source starts at PENDING
+                )
+                db.session.add(new_reservation)
+
+                # Update stock reservation for the new warehouse (earliest-expiring batches first)
+                reservation_ledger.reserve_reservation(new_reservation, product_request.product_id, LedgerReason.REPLACE)
+
+                # Set request to WAITING_FOR_ALL_PICKUPS
+                # The new reservation must complete pickup + AI before logistics can begin
+                product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+                product_request.procurement_notes = f"Replacement from warehouse {new_warehouse_id} assigned. Waiting for new source to complete pickup: {data.get('notes', '')}"
+            
+                # Trigger completion check (will stay in WAITING - new source not ready yet)
+                source_completion.check_all_sources_ready(request_id)
+            
+            elif action == 'import':
+                # Import shortfall from supplier with intelligent status assignment
+                supplier_id = data.get('supplierId')
+                quantity = data.get('quantity')
+
+                # Handle blocked reservation if specified
+                blocked_reservation_id = data.get('blockedReservationId')
+                if blocked_reservation_id:
+                    blocked_reservation = Reservation.query.get(blocked_reservation_id)
+                    if blocked_reservation:
+                        blocked_reservation.reservation_status = ReservationStatus.BLOCKED
+                        blocked_reservation.procurement_resolved = True
+                        blocked_reservation.procurement_resolved_at = datetime.utcnow()
+                        blocked_reservation.procurement_resolution_notes = f"Replaced with import from supplier {supplier_id}"
+
+                        # Soft delete blocked reservation
+                        blocked_reservation.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
+                        blocked_reservation.quantity = 0
+
+                # Use intelligent supplier reservation creation
+                sourcing_service = SourcingService()
+                new_reservation = sourcing_service.create_manual_supplier_reservation(
+                    product_request, supplier_id, quantity
+                )
+
+                # Set replacement flag if applicable
+                if blocked_reservation_id:
+                    new_reservation.is_replacement = True
+                    new_reservation.original_reservation_id = blocked_reservation_id
+
+                # Determine status message based on auto-confirmation
+                supplier = Supplier.query.get(supplier_id)
+                if new_reservation.reservation_status == ReservationStatus.SUPPLIER_CONFIRMED:
+                    status_msg = f"Auto-approved import from trusted supplier {supplier.name if supplier else supplier_id}"
+                else:
+                    status_msg = f"Import from supplier {supplier.name if supplier else supplier_id} assigned. Waiting for supplier confirmation"
+
+                # Set request to WAITING_FOR_ALL_PICKUPS
+                # Note: If supplier was auto-confirmed, this might transition immediately
+                product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+                product_request.procurement_notes = f"{status_msg}: {data.get('notes', '')}"
+
+                # Trigger completion check (may transition to READY_FOR_ALLOCATION if auto-confirmed)
+                source_completion.check_all_sources_ready(request_id)
+            
+            elif action == 'accept_damage':
+                # Accept damaged/low confidence items and proceed anyway
+                # Mark all blocked reservations as procurement-resolved
+                for res in product_request.reservations:
+                    if res.is_blocked or res.reservation_status in [
+                        ReservationStatus.AI_DAMAGED,
+                        ReservationStatus.AI_LOW_CONFIDENCE
+                    ]:
+                        # Mark as procurement resolved - this counts as "ready"
+                        res.is_blocked = False
+                        res.block_reason = None
+                        res.procurement_resolved = True
+                        res.procurement_resolved_at = datetime.utcnow()
+                        res.procurement_resolution_notes = f"Damage/issue accepted by manager: {data.get('notes', '')}"
+                        res.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
+            
+                product_request.procurement_notes = f"Damage/issue accepted by manager: {data.get('notes', '')}"
+            
+                # Use SourceCompletionService to check if all sources ready
+                # This will transition to READY_FOR_ALLOCATION if all sources are complete
+                all_ready = source_completion.check_all_sources_ready(request_id)
+            
+                if not all_ready:
+                    # Some sources still not ready, update status
+                    product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+            
+            elif action == 'reject':
+                # Release all stock reservations for this request
+                for reservation in product_request.reservations:
+                    if reservation.warehouse_id:
+                        reservation_ledger.release_reservation(reservation, product_request.product_id, LedgerReason.REJECT)
+
+                # Reject the request
+                product_request.status = RequestStatus.CANCELLED
+                product_request.procurement_notes = data.get('notes')
+            
+            elif action == 'request_reupload':
+                # Request warehouse to re-upload images
+                product_request.status = RequestStatus.PICKING
+                product_request.procurement_notes = f"Re-upload requested: {data.get('notes', '')}"
+            
+            else:
+                return jsonify({'message': 'Invalid action'}), 400
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 409
     
-    db.session.commit()
     return jsonify(product_request.to_dict())
 
 
@@ -257,6 +246,40 @@ def get_replacement_options(request_id):
     })
 
 
+@procurement_bp.route('/completion-status', methods=['GET'])
+@jwt_required()
+def list_completion_status():
+    """
+    Source completion status for many requests in one call (dashboards).
+    
+    Query: ids=1,2,3 or status=WAITING_FOR_ALL_PICKUPS[,PARTIALLY_BLOCKED];
+    limit caps the number of requests (default and max 500).
+    """
+    claims = get_jwt()
+    
+    if claims['role'] not in ['PROCUREMENT_MANAGER', 'WAREHOUSE_OPERATOR', 'LOGISTICS_PLANNER']:
+        return jsonify({'message': 'Access denied'}), 403
+    
+    try:
+        limit = min(max(int(request.args.get('limit', COMPLETION_STATUS_MAX_REQUESTS)), 1), COMPLETION_STATUS_MAX_REQUESTS)
+        ids = request.args.get('ids')
+        if ids:
+            request_ids = list(dict.fromkeys(int(i) for i in ids.split(',') if i.strip()))[:limit]
+        else:
+            statuses = request.args.get('status')
+            query = db.session.query(ProductRequest.id)
+            if statuses:
+                query = query.filter(ProductRequest.status.in_([RequestStatus(s) for s in statuses.split(',')]))
+            else:
+                query = query.filter(ProductRequest.status.in_(COMPLETION_STATUSES))
+            request_ids = [request_id for (request_id,) in query.order_by(ProductRequest.id.desc()).limit(limit)]
+    except ValueError:
+        return jsonify({'message': 'Invalid ids, status or limit'}), 400
+    
+    statuses_by_id = SourceCompletionService().get_completion_status_many(request_ids)
+    return jsonify([statuses_by_id[request_id] for request_id in request_ids if request_id in statuses_by_id])
+
+
 @procurement_bp.route('/completion-status/<int:request_id>', methods=['GET'])
 @jwt_required()
 def get_completion_status(request_id):
@@ -323,14 +346,15 @@ def auto_resolve_blocked(request_id):
     damaged_reservations = Reservation.query.filter_by(request_id=request_id).all()
     for reservation in damaged_reservations:
         if reservation.warehouse_id:
-            stock = Stock.query.filter_by(
-                warehouse_id=reservation.warehouse_id,
-                product_id=product_request.product_id
-            ).first()
-            if stock:
-                stock.reserved_quantity = max(0, stock.reserved_quantity - reservation.quantity)
+            reservation_ledger.release_reservation(reservation, product_request.product_id, LedgerReason.AUTO_RESOLVE)
 
+    db.session.flush()
+    ReservationBatch.query.filter(
+        ReservationBatch.reservation_id.in_([r.id for r in damaged_reservations])
+    ).delete(synchronize_session=False)
     Reservation.query.filter_by(request_id=request_id).delete()
+    product_request.sources_total = 0  # The bulk delete bypasses the flush listener
+    product_request.sources_ready = 0
 
     # Get the sourcing recommendation and create full import reservations
     from app.services.sourcing import SourcingService
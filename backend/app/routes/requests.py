@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
 from app import db
@@ -6,11 +6,28 @@ from app.models.request import ProductRequest, Reservation, RequestStatus, Sourc
 from app.models.product import Product
 from app.models.warehouse import Warehouse, Stock
 from app.models.supplier import Supplier, SupplierStock
-from app.services.sourcing import SourcingService
+from app.services.sourcing import SourcingService, reservation_metrics
+from app.services.availability import availability_index
+from app.services.recommendation_cache import recommendation_cache
+from app.services.reservation_ledger import reservation_ledger
+from app.models.ledger import LedgerReason
 
 requests_bp = Blueprint('requests', __name__)
 
 
+def _apply_recommendation(product_request, recommendation):
+    """Store recommended source, explanation and ETA on a request"""
+    product_request.recommended_source = recommendation['source_type']
+    product_request.recommendation_explanation = recommendation['explanation']
+
+    # Calculate estimated delivery date
+    max_days = 0
+    if recommendation['allocationPlan']:
+        max_days = max(a['estimatedDays'] for a in recommendation['allocationPlan'])
+
+    product_request.estimated_delivery_date = datetime.utcnow().date() + timedelta(days=max_days)
+
+
 @requests_bp.route('', methods=['GET'])
 @jwt_required()
 def get_requests():
@@ -69,7 +86,8 @@ def get_request(request_id):
     """Get a single request by ID"""
     product_request = ProductRequest.query.options(
         db.selectinload(ProductRequest.reservations).selectinload(Reservation.warehouse),
-        db.selectinload(ProductRequest.reservations).selectinload(Reservation.supplier)
+        db.selectinload(ProductRequest.reservations).selectinload(Reservation.supplier),
+        db.selectinload(ProductRequest.reservations).selectinload(Reservation.batches)
     ).get_or_404(request_id)
     return jsonify(product_request.to_dict())
 
@@ -117,15 +135,7 @@ def create_request():
     sourcing_service = SourcingService()
     recommendation = sourcing_service.get_recommendation(product_request)
     
-    product_request.recommended_source = recommendation['source_type']
-    product_request.recommendation_explanation = recommendation['explanation']
-    
-    # Calculate estimated delivery date
-    max_days = 0
-    if recommendation['allocationPlan']:
-        max_days = max(a['estimatedDays'] for a in recommendation['allocationPlan'])
-    
-    product_request.estimated_delivery_date = datetime.utcnow().date() + timedelta(days=max_days)
+    _apply_recommendation(product_request, recommendation)
     product_request.status = RequestStatus.AWAITING_RECOMMENDATION
     
     db.session.commit()
@@ -142,12 +152,135 @@ def get_recommendation(request_id):
     """Get sourcing recommendation for a request"""
     product_request = ProductRequest.query.get_or_404(request_id)
     
-    sourcing_service = SourcingService()
+    try:
+        sourcing_service = SourcingService(strategy=request.args.get('strategy'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     recommendation = sourcing_service.get_recommendation(product_request)
     
     return jsonify(recommendation)
 
 
+@requests_bp.route('/recommendations/batch', methods=['POST'])
+@jwt_required()
+def get_recommendations_batch():
+    """
+    Re-run sourcing recommendations for many requests in one pass.
+
+    Body: {"requestIds": [...]} or {"status": "PENDING"}; set "apply": true
+    to store the new recommendation and ETA on each request. An optional
+    "strategy" selects the allocation strategy ('greedy' or 'weighted').
+    """
+    claims = get_jwt()
+    if claims['role'] not in ['PROCUREMENT_MANAGER', 'ADMIN']:
+        return jsonify({'message': 'Procurement manager or admin access required'}), 403
+
+    data = request.get_json() or {}
+    request_ids = data.get('requestIds')
+
+    if request_ids is not None:
+        if not isinstance(request_ids, list) or not request_ids or any(
+                not isinstance(i, int) or isinstance(i, bool) for i in request_ids):
+            return jsonify({'message': 'requestIds must be a non-empty list of integers'}), 400
+        max_ids = current_app.config.get('RECOMMENDATION_BATCH_MAX_IDS', 1000)
+        if len(request_ids) > max_ids:
+            return jsonify({'message': f'At most {max_ids} requestIds per batch'}), 400
+
+    query = ProductRequest.query
+    if request_ids is not None:
+        query = query.filter(ProductRequest.id.in_(request_ids))
+    else:
+        statuses = data.get('status') or [RequestStatus.PENDING.value, RequestStatus.AWAITING_RECOMMENDATION.value]
+        if isinstance(statuses, str):
+            statuses = [statuses]
+        try:
+            query = query.filter(ProductRequest.status.in_([RequestStatus(s) for s in statuses]))
+        except ValueError:
+            return jsonify({'message': 'Invalid status'}), 400
+
+    try:
+        sourcing_service = SourcingService(strategy=data.get('strategy'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    product_requests = query.order_by(ProductRequest.id).all()
+    recommendations = sourcing_service.get_recommendations(product_requests)
+
+    apply = bool(data.get('apply'))
+    if apply:
+        for product_request in product_requests:
+            _apply_recommendation(product_request, recommendations[product_request.id])
+        db.session.commit()
+
+    return jsonify({
+        'count': len(recommendations),
+        'applied': apply,
+        'recommendations': {str(request_id): rec for request_id, rec in recommendations.items()}
+    })
+
+
+@requests_bp.route('/simulate', methods=['POST'])
+@jwt_required()
+def simulate_sourcing():
+    """
+    What-if sourcing without creating requests or reservations.
+
+    Body: {"lines": [{"productId": 1, "quantity": 10000, "city": "Madurai"}, ...],
+    "strategy": "greedy"}. Lines consume availability in order.
+    """
+    claims = get_jwt()
+    if claims['role'] not in ['PROCUREMENT_MANAGER', 'ADMIN']:
+        return jsonify({'message': 'Procurement manager or admin access required'}), 403
+
+    data = request.get_json() or {}
+    lines = data.get('lines')
+    if not isinstance(lines, list) or not lines:
+        return jsonify({'message': 'lines must be a non-empty list'}), 400
+
+    max_lines = current_app.config.get('SIMULATION_MAX_LINES', 5000)
+    if len(lines) > max_lines:
+        return jsonify({'message': f'At most {max_lines} lines per simulation'}), 400
+
+    for index, line in enumerate(lines):
+        if not isinstance(line, dict):
+            return jsonify({'message': f'Line {index}: must be an object'}), 400
+        product_id = line.get('productId')
+        quantity = line.get('quantity')
+        if not isinstance(product_id, int) or isinstance(product_id, bool):
+            return jsonify({'message': f'Line {index}: productId must be an integer'}), 400
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            return jsonify({'message': f'Line {index}: quantity must be a positive integer'}), 400
+
+    product_ids = {line['productId'] for line in lines}
+    known_ids = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(product_ids)).all()}
+    unknown_ids = sorted(product_ids - known_ids)
+    if unknown_ids:
+        return jsonify({'message': f'Unknown product ids: {unknown_ids}'}), 400
+
+    try:
+        sourcing_service = SourcingService(strategy=data.get('strategy'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    return jsonify(sourcing_service.simulate(lines))
+
+
+@requests_bp.route('/reservations/metrics', methods=['GET'])
+@jwt_required()
+def get_reservation_metrics():
+    """Reservation retry/contention counters for this worker process"""
+    claims = get_jwt()
+    if claims['role'] not in ['PROCUREMENT_MANAGER', 'ADMIN']:
+        return jsonify({'message': 'Procurement manager or admin access required'}), 403
+
+    return jsonify({
+        'mode': current_app.config.get('RESERVATION_MODE', 'locking'),
+        'modes': reservation_metrics.snapshot(),
+        'availabilityIndex': availability_index.stats(),
+        'recommendationCache': recommendation_cache.stats()
+    })
+
+
 @requests_bp.route('/<int:request_id>/confirm', methods=['POST'])
 @jwt_required()
 def confirm_request(request_id):
@@ -165,7 +298,10 @@ def confirm_request(request_id):
     if action == 'confirm':
         # Create reservations based on recommendation
         sourcing_service = SourcingService()
-        reservations = sourcing_service.create_reservations(product_request)
+        try:
+            reservations = sourcing_service.create_reservations(product_request)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 409
         
         product_request.status = RequestStatus.RESERVED
         product_request.confirmed_at = datetime.utcnow()
@@ -178,12 +314,7 @@ def confirm_request(request_id):
         # Release all stock reservations for this request
         for reservation in product_request.reservations:
             if reservation.warehouse_id:
-                stock = Stock.query.filter_by(
-                    warehouse_id=reservation.warehouse_id,
-                    product_id=product_request.product_id
-                ).first()
-                if stock:
-                    stock.reserved_quantity = max(0, stock.reserved_quantity - reservation.quantity)
+                reservation_ledger.release_reservation(reservation, product_request.product_id, LedgerReason.CANCEL)
 
         product_request.status = RequestStatus.CANCELLED
         
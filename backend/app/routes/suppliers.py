@@ -4,8 +4,10 @@ from app import db
 from app.models.supplier import Supplier, SupplierStock
 from app.models.product import Product
 from app.models.user import User, Role
+from app.utils.log import get_logger
 
 suppliers_bp = Blueprint('suppliers', __name__)
+log = get_logger(__name__)
 
 
 @suppliers_bp.route('', methods=['GET'])
@@ -229,20 +231,15 @@ def confirm_availability(reservation_id):
     data = request.get_json() or {}
     notes = data.get('notes', '')
     
-    # Mark as confirmed
-    reservation.reservation_status = ReservationStatus.SUPPLIER_CONFIRMED
-    
-    db.session.commit()
-    
-    print(f"[SUPPLIER] Reservation {reservation_id} confirmed by supplier {user.assigned_supplier_id}")
-    
-    # Trigger source completion check
+    # Mark as confirmed and trigger source completion check in one transaction
     # This will transition request to READY_FOR_ALLOCATION if ALL sources ready
     source_completion = SourceCompletionService()
-    all_ready = source_completion.check_all_sources_ready(reservation.request_id)
+    with source_completion.transaction():
+        reservation.reservation_status = ReservationStatus.SUPPLIER_CONFIRMED
+        all_ready = source_completion.check_all_sources_ready(reservation.request_id)
     
-    if all_ready:
-        print(f"[SUPPLIER] Request {reservation.request_id} ALL SOURCES READY - transitioned to READY_FOR_ALLOCATION")
+    log.info('reservation_confirmed', reservation_id=reservation_id, supplier_id=user.assigned_supplier_id,
+             request_id=reservation.request_id, all_sources_ready=all_ready)
     
     # Return updated reservation with completion status
     completion_status = source_completion.get_completion_status(reservation.request_id)
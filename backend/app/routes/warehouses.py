@@ -5,8 +5,11 @@ from sqlalchemy import or_
 from app import db
 from app.models.warehouse import Warehouse, Stock
 from app.models.product import Product
+from app.services.reservation_ledger import reservation_ledger
+from app.utils.log import get_logger
 
 warehouses_bp = Blueprint('warehouses', __name__)
+log = get_logger(__name__)
 
 
 @warehouses_bp.route('', methods=['GET'])
@@ -64,12 +67,9 @@ def create_warehouse():
 @jwt_required()
 def get_warehouse_stock(warehouse_id):
     """Get stock levels for a warehouse"""
-    print(f"[WAREHOUSE_STOCK] Getting stock for warehouse {warehouse_id}")
     warehouse = Warehouse.query.get_or_404(warehouse_id)
     stocks = Stock.query.filter_by(warehouse_id=warehouse_id).all()
-    print(f"[WAREHOUSE_STOCK] Found {len(stocks)} stock records")
-    for stock in stocks:
-        print(f"[WAREHOUSE_STOCK] Stock ID {stock.id}: product {stock.product_id}, quantity {stock.quantity}, reserved {stock.reserved_quantity}")
+    log.debug('stock_listed', sampled=True, warehouse_id=warehouse_id, rows=len(stocks))
     return jsonify([s.to_dict() for s in stocks])
 
 
@@ -135,7 +135,7 @@ def update_stock(warehouse_id):
     if available_quantity is not None and available_quantity != '':
         # User specified available quantity - adjust reserved_quantity accordingly
         desired_available = int(available_quantity)
-        stock.reserved_quantity = max(0, quantity - desired_available)
+        reservation_ledger.set_reserved(stock, max(0, quantity - desired_available))
     # If no available quantity specified, keep existing reserved_quantity
 
     stock.location_code = data.get('locationCode')
@@ -19,6 +19,7 @@ from app.models.supplier import Supplier
 from app.models.shipment import Shipment
 from app.models.chat import ChatSession, ChatMessage
 from app.services.encryption import EncryptionService
+from app.services.groq_client import groq_clients
 
 
 class AIAssistantService:
@@ -60,8 +61,7 @@ class AIAssistantService:
             }
         
         try:
-            from groq import Groq
-            client = Groq(api_key=self.api_key)
+            client = groq_clients.get(self.api_key)
             
             # Get conversation history from DB
             history = self._get_conversation_history(session_id)
@@ -0,0 +1,282 @@
+"""
+Allocation strategies for SourcingService
+
+A strategy turns the available local (warehouse) and import (supplier)
+options for a product into an allocation plan for a requested quantity.
+Options are the plain dicts produced by SourcingService._local_option /
+_import_option; strategies must not mutate them. A local option covers
+all usable batches of the product in one warehouse; local_allocation()
+splits its quantity across them first-expiry-first-out.
+
+- GreedyAllocationStrategy: the original fixed walk (import if faster,
+  else Madurai/Coimbatore slots of 50, other warehouses, then suppliers)
+- WeightedAllocationStrategy: minimises a weighted objective over lead
+  time, unit price, supplier reliability and number of split sources
+"""
+
+import numpy as np
+
+
+def local_allocation(option: dict, quantity: int) -> dict:
+    """Allocation plan line for a warehouse option, split across its batches first-expiry-first-out"""
+    return {
+        'source': 'local',
+        'warehouseId': option['warehouseId'],
+        'warehouseCode': option.get('warehouseCode'),
+        'warehouseName': option['warehouseName'],
+        'warehouseCity': option['warehouseCity'],
+        'quantity': quantity,
+        'estimatedDays': option['deliveryDays'],
+        'batches': fefo_batches(option['batches'], quantity)
+    }
+
+
+def fefo_batches(batches: list, quantity: int) -> list:
+    """Take quantity from batches in the given (expiry) order"""
+    taken = []
+    remaining = quantity
+    for batch in batches:
+        if remaining <= 0:
+            break
+        batch_qty = min(batch['available'], remaining)
+        if batch_qty > 0:
+            taken.append({
+                'stockId': batch['stockId'],
+                'batchNumber': batch['batchNumber'],
+                'expiryDate': batch['expiryDate'],
+                'quantity': batch_qty
+            })
+            remaining -= batch_qty
+    return taken
+
+
+def import_allocation(option: dict, quantity: int) -> dict:
+    """Allocation plan line for a supplier option"""
+    return {
+        'source': 'import',
+        'supplierId': option['supplierId'],
+        'supplierName': option['supplierName'],
+        'supplierCountry': option['supplierCountry'],
+        'quantity': quantity,
+        'estimatedDays': option['leadTimeDays'],
+        'unitPrice': option.get('unitPrice', 0),
+        'currency': option.get('currency')
+    }
+
+
+class AllocationStrategy:
+    """Base class for allocation strategies"""
+
+    name = None
+
+    def allocate(self, requested_qty: int, local_options: list, import_options: list) -> tuple:
+        """
+        Build an allocation plan.
+
+        Returns (allocation_plan, prefer_import_due_to_speed).
+        """
+        raise NotImplementedError
+
+
+class GreedyAllocationStrategy(AllocationStrategy):
+    """
+    Fixed greedy walk.
+
+    Priority 1: Compare lead times - prefer faster option even if more expensive
+    - If local stock available but supplier is faster -> IMPORT
+    - If all suppliers slower than local -> LOCAL
+    - If partial local stock -> compare remaining with imports
+
+    When the options carry transit times for the delivery city they arrive
+    nearest-first and are walked in that order; the fixed Madurai/Coimbatore
+    slots only apply when there is no distance information.
+    """
+
+    name = 'greedy'
+    preferred_cities = ('madurai', 'coimbatore')
+    preferred_city_quantity = 50
+
+    def allocate(self, requested_qty: int, local_options: list, import_options: list) -> tuple:
+        total_import_available = sum(s['available'] for s in import_options)
+
+        local_max_days = max((s['deliveryDays'] for s in local_options), default=float('inf'))
+        import_min_days = min((s['leadTimeDays'] for s in import_options), default=float('inf'))
+
+        # Priority 1: Speed comparison
+        prefer_import_due_to_speed = (
+            import_min_days < local_max_days and
+            total_import_available >= requested_qty
+        )
+
+        allocation_plan = []
+        remaining_qty = requested_qty
+
+        if prefer_import_due_to_speed:
+            # Import is faster, use import even if local stock available
+            for supplier_stock in import_options:
+                if remaining_qty <= 0:
+                    break
+                alloc_qty = min(supplier_stock['available'], remaining_qty)
+                allocation_plan.append(import_allocation(supplier_stock, alloc_qty))
+                remaining_qty -= alloc_qty
+            return allocation_plan, prefer_import_due_to_speed
+
+        distance_aware = any(s.get('transitDays') is not None for s in local_options)
+        preferred_cities = () if distance_aware else self.preferred_cities
+
+        # Local is viable, allocate fixed slots from specific warehouses (Madurai, then Coimbatore)
+        for city in preferred_cities:
+            city_stock = next((s for s in local_options if (s['warehouseCity'] or '').lower() == city), None)
+            if city_stock and remaining_qty > 0:
+                alloc_qty = min(self.preferred_city_quantity, city_stock['available'], remaining_qty)
+                if alloc_qty > 0:
+                    allocation_plan.append(local_allocation(city_stock, alloc_qty))
+                    remaining_qty -= alloc_qty
+
+        # If still remaining quantity, allocate from other warehouses
+        if remaining_qty > 0:
+            for stock in local_options:
+                # Skip preferred cities as we already allocated to them
+                if (stock['warehouseCity'] or '').lower() in preferred_cities:
+                    continue
+                if remaining_qty <= 0:
+                    break
+                alloc_qty = min(stock['available'], remaining_qty)
+                if alloc_qty > 0:
+                    allocation_plan.append(local_allocation(stock, alloc_qty))
+                    remaining_qty -= alloc_qty
+
+        # If still remaining, allocate from suppliers
+        if remaining_qty > 0:
+            for supplier_stock in import_options:
+                if remaining_qty <= 0:
+                    break
+                alloc_qty = min(supplier_stock['available'], remaining_qty)
+                allocation_plan.append(import_allocation(supplier_stock, alloc_qty))
+                remaining_qty -= alloc_qty
+
+        return allocation_plan, prefer_import_due_to_speed
+
+
+class WeightedAllocationStrategy(AllocationStrategy):
+    """
+    Weighted cost / lead-time solver.
+
+    Every candidate source gets a per-unit score
+        lead_weight * lead_time / max_lead_time
+      + price_weight * unit_price / max_unit_price
+      + reliability_weight * (1 - reliability)
+    where warehouse stock counts as already paid for (price 0) and fully
+    reliable. A plan's objective is its quantity-weighted average score,
+    plus eta_weight * (slowest source lead time / max_lead_time) and
+    split_weight for every source beyond the first.
+
+    The linear part is minimised exactly by filling sources in score order;
+    the ETA and split terms are handled by also evaluating, with NumPy over
+    all candidates at once, the same fill restricted to each lead-time
+    ceiling and the best single source able to cover the whole quantity.
+    The cheapest feasible plan wins.
+    """
+
+    name = 'weighted'
+
+    def __init__(self, lead_weight=1.0, price_weight=0.5, reliability_weight=0.5,
+                 eta_weight=1.0, split_weight=0.05):
+        self.lead_weight = lead_weight
+        self.price_weight = price_weight
+        self.reliability_weight = reliability_weight
+        self.eta_weight = eta_weight
+        self.split_weight = split_weight
+
+    def allocate(self, requested_qty: int, local_options: list, import_options: list) -> tuple:
+        options = list(local_options) + list(import_options)
+        if not options or requested_qty <= 0:
+            return [], False
+
+        n_local = len(local_options)
+        available = np.fromiter((o['available'] for o in options), dtype=np.int64, count=len(options))
+        lead = np.fromiter(
+            (o['deliveryDays'] if i < n_local else o['leadTimeDays'] for i, o in enumerate(options)),
+            dtype=np.float64, count=len(options)
+        )
+        price = np.zeros(len(options))
+        reliability = np.ones(len(options))
+        if import_options:
+            price[n_local:] = [o.get('unitPrice') or 0 for o in import_options]
+            reliability[n_local:] = [o.get('reliability', 0.8) for o in import_options]
+
+        lead_scale = lead.max() or 1.0
+        price_scale = price.max() or 1.0
+        lead_norm = lead / lead_scale
+        score = (
+            self.lead_weight * lead_norm
+            + self.price_weight * price / price_scale
+            + self.reliability_weight * (1.0 - reliability)
+        )
+
+        target = min(requested_qty, int(available.sum()))
+        order = np.argsort(score, kind='stable')
+
+        candidates = []
+
+        # Fill in score order, optionally restricted to sources at or under a lead-time ceiling
+        for ceiling in np.unique(lead):
+            eligible = order[lead[order] <= ceiling]
+            if available[eligible].sum() < target:
+                continue
+            candidates.append(self._fill(eligible, available, target))
+
+        # Best single source that covers the whole quantity on its own (no split penalty)
+        covering = np.flatnonzero(available >= target)
+        if covering.size:
+            single_cost = score[covering] + self.eta_weight * lead_norm[covering]
+            quantities = np.zeros(len(options), dtype=np.int64)
+            quantities[covering[np.argmin(single_cost)]] = target
+            candidates.append(quantities)
+
+        best = min(candidates, key=lambda q: self._objective(q, score, lead_norm, target))
+
+        allocation_plan = []
+        for index in order:
+            quantity = int(best[index])
+            if quantity <= 0:
+                continue
+            option = options[index]
+            if index < n_local:
+                allocation_plan.append(local_allocation(option, quantity))
+            else:
+                allocation_plan.append(import_allocation(option, quantity))
+
+        return allocation_plan, False
+
+    @staticmethod
+    def _fill(indices, available, target):
+        """Take from indices in order until target is reached"""
+        quantities = np.zeros(len(available), dtype=np.int64)
+        taken = np.minimum(available[indices], np.maximum(target - (np.cumsum(available[indices]) - available[indices]), 0))
+        quantities[indices] = taken
+        return quantities
+
+    def _objective(self, quantities, score, lead_norm, target):
+        used = quantities > 0
+        if not used.any():
+            return float('inf')
+        return (
+            float(quantities @ score) / target
+            + self.eta_weight * float(lead_norm[used].max())
+            + self.split_weight * (int(used.sum()) - 1)
+        )
+
+
+STRATEGIES = {
+    GreedyAllocationStrategy.name: GreedyAllocationStrategy,
+    WeightedAllocationStrategy.name: WeightedAllocationStrategy,
+}
+
+
+def get_strategy(name: str = None) -> AllocationStrategy:
+    """Instantiate a registered strategy by name (defaults to greedy)"""
+    strategy_cls = STRATEGIES.get(name or GreedyAllocationStrategy.name)
+    if strategy_cls is None:
+        raise ValueError(f"Unknown allocation strategy: {name}")
+    return strategy_cls()
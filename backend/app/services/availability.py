@@ -0,0 +1,147 @@
+"""
+AvailabilityIndex - per-process sourcing availability cache
+
+Holds, per product, the pre-sorted local (warehouse) and import (supplier)
+options that SourcingService allocates from, with lead times already
+resolved from Warehouse.local_delivery_days and SupplierStock.lead_time_days.
+
+Entries are invalidated incrementally: a session listener records which
+products had Stock/SupplierStock rows flushed and drops exactly those
+entries once the transaction commits. Changes to a Warehouse or Supplier
+(names, delivery/lead times) drop the whole index. A TTL bounds staleness
+caused by writes made in other worker processes.
+"""
+
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+_PENDING_KEY = 'availability_index_pending'
+_ALL = object()
+
+
+class AvailabilityIndex:
+    """Product id -> (local_options, import_options), loaded lazily"""
+
+    def __init__(self, ttl_seconds: float = 300):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # product_id -> (loaded_at, local_options, import_options)
+        self._versions = {}  # product_id -> int, bumped on every invalidation
+        self._generation = 0  # bumped when the whole index is dropped
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl_seconds = app.config.get('AVAILABILITY_INDEX_TTL', self.ttl_seconds)
+
+    def get_many(self, product_ids, loader) -> dict:
+        """
+        Return availability for the given products.
+
+        Missing or expired entries are loaded with one call to loader(product_ids),
+        which must return {product_id: (local_options, import_options)}.
+        The returned option lists are shared and must not be mutated.
+        """
+        now = time.monotonic()
+        result = {}
+        missing = []
+
+        with self._lock:
+            for product_id in set(product_ids):
+                entry = self._entries.get(product_id)
+                if entry and (not self.ttl_seconds or now - entry[0] < self.ttl_seconds):
+                    result[product_id] = (entry[1], entry[2])
+                else:
+                    missing.append(product_id)
+            versions = {product_id: self._versions.get(product_id, 0) for product_id in missing}
+            generation = self._generation
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for product_id in missing:
+                    local_options, import_options = loaded.get(product_id, ([], []))
+                    result[product_id] = (local_options, import_options)
+                    # Don't cache a snapshot that was invalidated while it was loading
+                    if self._generation == generation and self._versions.get(product_id, 0) == versions[product_id]:
+                        self._entries[product_id] = (now, local_options, import_options)
+
+        return result
+
+    def get(self, product_id: int, loader) -> tuple:
+        return self.get_many([product_id], loader)[product_id]
+
+    def version(self, product_id: int) -> tuple:
+        """Opaque token that changes whenever the product's availability may have changed"""
+        with self._lock:
+            return (self._generation, self._versions.get(product_id, 0))
+
+    def invalidate(self, product_ids=None):
+        """Drop entries for the given products, or the whole index if None"""
+        with self._lock:
+            if product_ids is None:
+                self._entries.clear()
+                self._generation += 1
+                return
+            for product_id in product_ids:
+                self._entries.pop(product_id, None)
+                self._versions[product_id] = self._versions.get(product_id, 0) + 1
+
+    def track(self, session, product_ids=None):
+        """
+        Invalidate the given products (or everything) when session commits.
+
+        Use this after bulk UPDATE/INSERT statements, which bypass the
+        flush listener.
+        """
+        pending = session.info.setdefault(_PENDING_KEY, set())
+        if product_ids is None:
+            pending.add(_ALL)
+        else:
+            pending.update(product_ids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'products': len(self._entries),
+                'generation': self._generation,
+                'ttlSeconds': self.ttl_seconds
+            }
+
+
+availability_index = AvailabilityIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_products(session, flush_context):
+    from app.models.warehouse import Warehouse, Stock
+    from app.models.supplier import Supplier, SupplierStock
+
+    product_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Stock, SupplierStock)):
+            history = inspect(obj).attrs.product_id.history
+            product_ids.update(pid for pid in history.sum() if pid is not None)
+            if obj.product_id is not None:
+                product_ids.add(obj.product_id)
+        elif isinstance(obj, (Warehouse, Supplier)) and session.is_modified(obj, include_collections=False):
+            availability_index.track(session)
+
+    if product_ids:
+        availability_index.track(session, product_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if _ALL in pending:
+        availability_index.invalidate()
+    else:
+        availability_index.invalidate(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,200 @@
+"""
+CompletionSweeper - moves stranded requests to READY_FOR_ALLOCATION in bulk
+
+A request can end up with every source ready while still sitting in PICKING,
+INSPECTION_PENDING etc. (a crash between the reservation update and the
+completion check, a manual database fix, or counters written before
+migrate_source_counters.py). Instead of looping over requests in Python like
+fix_stuck_requests.py, each sweep batch is three statements:
+
+1. one aggregate SELECT over reservations for requests in a completion status
+   whose quantity > 0 reservations all satisfy Reservation.source_ready_clause()
+   (requests left with only zero-quantity reservations qualify too, as in
+   SourceCompletionService.check_all_sources_ready)
+2. one UPDATE marking the ready reservations counted_as_ready
+3. one UPDATE moving the requests to READY_FOR_ALLOCATION and resetting their
+   source counters
+
+Both UPDATEs re-apply the readiness rule instead of trusting the SELECT: the
+reservation UPDATE only touches ready rows, and the request UPDATE is guarded
+by the status and by NOT EXISTS on a quantity > 0 reservation that is not
+ready, so a reservation blocked, added or un-picked after step 1 keeps its
+request waiting.
+
+A daemon thread sweeps every COMPLETION_SWEEP_SECONDS (0 = off), starting with
+the first HTTP request or from inspection_worker.py. Batches hold at most
+COMPLETION_SWEEP_BATCH requests and one sweep runs at most
+COMPLETION_SWEEP_MAX_BATCHES of them.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, or_, select, update
+
+from app import db
+from app.models.request import ProductRequest, Reservation, RequestStatus
+from app.services.source_completion import COMPLETION_STATUSES
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+def _not_ready():
+    """Negation of Reservation.source_ready_clause() that treats NULL as not ready"""
+    return func.coalesce(Reservation.source_ready_clause(), False) == False
+
+
+class CompletionSweeper:
+    """Periodic set-based completion check with counters of what it fixed"""
+
+    def __init__(self, interval_seconds: float = 300, batch_size: int = 500, max_batches: int = 20):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.sweeps = 0
+        self.fixed = 0
+        self.last_sweep_at = None
+        self.last_fixed = 0
+        self.last_duration_ms = 0.0
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self._app = app
+        self.interval_seconds = app.config.get('COMPLETION_SWEEP_SECONDS', self.interval_seconds)
+        self.batch_size = app.config.get('COMPLETION_SWEEP_BATCH', self.batch_size)
+        self.max_batches = app.config.get('COMPLETION_SWEEP_MAX_BATCHES', self.max_batches)
+        if self.interval_seconds > 0:
+            app.before_request(self.start)
+
+    def start(self):
+        """Start the sweep thread (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None or self.interval_seconds <= 0:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='completion-sweeper', daemon=True)
+            self._thread.start()
+            log.info('sweeper_started', interval_seconds=self.interval_seconds)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join(timeout)
+
+    def _run(self):
+        with self._app.app_context():
+            while not self._stopping.wait(self.interval_seconds):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    log.error('sweep_failed', error=str(e))
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def candidates(self, limit: int) -> list:
+        """Ids of requests in a completion status whose sources are all ready"""
+        not_ready = func.sum(case((and_(Reservation.quantity > 0, _not_ready()), 1), else_=0))
+        return list(db.session.scalars(
+            select(Reservation.request_id)
+            .join(ProductRequest, ProductRequest.id == Reservation.request_id)
+            .where(ProductRequest.status.in_(COMPLETION_STATUSES))
+            .group_by(Reservation.request_id)
+            .having(not_ready == 0)
+            .order_by(Reservation.request_id)
+            .limit(limit)
+        ))
+
+    def sweep(self) -> int:
+        """Run one sweep; returns how many requests were moved to READY_FOR_ALLOCATION"""
+        started = time.perf_counter()
+        fixed = 0
+        for _ in range(self.max_batches):
+            request_ids = self.candidates(self.batch_size)
+            if not request_ids:
+                break
+            fixed += self._complete(request_ids)
+            if len(request_ids) < self.batch_size:
+                break
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.sweeps += 1
+            self.fixed += fixed
+            self.last_fixed = fixed
+            self.last_sweep_at = datetime.utcnow()
+            self.last_duration_ms = duration_ms
+        if fixed:
+            log.info('stranded_requests_completed', requests=fixed, duration_ms=round(duration_ms))
+        else:
+            log.debug('sweep_finished', sampled=True, duration_ms=round(duration_ms))
+        return fixed
+
+    def _complete(self, request_ids: list) -> int:
+        source_count = (
+            select(func.count())
+            .where(Reservation.request_id == ProductRequest.id, Reservation.quantity > 0)
+            .scalar_subquery()
+        )
+        has_reservations = select(Reservation.id).where(Reservation.request_id == ProductRequest.id).exists()
+        has_pending_source = select(Reservation.id).where(
+            Reservation.request_id == ProductRequest.id,
+            Reservation.quantity > 0,
+            _not_ready()
+        ).exists()
+        try:
+            db.session.execute(
+                update(Reservation)
+                .where(
+                    Reservation.request_id.in_(request_ids),
+                    or_(Reservation.quantity <= 0, Reservation.source_ready_clause())
+                )
+                .values(counted_as_ready=case((Reservation.quantity > 0, True), else_=None))
+                .execution_options(synchronize_session=False)
+            )
+            result = db.session.execute(
+                update(ProductRequest)
+                .where(
+                    ProductRequest.id.in_(request_ids),
+                    ProductRequest.status.in_(COMPLETION_STATUSES),
+                    has_reservations,
+                    ~has_pending_source
+                )
+                .values(
+                    status=RequestStatus.READY_FOR_ALLOCATION,
+                    sources_total=source_count,
+                    sources_ready=source_count,
+                    updated_at=datetime.utcnow()
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return result.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'intervalSeconds': self.interval_seconds,
+                'batchSize': self.batch_size,
+                'sweeps': self.sweeps,
+                'fixed': self.fixed,
+                'lastFixed': self.last_fixed,
+                'lastSweepAt': self.last_sweep_at.isoformat() if self.last_sweep_at else None,
+                'lastDurationMs': round(self.last_duration_ms, 1)
+            }
+
+
+completion_sweeper = CompletionSweeper()
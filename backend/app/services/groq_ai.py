@@ -1,16 +1,85 @@
 import os
 import base64
+import hashlib
 import json
 from datetime import datetime, timedelta
-from flask import current_app
+from flask import current_app, has_app_context
 
+from app.services.groq_client import groq_clients
+from app.services.inspection_backend import InspectionBackend
+from app.services.model_output import model_output, ModelOutputError
+from app.services.vision_scheduler import vision_scheduler, VisionUnavailable
+from app.utils.images import prepare_for_analysis
+from app.utils.log import get_logger
 
-class GroqAIService:
+log = get_logger(__name__)
+
+# Fields the model reports for each image
+RESPONSE_SCHEMA = """{
+    "damage_detected": true/false,
+    "damage_type": "none" or specific type (tear, dent, puncture, water_damage, crushing, scratch, crack),
+    "damage_severity": "none", "minor", "moderate", or "severe",
+    "damage_location": "description of where damage is located or null",
+    "seal_intact": true/false/null,
+    "tamper_evidence": true/false,
+    "spoilage_detected": true/false,
+    "spoilage_type": "none" or type (mold, discoloration, leakage, swelling),
+    "expiry_date_text": "extracted text exactly as shown or null",
+    "expiry_date_iso": "YYYY-MM-DD format or null",
+    "is_expired": true/false/null,
+    "days_until_expiry": number or null,
+    "batch_number": "extracted batch/lot number or null",
+    "overall_result": "OK", "DAMAGED", "EXPIRED", "SPOILED", or "NEEDS_REVIEW",
+    "confidence_score": 0-100,
+    "quality_grade": "A" (perfect), "B" (minor issues), "C" (significant issues), "F" (reject),
+    "explanation": "detailed explanation of all findings"
+}"""
+
+# What to look for in each image type when several are inspected in one call
+BATCH_FOCUS = {
+    'package': 'packaging integrity - tears, dents, crushing, moisture, seal and tamper evidence, leakage or swelling',
+    'label': 'OCR of expiry/best-before and manufacturing dates, batch/lot number, label legibility',
+    'contents': 'the product itself - freshness, discoloration, mold, rot, contamination, completeness',
+    'damage': 'documented damage - type, severity (minor/moderate/severe), location and extent, whether contents are compromised',
+}
+
+# Reservation verdict precedence when merging per-image results (worst first)
+VERDICT_PRECEDENCE = ['DAMAGED', 'EXPIRED', 'LOW_CONFIDENCE', 'ERROR', 'OK']
+
+
+def merge_verdicts(results: list) -> dict:
+    """
+    Combine per-image results for one reservation into a single verdict.
+
+    The worst result wins (see VERDICT_PRECEDENCE) and the confidence is the
+    lowest reported by any image.
+    """
+    if not results:
+        return {'result': 'ERROR', 'confidence': 0, 'images': 0}
+    worst = min(results, key=lambda r: VERDICT_PRECEDENCE.index(r['result']) if r['result'] in VERDICT_PRECEDENCE else 0)
+    return {
+        'result': worst['result'],
+        'confidence': min(r.get('confidence') or 0 for r in results),
+        'images': len(results)
+    }
+
+
+class GroqAIService(InspectionBackend):
     """Service for AI-powered image inspection using Groq API"""
+
+    name = 'groq'
+    _json_mode_unsupported = set()  # Models that rejected response_format
     
     def __init__(self):
         self.api_key = os.getenv('GROQ_API_KEY', '')
         self.model = "meta-llama/llama-4-scout-17b-16e-instruct"  # Llama 4 Scout - replacement for deprecated vision models
+
+        # Image preprocessing before upload to the model (max edge 0 = send the original file)
+        config = current_app.config if has_app_context() else {}
+        self.image_max_edge = config.get('INSPECTION_IMAGE_MAX_EDGE', 1280)
+        self.image_format = config.get('INSPECTION_IMAGE_FORMAT', 'JPEG')
+        self.image_quality = config.get('INSPECTION_IMAGE_QUALITY', 85)
+        self.json_mode = config.get('INSPECTION_JSON_MODE', True)
     
     def analyze_image(self, image_path: str, image_type: str = 'package') -> dict:
         """
@@ -33,38 +102,25 @@ class GroqAIService:
                 - seal_intact: bool or None
                 - spoilage_detected: bool
                 - raw_response: str
+
+        Raises:
+            VisionUnavailable: the API is rate-limiting or down; retry later
         """
         if not self.api_key:
             # Return mock response if no API key
-            print("[GROQ DEBUG] No API key configured, using mock")
+            log.warning('mock_analysis', reason='no_api_key', sampled=True)
             return self._mock_analysis()
         
         try:
-            print(f"[GROQ DEBUG] Using API key: {self.api_key[:10]}... Image type: {image_type}")
-            from groq import Groq
-            
-            client = Groq(api_key=self.api_key)
-            
-            # Read and encode image
-            with open(image_path, 'rb') as f:
-                image_data = base64.b64encode(f.read()).decode('utf-8')
-            
-            # Determine mime type
-            ext = image_path.rsplit('.', 1)[-1].lower()
-            mime_types = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'webp': 'image/webp'
-            }
-            mime_type = mime_types.get(ext, 'image/jpeg')
+            log.debug('analyze_image', model=self.model, image_type=image_type)
+            client = self._client()
             
             # Create type-specific prompt
             prompt = self._get_prompt_for_type(image_type)
 
-            # Call Groq API
-            response = client.chat.completions.create(
-                model=self.model,
+            # Call Groq API (rate-limited and retried by the vision scheduler)
+            raw_response = self._complete(
+                client,
                 messages=[
                     {
                         "role": "user",
@@ -76,122 +132,190 @@ class GroqAIService:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:{mime_type};base64,{image_data}"
+                                    "url": self._image_data_url(image_path)
                                 }
                             }
                         ]
                     }
                 ],
-                max_tokens=1500,  # Increased for detailed response
-                temperature=0.1
+                max_tokens=1500  # Increased for detailed response
             )
+            log.debug('model_response', sampled=True, image_type=image_type, chars=len(raw_response), head=raw_response[:200])
             
-            raw_response = response.choices[0].message.content
-            print(f"[GROQ DEBUG] Raw response: {raw_response[:200]}...")
-            
-            # Parse JSON response
+            # Parse, repair and validate the JSON response
             try:
-                # Extract JSON from response
-                json_start = raw_response.find('{')
-                json_end = raw_response.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = raw_response[json_start:json_end]
-                    ai_result = json.loads(json_str)
-                else:
-                    raise ValueError("No JSON found in response")
-                
-                # Map to our format with enhanced logic
-                result = 'OK'
-                quality_grade = ai_result.get('quality_grade', 'B')
-                
-                # Check for critical issues first
-                if ai_result.get('spoilage_detected'):
-                    result = 'DAMAGED'  # Spoilage is treated as critical damage
-                elif ai_result.get('is_expired'):
-                    result = 'EXPIRED'
-                elif ai_result.get('damage_detected') and ai_result.get('damage_severity') in ['moderate', 'severe']:
-                    result = 'DAMAGED'
-                elif ai_result.get('tamper_evidence'):
-                    result = 'DAMAGED'  # Tampered packages are rejected
-                elif quality_grade == 'F':
-                    result = 'DAMAGED'
-                elif ai_result.get('overall_result') in ['DAMAGED', 'SPOILED']:
-                    result = 'DAMAGED'
-                elif ai_result.get('overall_result') == 'NEEDS_REVIEW' or quality_grade == 'C':
-                    result = 'LOW_CONFIDENCE'
-                elif ai_result.get('confidence_score', 100) < 70:
-                    result = 'LOW_CONFIDENCE'
-                
-                return {
-                    'result': result,
-                    'confidence': ai_result.get('confidence_score', 80),
-                    'damage_detected': ai_result.get('damage_detected', False),
-                    'damage_type': ai_result.get('damage_type') if ai_result.get('damage_type') != 'none' else None,
-                    'damage_severity': ai_result.get('damage_severity') if ai_result.get('damage_severity') != 'none' else None,
-                    'expiry_detected': ai_result.get('expiry_date_iso') is not None,
-                    'detected_expiry_date': ai_result.get('expiry_date_iso'),
-                    'is_expired': ai_result.get('is_expired', False),
-                    'seal_intact': ai_result.get('seal_intact'),
-                    'spoilage_detected': ai_result.get('spoilage_detected', False),
-                    'raw_response': raw_response
-                }
-                
-            except json.JSONDecodeError as e:
-                return {
-                    'result': 'LOW_CONFIDENCE',
-                    'confidence': 50,
-                    'damage_detected': False,
-                    'damage_type': None,
-                    'damage_severity': None,
-                    'expiry_detected': False,
-                    'detected_expiry_date': None,
-                    'is_expired': False,
-                    'seal_intact': None,
-                    'spoilage_detected': False,
-                    'raw_response': f"Parse error: {str(e)}. Response: {raw_response}"
-                }
+                ai_result = model_output.parse_inspection(raw_response, image_type)
+            except ModelOutputError as e:
+                return self._fallback_result('LOW_CONFIDENCE', 50, f"Parse error: {str(e)}. Response: {raw_response}")
+
+            return self._map_result(ai_result, raw_response)
                 
+        except VisionUnavailable:
+            raise
         except Exception as e:
-            print(f"[GROQ DEBUG] Exception: {type(e).__name__}: {str(e)}")
-            return {
-                'result': 'ERROR',
-                'confidence': 0,
-                'damage_detected': False,
-                'damage_type': None,
-                'damage_severity': None,
-                'expiry_detected': False,
-                'detected_expiry_date': None,
-                'is_expired': False,
-                'seal_intact': None,
-                'spoilage_detected': False,
-                'raw_response': f"API error: {str(e)}"
-            }
+            log.error('analysis_failed', error_type=type(e).__name__, error=str(e))
+            return self._fallback_result('ERROR', 0, f"API error: {str(e)}")
     
+    def prompt_version(self, image_type: str) -> str:
+        """
+        Fingerprint of the model and prompts used for an image type.
+
+        Cached results are keyed on this, so editing a prompt or switching
+        models stops old results from being reused.
+        """
+        prompts = (
+            f"{self.model}\n{self.image_max_edge}/{self.image_format}/{self.image_quality}\n"
+            f"{self._get_prompt_for_type(image_type)}\n{self._get_batch_prompt([image_type, image_type])}"
+        )
+        return hashlib.sha256(prompts.encode('utf-8')).hexdigest()[:16]
+
+    def analyze_images(self, images: list) -> list:
+        """
+        Analyze several images of the same reservation in one model call.
+
+        Args:
+            images: list of (image_path, image_type) tuples, at most
+                INSPECTION_BATCH_SIZE (the vision model accepts up to 5)
+
+        Returns:
+            list of result dicts in the same order and format as analyze_image();
+            use merge_verdicts() for the combined reservation verdict
+        """
+        if len(images) == 1:
+            return [self.analyze_image(*images[0])]
+
+        if not self.api_key:
+            log.warning('mock_analysis', reason='no_api_key', sampled=True)
+            return [self._mock_analysis() for _ in images]
+
+        try:
+            log.debug('analyze_batch', model=self.model, images=len(images), image_types=','.join(t for _, t in images))
+            client = self._client()
+
+            content = [{"type": "text", "text": self._get_batch_prompt([t for _, t in images])}]
+            for image_path, _ in images:
+                content.append({"type": "image_url", "image_url": {"url": self._image_data_url(image_path)}})
+
+            raw_response = self._complete(
+                client,
+                messages=[{"role": "user", "content": content}],
+                max_tokens=1200 * len(images)
+            )
+            log.debug('model_response', sampled=True, images=len(images), chars=len(raw_response), head=raw_response[:200])
+
+            try:
+                entries = model_output.parse_batch(raw_response, len(images))
+            except ModelOutputError as e:
+                return [
+                    self._fallback_result('LOW_CONFIDENCE', 50, f"Parse error: {str(e)}. Response: {raw_response}")
+                    for _ in images
+                ]
+
+            results = []
+            for index, entry in enumerate(entries, start=1):
+                if entry is None:
+                    results.append(self._fallback_result(
+                        'LOW_CONFIDENCE', 50, f"Batch response had no valid entry for image {index}. Response: {raw_response}"
+                    ))
+                else:
+                    results.append(self._map_result(entry, json.dumps(entry)))
+            return results
+
+        except VisionUnavailable:
+            raise
+        except Exception as e:
+            log.error('analysis_failed', error_type=type(e).__name__, error=str(e))
+            return [self._fallback_result('ERROR', 0, f"API error: {str(e)}") for _ in images]
+
+    def _complete(self, client, messages: list, max_tokens: int) -> str:
+        """
+        Reply text for a chat completion, through the vision scheduler.
+
+        Asks for JSON mode when INSPECTION_JSON_MODE is on. If the model's
+        output fails the API's JSON check, the rejected text is returned for
+        the tolerant parser to repair. If the API rejects response_format for
+        this model, the request is repeated without it and JSON mode stays
+        off for the model in this process.
+        """
+        import groq
+
+        use_json_mode = self.json_mode and self.model not in GroqAIService._json_mode_unsupported
+        request = dict(model=self.model, messages=messages, max_tokens=max_tokens, temperature=0.1)
+        try:
+            response = vision_scheduler.call(self.api_key, lambda: client.chat.completions.create(
+                **request, **({'response_format': {"type": "json_object"}} if use_json_mode else {})
+            ))
+        except groq.BadRequestError as e:
+            if not use_json_mode:
+                raise
+            body = e.body if isinstance(e.body, dict) else {}
+            failed_generation = body.get('failed_generation') or (body.get('error') or {}).get('failed_generation')
+            if failed_generation:
+                return failed_generation
+            if 'response_format' not in str(e):
+                raise
+            log.warning('json_mode_unsupported', model=self.model, error=str(e))
+            GroqAIService._json_mode_unsupported.add(self.model)
+            response = vision_scheduler.call(self.api_key, lambda: client.chat.completions.create(**request))
+        return response.choices[0].message.content or ''
+
+    def _client(self):
+        """Shared pooled client; retries are left to the vision scheduler"""
+        return groq_clients.get(self.api_key).with_options(max_retries=0)
+
+    def _image_data_url(self, image_path: str) -> str:
+        """Base64 data URL for an image file, downscaled/re-encoded unless preprocessing is disabled"""
+        if self.image_max_edge:
+            try:
+                image_bytes, mime_type = prepare_for_analysis(
+                    image_path, self.image_max_edge, self.image_format, self.image_quality
+                )
+                return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+            except (OSError, ValueError) as e:
+                log.warning('preprocessing_failed', path=image_path, error=str(e))
+
+        with open(image_path, 'rb') as f:
+            image_data = base64.b64encode(f.read()).decode('utf-8')
+
+        ext = image_path.rsplit('.', 1)[-1].lower()
+        mime_types = {
+            'jpg': 'image/jpeg',
+            'jpeg': 'image/jpeg',
+            'png': 'image/png',
+            'webp': 'image/webp'
+        }
+        mime_type = mime_types.get(ext, 'image/jpeg')
+        return f"data:{mime_type};base64,{image_data}"
+
+    def _get_batch_prompt(self, image_types: list) -> str:
+        """Prompt for inspecting several images of one reservation in a single call"""
+        image_lines = "\n".join(
+            f"- Image {index}: {image_type.upper()} photo. Focus on {BATCH_FOCUS.get(image_type, BATCH_FOCUS['package'])}."
+            for index, image_type in enumerate(image_types, start=1)
+        )
+        return f"""You are an expert quality control inspector. The {len(image_types)} images that follow are photos of the SAME product reservation, in this order:
+{image_lines}
+
+Inspect EACH image independently according to its type. Judge every image only on what is visible in that image.
+
+## RESPONSE FORMAT
+Respond ONLY with valid JSON (no markdown, no extra text):
+{{
+    "images": [
+        {{"image_index": 1, ...fields below...}},
+        ... exactly {len(image_types)} entries, in image order
+    ]
+}}
+where each entry also contains these fields:
+{RESPONSE_SCHEMA}"""
+
     def _get_prompt_for_type(self, image_type: str) -> str:
         """Get specialized prompt based on image type"""
         
-        base_response_format = """
+        base_response_format = f"""
 ## RESPONSE FORMAT
 Respond ONLY with valid JSON (no markdown, no extra text):
-{
-    "damage_detected": true/false,
-    "damage_type": "none" or specific type (tear, dent, puncture, water_damage, crushing, scratch, crack),
-    "damage_severity": "none", "minor", "moderate", or "severe",
-    "damage_location": "description of where damage is located or null",
-    "seal_intact": true/false/null,
-    "tamper_evidence": true/false,
-    "spoilage_detected": true/false,
-    "spoilage_type": "none" or type (mold, discoloration, leakage, swelling),
-    "expiry_date_text": "extracted text exactly as shown or null",
-    "expiry_date_iso": "YYYY-MM-DD format or null",
-    "is_expired": true/false/null,
-    "days_until_expiry": number or null,
-    "batch_number": "extracted batch/lot number or null",
-    "overall_result": "OK", "DAMAGED", "EXPIRED", "SPOILED", or "NEEDS_REVIEW",
-    "confidence_score": 0-100,
-    "quality_grade": "A" (perfect), "B" (minor issues), "C" (significant issues), "F" (reject),
-    "explanation": "detailed explanation of all findings"
-}"""
+{RESPONSE_SCHEMA}"""
         
         if image_type == 'label':
             return f"""You are an expert OCR and label inspector. This image shows a product LABEL. Focus on extracting and analyzing text information.
@@ -347,6 +471,7 @@ Consider: Would this package be acceptable for retail display?
         result = random.choice(result_options)
         
         mock = {
+            'cacheable': False,
             'result': result,
             'confidence': random.randint(75, 98) if result == 'OK' else random.randint(55, 85),
             'damage_detected': result == 'DAMAGED',
@@ -0,0 +1,110 @@
+"""
+GroqClientRegistry - one pooled Groq client per API key, per process
+
+Creating a Groq client per call re-imports nothing but does build a new
+httpx connection pool, so every request paid a fresh TCP + TLS handshake.
+Clients built here share a keep-alive pool (GROQ_POOL_MAX_CONNECTIONS /
+GROQ_POOL_MAX_KEEPALIVE, idle connections kept GROQ_KEEPALIVE_EXPIRY
+seconds) and are reused by every service and worker thread; httpx clients
+are thread-safe. warm_up() opens a connection in the background at app
+start so the first user request does not pay the handshake either.
+"""
+
+import threading
+import time
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+class GroqClientRegistry:
+    """API key -> shared Groq client"""
+
+    def __init__(self):
+        self.max_connections = 20
+        self.max_keepalive = 10
+        self.keepalive_expiry = 30.0
+        self.connect_timeout = 5.0
+        self.read_timeout = 60.0
+        self.max_retries = 2
+        self.base_url = None
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def init_app(self, app):
+        self.max_connections = app.config.get('GROQ_POOL_MAX_CONNECTIONS', self.max_connections)
+        self.max_keepalive = app.config.get('GROQ_POOL_MAX_KEEPALIVE', self.max_keepalive)
+        self.keepalive_expiry = app.config.get('GROQ_KEEPALIVE_EXPIRY', self.keepalive_expiry)
+        self.connect_timeout = app.config.get('GROQ_CONNECT_TIMEOUT', self.connect_timeout)
+        self.read_timeout = app.config.get('GROQ_READ_TIMEOUT', self.read_timeout)
+        self.max_retries = app.config.get('GROQ_MAX_RETRIES', self.max_retries)
+        self.base_url = app.config.get('GROQ_BASE_URL') or None
+        self.close()
+
+        api_key = app.config.get('GROQ_API_KEY')
+        if api_key and app.config.get('GROQ_WARMUP', True):
+            threading.Thread(target=self.warm_up, args=(api_key,), name='groq-warmup', daemon=True).start()
+
+    def get(self, api_key: str):
+        """Shared client for api_key, created on first use"""
+        client = self._clients.get(api_key)
+        if client is not None:
+            self.reused += 1
+            return client
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = self._build(api_key)
+                self._clients[api_key] = client
+                self.created += 1
+            return client
+
+    def _build(self, api_key: str):
+        import httpx
+        from groq import Groq
+
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        http_client = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            follow_redirects=True
+        )
+        return Groq(api_key=api_key, base_url=self.base_url, http_client=http_client, timeout=timeout,
+                    max_retries=self.max_retries)
+
+    def warm_up(self, api_key: str):
+        """Build the client and open a pooled connection with a cheap request"""
+        started = time.monotonic()
+        try:
+            self.get(api_key).models.list()
+            log.info('client_warmed_up', duration_ms=round((time.monotonic() - started) * 1000))
+        except Exception as e:
+            log.warning('warm_up_failed', error_type=type(e).__name__, error=str(e))
+
+    def close(self):
+        """Close all pooled connections (clients are rebuilt on next use)"""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            'clients': len(self._clients),
+            'created': self.created,
+            'reused': self.reused,
+            'maxConnections': self.max_connections,
+            'maxKeepalive': self.max_keepalive
+        }
+
+
+groq_clients = GroqClientRegistry()
@@ -0,0 +1,104 @@
+"""
+InspectionBackend - what analyzes inspection photos
+
+The job queue asks get_inspection_backend() for the backend selected by
+INSPECTION_BACKEND:
+
+- 'groq'  (default) GroqAIService, the hosted vision model
+- 'local' LocalInspectionBackend, CPU-only image heuristics (plus OCR when
+          Tesseract is installed) run in a process pool, for sites without
+          network access
+
+Every backend returns the same result dict (see map_result()), so the job
+queue, the result cache and the Joint Wait flow do not care which one ran.
+"""
+
+from flask import current_app, has_app_context
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+class InspectionBackend:
+    """Base class: analyze one or several images and return inspection result dicts"""
+
+    name = 'base'
+
+    def analyze_image(self, image_path: str, image_type: str = 'package') -> dict:
+        raise NotImplementedError
+
+    def analyze_images(self, images: list) -> list:
+        """Results for a list of (image_path, image_type), in order"""
+        return [self.analyze_image(image_path, image_type) for image_path, image_type in images]
+
+    def prompt_version(self, image_type: str) -> str:
+        """Fingerprint of everything that determines a result; cached results are keyed on it"""
+        raise NotImplementedError
+
+    def _map_result(self, ai_result: dict, raw_response: str) -> dict:
+        """Map RESPONSE_SCHEMA fields (see groq_ai) to our inspection result format"""
+        result = 'OK'
+        quality_grade = ai_result.get('quality_grade', 'B')
+
+        # Check for critical issues first
+        if ai_result.get('spoilage_detected'):
+            result = 'DAMAGED'  # Spoilage is treated as critical damage
+        elif ai_result.get('is_expired'):
+            result = 'EXPIRED'
+        elif ai_result.get('damage_detected') and ai_result.get('damage_severity') in ['moderate', 'severe']:
+            result = 'DAMAGED'
+        elif ai_result.get('tamper_evidence'):
+            result = 'DAMAGED'  # Tampered packages are rejected
+        elif quality_grade == 'F':
+            result = 'DAMAGED'
+        elif ai_result.get('overall_result') in ['DAMAGED', 'SPOILED']:
+            result = 'DAMAGED'
+        elif ai_result.get('overall_result') == 'NEEDS_REVIEW' or quality_grade == 'C':
+            result = 'LOW_CONFIDENCE'
+        elif ai_result.get('confidence_score', 100) < 70:
+            result = 'LOW_CONFIDENCE'
+
+        return {
+            'result': result,
+            'confidence': ai_result.get('confidence_score', 80),
+            'damage_detected': ai_result.get('damage_detected', False),
+            'damage_type': ai_result.get('damage_type') if ai_result.get('damage_type') != 'none' else None,
+            'damage_severity': ai_result.get('damage_severity') if ai_result.get('damage_severity') != 'none' else None,
+            'expiry_detected': ai_result.get('expiry_date_iso') is not None,
+            'detected_expiry_date': ai_result.get('expiry_date_iso'),
+            'is_expired': ai_result.get('is_expired', False),
+            'seal_intact': ai_result.get('seal_intact'),
+            'spoilage_detected': ai_result.get('spoilage_detected', False),
+            'raw_response': raw_response
+        }
+
+    @staticmethod
+    def _fallback_result(result: str, confidence: int, raw_response: str) -> dict:
+        """Result used when the analysis could not be used (never cached)"""
+        return {
+            'cacheable': False,
+            'result': result,
+            'confidence': confidence,
+            'damage_detected': False,
+            'damage_type': None,
+            'damage_severity': None,
+            'expiry_detected': False,
+            'detected_expiry_date': None,
+            'is_expired': False,
+            'seal_intact': None,
+            'spoilage_detected': False,
+            'raw_response': raw_response
+        }
+
+
+def get_inspection_backend() -> InspectionBackend:
+    """The backend selected by INSPECTION_BACKEND ('groq' or 'local')"""
+    name = current_app.config.get('INSPECTION_BACKEND', 'groq') if has_app_context() else 'groq'
+    if name == 'local':
+        from app.services.local_inspection import local_inspection
+        return local_inspection
+    if name != 'groq':
+        log.warning('unknown_inspection_backend', backend=name, using='groq')
+
+    from app.services.groq_ai import GroqAIService
+    return GroqAIService()
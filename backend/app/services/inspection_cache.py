@@ -0,0 +1,171 @@
+"""
+InspectionCache - reuse AI inspection results for re-uploaded photos
+
+Uploads are fingerprinted when saved (SHA-256 and a 64-bit dHash, see
+app/utils/images.py). Before calling the vision model, the inspection queue
+looks here for a stored result with the same image type and prompt version:
+
+- exact: same SHA-256, from any request
+- near-duplicate: dHash within INSPECTION_DEDUP_MAX_DISTANCE bits, limited to
+  uploads for the same request so a similar-looking photo of a different
+  shipment never inherits its verdict
+
+Entries expire after INSPECTION_CACHE_TTL_DAYS; purge() also trims the table
+to INSPECTION_CACHE_MAX_ENTRIES, least recently used first.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.inspection import InspectionImage, InspectionResultCache
+from app.utils.images import hamming_distance
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+# Result fields stored in the cache (raw_response is kept for the audit trail)
+_CACHED_FIELDS = (
+    'result', 'confidence', 'damage_detected', 'damage_type', 'damage_severity', 'expiry_detected',
+    'detected_expiry_date', 'is_expired', 'seal_intact', 'spoilage_detected', 'raw_response'
+)
+_CACHEABLE_RESULTS = ('OK', 'DAMAGED', 'EXPIRED', 'LOW_CONFIDENCE')
+
+
+class InspectionCache:
+    """Content-hash keyed store of parsed analyze_image() results"""
+
+    def __init__(self, ttl_days: int = 30, max_entries: int = 50000, max_distance: int = 4,
+                 purge_interval_seconds: int = 3600):
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl_days = app.config.get('INSPECTION_CACHE_TTL_DAYS', self.ttl_days)
+        self.max_entries = app.config.get('INSPECTION_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_distance = app.config.get('INSPECTION_DEDUP_MAX_DISTANCE', self.max_distance)
+
+    def lookup(self, inspection: InspectionImage, prompt_version: str):
+        """Cached result for the image, or None. Returned dicts carry cached=True."""
+        if not inspection.content_sha256 or self.ttl_days <= 0:
+            return None
+        now = datetime.utcnow()
+        base = InspectionResultCache.query.filter(
+            InspectionResultCache.image_type == inspection.image_type,
+            InspectionResultCache.prompt_version == prompt_version,
+            InspectionResultCache.expires_at > now
+        )
+
+        entry = base.filter(InspectionResultCache.content_sha256 == inspection.content_sha256).first()
+        kind = 'exact'
+        if entry is None and inspection.perceptual_hash and self.max_distance > 0 and inspection.request_id:
+            candidates = base.filter(
+                InspectionResultCache.request_id == inspection.request_id,
+                InspectionResultCache.perceptual_hash.isnot(None)
+            ).order_by(InspectionResultCache.created_at.desc()).limit(200).all()
+            scored = [(hamming_distance(inspection.perceptual_hash, c.perceptual_hash), c) for c in candidates]
+            scored = [(distance, c) for distance, c in scored if distance <= self.max_distance]
+            if scored:
+                distance, entry = min(scored, key=lambda pair: pair[0])
+                kind = f'near (distance {distance})'
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif kind == 'exact':
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+        if entry is None:
+            return None
+
+        entry.hits += 1
+        entry.last_hit_at = now
+        log.debug('inspection_cache_hit', sampled=True, image_id=inspection.id, kind=kind, entry_id=entry.id)
+        return {**json.loads(entry.result_json), 'cached': True}
+
+    def store(self, inspection: InspectionImage, prompt_version: str, ai_result: dict):
+        """Remember a fresh model result for the image (skips fallback/mock/error results)"""
+        if (
+            not inspection.content_sha256
+            or self.ttl_days <= 0
+            or ai_result.get('cached')
+            or ai_result.get('cacheable') is False
+            or ai_result.get('result') not in _CACHEABLE_RESULTS
+        ):
+            return
+
+        now = datetime.utcnow()
+        values = {
+            'perceptual_hash': inspection.perceptual_hash,
+            'request_id': inspection.request_id,
+            'result_json': json.dumps({key: ai_result.get(key) for key in _CACHED_FIELDS}),
+            'created_at': now,
+            'expires_at': now + timedelta(days=self.ttl_days)
+        }
+        key = {
+            'content_sha256': inspection.content_sha256,
+            'image_type': inspection.image_type,
+            'prompt_version': prompt_version
+        }
+        try:
+            with db.session.begin_nested():
+                entry = InspectionResultCache.query.filter_by(**key).first()
+                if entry is None:
+                    db.session.add(InspectionResultCache(**key, **values))
+                else:
+                    for name, value in values.items():
+                        setattr(entry, name, value)
+        except IntegrityError:
+            # Another worker stored the same content first; its result is as good as ours
+            pass
+
+        if time.monotonic() - self._last_purge > self.purge_interval_seconds:
+            self._last_purge = time.monotonic()
+            self.purge()
+
+    def purge(self) -> int:
+        """Delete expired entries and trim to max_entries (least recently used first)"""
+        removed = InspectionResultCache.query.filter(
+            InspectionResultCache.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+
+        excess = InspectionResultCache.query.count() - self.max_entries
+        if self.max_entries > 0 and excess > 0:
+            stale_ids = [
+                entry_id for (entry_id,) in db.session.query(InspectionResultCache.id)
+                .order_by(func.coalesce(InspectionResultCache.last_hit_at, InspectionResultCache.created_at))
+                .limit(excess)
+            ]
+            removed += InspectionResultCache.query.filter(
+                InspectionResultCache.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+
+        if removed:
+            log.info('inspection_cache_purged', entries=removed)
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.near_hits + self.misses
+            counters = {
+                'exactHits': self.exact_hits,
+                'nearHits': self.near_hits,
+                'misses': self.misses,
+                'hitRate': round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else None
+            }
+        return {'entries': InspectionResultCache.query.count(), 'ttlDays': self.ttl_days, **counters}
+
+
+inspection_cache = InspectionCache()
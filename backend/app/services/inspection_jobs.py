@@ -0,0 +1,411 @@
+"""
+InspectionJobQueue - background AI analysis of uploaded inspection images
+
+Uploads only save the image and enqueue an InspectionJob row; the vision
+model call and the Joint Wait status updates that follow it run here, in
+worker threads that claim jobs from the inspection_jobs table. Because the
+queue is a table, jobs survive restarts and can also be drained by a
+separate process (see inspection_worker.py). The in-process pool starts with
+the first HTTP request, so jobs left over from a previous process are picked
+up without waiting for a new upload.
+
+With INSPECTION_BATCH_SIZE > 1 a worker that claims a job also claims the
+other queued jobs for the same reservation and sends all of their images in
+one multi-image model call; the merged verdict then drives the reservation.
+
+Images whose content matches an earlier upload take their result from the
+inspection result cache instead of calling the model.
+
+When the vision scheduler reports the API unavailable (rate limited or
+circuit open) the jobs go back in the queue for the suggested delay without
+using up an attempt.
+"""
+
+import math
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, func, update
+
+from app import db
+from app.models.inspection import InspectionImage, InspectionResult, InspectionJob, InspectionJobStatus
+from app.models.request import Reservation, RequestStatus, ReservationStatus
+from app.services.groq_ai import merge_verdicts
+from app.services.inspection_backend import get_inspection_backend
+from app.services.inspection_cache import inspection_cache
+from app.services.source_completion import SourceCompletionService
+from app.services.groq_client import groq_clients
+from app.services.vision_scheduler import VisionUnavailable, vision_scheduler
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+def process_inspection(inspection: InspectionImage):
+    """Run AI analysis on an uploaded image and apply the result to its request"""
+    process_inspections([inspection])
+
+
+def analyze_inspections(inspections: list) -> list:
+    """AI results for the images, from the result cache where possible and one backend call for the rest"""
+    backend = get_inspection_backend()
+    versions = [backend.prompt_version(i.image_type) for i in inspections]
+    ai_results = [inspection_cache.lookup(i, version) for i, version in zip(inspections, versions)]
+
+    pending = [index for index, ai_result in enumerate(ai_results) if ai_result is None]
+    if pending:
+        fresh = backend.analyze_images([(inspections[i].file_path, inspections[i].image_type) for i in pending])
+        for index, ai_result in zip(pending, fresh):
+            ai_results[index] = ai_result
+            inspection_cache.store(inspections[index], versions[index], ai_result)
+    return ai_results
+
+
+def process_inspections(inspections: list):
+    """
+    Analyze several images of one reservation in a single model call.
+
+    Each image keeps its own result; the reservation and request are updated
+    once, from the worst per-image verdict.
+    """
+    ai_results = analyze_inspections(inspections)
+    for inspection, ai_result in zip(inspections, ai_results):
+        record_inspection_result(inspection, ai_result)
+
+    if len(inspections) == 1:
+        return apply_inspection_verdict(inspections[0], ai_results[0]['result'])
+
+    verdict = merge_verdicts(ai_results)
+    log.info('batch_verdict', reservation_id=inspections[0].reservation_id, images=len(inspections),
+             verdict=verdict['result'], results=','.join(r['result'] for r in ai_results))
+    apply_inspection_verdict(inspections[0], verdict['result'])
+
+
+def record_inspection_result(inspection: InspectionImage, ai_result: dict):
+    """Copy an AI result onto the image row"""
+    inspection.result = InspectionResult(ai_result['result'])
+    inspection.confidence_score = ai_result['confidence']
+    inspection.damage_detected = ai_result.get('damage_detected', False)
+    inspection.damage_type = ai_result.get('damage_type')
+    inspection.damage_severity = ai_result.get('damage_severity')
+    inspection.expiry_detected = ai_result.get('expiry_detected', False)
+    inspection.is_expired = ai_result.get('is_expired', False)
+    inspection.seal_intact = ai_result.get('seal_intact')
+    inspection.spoilage_detected = ai_result.get('spoilage_detected', False)
+    inspection.ai_raw_response = ai_result.get('raw_response', '')
+    inspection.result_cached = bool(ai_result.get('cached'))
+    inspection.processed_at = datetime.utcnow()
+
+    if ai_result.get('detected_expiry_date'):
+        inspection.detected_expiry_date = datetime.fromisoformat(ai_result['detected_expiry_date']).date()
+
+
+def apply_inspection_verdict(inspection: InspectionImage, result: str):
+    """
+    Move the image's reservation and request along the Joint Wait flow for an AI verdict.
+
+    Runs as one Joint Wait unit of work (joining the caller's, if any).
+    """
+    request_id = inspection.request_id
+    reservation_id = inspection.reservation_id
+    product_request = inspection.request
+    user_warehouse_id = inspection.uploader.assigned_warehouse_id if inspection.uploader else None
+
+    # Initialize source completion service for Joint Wait model
+    source_completion = SourceCompletionService()
+
+    with source_completion.transaction():
+        # Update reservation if blocked (when there's a specific reservation)
+        if reservation_id and result in ['DAMAGED', 'EXPIRED']:
+            reservation = Reservation.query.get(reservation_id)
+            if reservation:
+                reservation.is_blocked = True
+                reservation.block_reason = result
+                reservation.reservation_status = ReservationStatus.AI_DAMAGED
+
+        if result in ['DAMAGED', 'EXPIRED']:
+            all_blocked = Reservation.query.filter_by(
+                request_id=request_id,
+                is_blocked=True
+            ).count()
+
+            total_reservations = Reservation.query.filter_by(request_id=request_id).count()
+
+            if all_blocked == total_reservations and total_reservations > 0:
+                product_request.status = RequestStatus.BLOCKED
+                log.info('request_blocked', request_id=product_request.id, blocked=all_blocked, total=total_reservations)
+            else:
+                # JOINT WAIT: Set to PARTIALLY_BLOCKED, let procurement handle
+                # Procurement will use SourceCompletionService after resolution
+                product_request.status = RequestStatus.PARTIALLY_BLOCKED
+                log.info('request_partially_blocked', request_id=product_request.id, blocked=all_blocked, total=total_reservations)
+
+        elif result == 'LOW_CONFIDENCE':
+            # LOW_CONFIDENCE requires procurement review
+            if reservation_id:
+                reservation = Reservation.query.get(reservation_id)
+                if reservation:
+                    reservation.reservation_status = ReservationStatus.AI_LOW_CONFIDENCE
+
+            product_request.status = RequestStatus.PARTIALLY_BLOCKED
+            log.info('low_confidence', request_id=product_request.id, reservation_id=reservation_id)
+
+        elif result == 'OK':
+            # JOINT WAIT MODEL: Mark this reservation as AI-confirmed
+            # Then trigger completion check to see if ALL sources are ready
+            if reservation_id:
+                reservation = Reservation.query.get(reservation_id)
+                if reservation:
+                    # Auto-mark as picked when AI confirms (uploading = already picked)
+                    if not reservation.is_picked:
+                        reservation.is_picked = True
+                        reservation.picked_at = datetime.utcnow()
+                        log.debug('auto_picked', reservation_id=reservation_id)
+
+                    reservation.ai_confirmed = True
+                    reservation.ai_confirmation_date = datetime.utcnow()
+                    reservation.reservation_status = ReservationStatus.AI_CONFIRMED
+                    log.debug('ai_confirmed', reservation_id=reservation_id)
+
+            # Check if this action completed picking for the warehouse (re-check for auto-pick scenarios)
+            warehouse_reservations = [r for r in product_request.reservations if r.warehouse_id == user_warehouse_id]
+            warehouse_all_picked = all(r.is_picked for r in warehouse_reservations) if warehouse_reservations else False
+
+            if warehouse_all_picked and product_request.status == RequestStatus.PICKING:
+                product_request.status = RequestStatus.INSPECTION_PENDING
+                log.info('warehouse_picking_complete', request_id=request_id, warehouse_id=user_warehouse_id)
+
+            # JOINT WAIT: Use SourceCompletionService to check if ALL sources are ready
+            # This will transition to READY_FOR_ALLOCATION only when all sources complete
+            all_ready = source_completion.check_all_sources_ready(int(request_id))
+
+            if all_ready:
+                log.info('all_sources_ready', request_id=request_id)
+            else:
+                # Some sources still pending - update status to waiting
+                if product_request.status == RequestStatus.INSPECTION_PENDING:
+                    product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+                log.debug('waiting_for_sources', sampled=True, request_id=request_id)
+
+
+class InspectionJobQueue:
+    """Table-backed job queue with an in-process pool of worker threads"""
+
+    def __init__(self, workers: int = 2, poll_seconds: float = 2.0, job_timeout_seconds: int = 300,
+                 max_attempts: int = 3, batch_size: int = 4):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.job_timeout_seconds = job_timeout_seconds
+        self.max_attempts = max_attempts
+        self._app = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = app.config.get('INSPECTION_WORKERS', self.workers)
+        self.poll_seconds = app.config.get('INSPECTION_POLL_SECONDS', self.poll_seconds)
+        self.job_timeout_seconds = app.config.get('INSPECTION_JOB_TIMEOUT', self.job_timeout_seconds)
+        self.max_attempts = app.config.get('INSPECTION_MAX_ATTEMPTS', self.max_attempts)
+        self.batch_size = app.config.get('INSPECTION_BATCH_SIZE', self.batch_size)
+
+        # A RUNNING job is reclaimed after job_timeout_seconds; keep that longer than a job can
+        # legitimately run, or a slow model call would be claimed again and run twice
+        longest = max(
+            vision_scheduler.longest_call(groq_clients.connect_timeout + groq_clients.read_timeout),
+            app.config.get('INSPECTION_LOCAL_TIMEOUT', 60) * max(1, self.batch_size)
+        )
+        if self.job_timeout_seconds < longest:
+            log.warning('job_timeout_raised', configured=self.job_timeout_seconds, seconds=math.ceil(longest))
+            self.job_timeout_seconds = math.ceil(longest)
+
+        if self.workers > 0:
+            # Pick up jobs left QUEUED or backed off by an earlier process without waiting for an upload
+            app.before_request(self.start)
+
+    def enqueue(self, inspection: InspectionImage) -> InspectionJob:
+        """Add a job for the image to the current session; call notify() after commit"""
+        job = InspectionJob(image=inspection, max_attempts=self.max_attempts)
+        db.session.add(job)
+        return job
+
+    def notify(self):
+        """Wake an idle worker, starting the in-process pool if it is not running yet"""
+        if self.workers > 0:
+            self.start()
+        self._wakeup.set()
+
+    def start(self, workers: int = None):
+        """Start worker threads (idempotent)"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            count = workers if workers is not None else self.workers
+            prefix = f"{socket.gethostname()}:{os.getpid()}"
+            for n in range(count):
+                thread = threading.Thread(
+                    target=self._run, args=(f"{prefix}:{n}",), name=f"inspection-worker-{n}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            log.info('workers_started', workers=count)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id: str):
+        with self._app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    ran = self.run_next(worker_id)
+                except Exception as e:
+                    log.error('worker_error', worker_id=worker_id, error=str(e))
+                    db.session.rollback()
+                    ran = False
+                finally:
+                    db.session.remove()
+                if not ran:
+                    self._wakeup.wait(self.poll_seconds)
+                    self._wakeup.clear()
+
+    def run_next(self, worker_id: str) -> bool:
+        """Claim and run one job (plus its batch). Returns False if none was available."""
+        job_id = self.claim(worker_id)
+        if job_id is None:
+            return False
+        self.run([job_id] + self.claim_batch(job_id, worker_id))
+        return True
+
+    def _claimable(self, now: datetime):
+        stale_before = now - timedelta(seconds=self.job_timeout_seconds)
+        return or_(
+            and_(InspectionJob.status == InspectionJobStatus.QUEUED, InspectionJob.available_at <= now),
+            and_(InspectionJob.status == InspectionJobStatus.RUNNING, InspectionJob.locked_at < stale_before)
+        )
+
+    def claim(self, worker_id: str):
+        """Atomically mark the oldest claimable job RUNNING for this worker and return its id"""
+        now = datetime.utcnow()
+        candidate_ids = [
+            job_id for (job_id,) in db.session.query(InspectionJob.id)
+            .filter(self._claimable(now))
+            .order_by(InspectionJob.id)
+            .limit(5)
+        ]
+        claimed = self._claim_ids(candidate_ids, worker_id, now, limit=1)
+        return claimed[0] if claimed else None
+
+    def claim_batch(self, job_id: int, worker_id: str) -> list:
+        """Claim other claimable jobs for the same reservation as job_id, up to batch_size in total"""
+        if self.batch_size <= 1:
+            return []
+        reservation_id = db.session.query(InspectionImage.reservation_id).join(
+            InspectionJob, InspectionJob.image_id == InspectionImage.id
+        ).filter(InspectionJob.id == job_id).scalar()
+        if reservation_id is None:
+            return []
+
+        now = datetime.utcnow()
+        candidate_ids = [
+            sibling_id for (sibling_id,) in db.session.query(InspectionJob.id)
+            .join(InspectionImage, InspectionJob.image_id == InspectionImage.id)
+            .filter(InspectionImage.reservation_id == reservation_id, InspectionJob.id != job_id, self._claimable(now))
+            .order_by(InspectionJob.id)
+            .limit(self.batch_size - 1)
+        ]
+        return self._claim_ids(candidate_ids, worker_id, now, limit=self.batch_size - 1)
+
+    def _claim_ids(self, candidate_ids: list, worker_id: str, now: datetime, limit: int) -> list:
+        claimed = []
+        for job_id in candidate_ids:
+            if len(claimed) >= limit:
+                break
+            # Conditional UPDATE: only one worker can win a given job
+            result = db.session.execute(
+                update(InspectionJob)
+                .where(InspectionJob.id == job_id, self._claimable(now))
+                .values(
+                    status=InspectionJobStatus.RUNNING,
+                    locked_by=worker_id,
+                    locked_at=now,
+                    started_at=now,
+                    attempts=InspectionJob.attempts + 1
+                )
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                claimed.append(job_id)
+        return claimed
+
+    def run(self, job_ids: list):
+        """Process claimed jobs together, rescheduling them with backoff or failing them on error"""
+        jobs = InspectionJob.query.filter(InspectionJob.id.in_(job_ids)).order_by(InspectionJob.id).all()
+        try:
+            # Verdict, Joint Wait transitions and job completion commit together
+            with SourceCompletionService().transaction():
+                process_inspections([job.image for job in jobs])
+                for job in jobs:
+                    job.status = InspectionJobStatus.DONE
+                    job.finished_at = datetime.utcnow()
+                    job.last_error = None
+            log.info('jobs_done', job_ids=','.join(str(job.id) for job in jobs))
+        except VisionUnavailable as e:
+            log.warning('jobs_deferred', job_ids=','.join(str(job_id) for job_id in job_ids),
+                        retry_after=round(e.retry_after), error=str(e))
+            db.session.rollback()
+            for job in InspectionJob.query.filter(InspectionJob.id.in_(job_ids)).all():
+                job.status = InspectionJobStatus.QUEUED
+                job.attempts = max(0, job.attempts - 1)  # not the job's fault
+                job.available_at = datetime.utcnow() + timedelta(seconds=e.retry_after)
+                job.last_error = str(e)
+            db.session.commit()
+        except Exception as e:
+            log.error('jobs_failed', job_ids=','.join(str(job_id) for job_id in job_ids), error=str(e))
+            db.session.rollback()
+            for job in InspectionJob.query.filter(InspectionJob.id.in_(job_ids)).all():
+                job.last_error = str(e)
+                if job.attempts >= job.max_attempts:
+                    job.status = InspectionJobStatus.FAILED
+                    job.finished_at = datetime.utcnow()
+                    image = job.image
+                    if image:
+                        image.result = InspectionResult.ERROR
+                        image.ai_raw_response = str(e)
+                else:
+                    job.status = InspectionJobStatus.QUEUED
+                    job.available_at = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+            db.session.commit()
+
+    def drain(self, worker_id: str = 'drain') -> int:
+        """Run claimable jobs in the calling thread until none are left; returns how many ran"""
+        count = 0
+        while self.run_next(worker_id):
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        counts = dict(
+            db.session.query(InspectionJob.status, func.count(InspectionJob.id))
+            .group_by(InspectionJob.status)
+            .all()
+        )
+        return {
+            'workers': len(self._threads),
+            **{status.value.lower(): counts.get(status, 0) for status in InspectionJobStatus}
+        }
+
+
+inspection_queue = InspectionJobQueue()
@@ -0,0 +1,320 @@
+"""
+LocalInspectionBackend - offline inspection with CPU image heuristics
+
+For sites without network access (INSPECTION_BACKEND=local). Each image is
+scored in a worker process of a ProcessPoolExecutor (INSPECTION_LOCAL_WORKERS)
+so decoding and filtering never hold up the web or queue threads:
+
+- darkness / overexposure: mean luminance
+- blur: variance of the Laplacian
+- damage (stains, holes, dents in shadow): dark blobs wider than print
+  strokes, found by closing the image (which removes text) and comparing it
+  with a heavily blurred background
+- possible spoilage on 'contents' photos: share of mould-coloured pixels
+- expiry / batch: OCR with Tesseract when pytesseract and the tesseract
+  binary are installed; dates after EXP / BEST BEFORE / USE BY are preferred
+
+The heuristics are deliberately conservative. Only clear damage blocks a
+reservation; unusable photos and weak signals come back as NEEDS_REVIEW
+(LOW_CONFIDENCE) so procurement looks at them, and clean photos never score
+above HEURISTIC_MAX_CONFIDENCE. Results go through the same mapping as the
+Groq backend, so the upload route and Joint Wait flow see the same dict.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from app.services.inspection_backend import InspectionBackend
+from app.utils.images import QUALITY_EDGE, image_quality
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+HEURISTICS_VERSION = 1
+ANALYSIS_EDGE = QUALITY_EDGE      # Images are scored at this longest edge
+DARK_MEAN = 40                    # Mean luminance below this: too dark to judge
+BRIGHT_MEAN = 235                 # ... above this: overexposed
+BLUR_VARIANCE = 40.0              # Laplacian variance below this: too blurry to judge
+STAIN_CONTRAST = 35               # Blob darker than its surroundings by this much
+STAIN_SEVERITY = [(0.15, 'severe'), (0.06, 'moderate'), (0.02, 'minor')]  # Share of stained pixels
+MOULD_FRACTION = 0.12             # Share of mould-coloured pixels on 'contents' photos
+HEURISTIC_MAX_CONFIDENCE = 85
+OCR_EDGE = 2000
+
+_MONTHS = {m: n for n, m in enumerate(
+    ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'], start=1)}
+_EXPIRY_KEYWORD = re.compile(r'\b(EXP(?:IRY|IRES|\.)?|BEST\s+BEFORE(?:\s+END)?|BBE?|USE\s+BY)\b[\s:.]*', re.I)
+_DATE_PATTERNS = [
+    (re.compile(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b'), 'ymd'),
+    (re.compile(r'\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})\b'), 'dmy'),
+    (re.compile(r'\b(\d{1,2})\s*([A-Z]{3})[A-Z]*[\s,.-]*(\d{2,4})\b', re.I), 'd_mon_y'),
+    (re.compile(r'\b([A-Z]{3})[A-Z]*[\s,.-]*(\d{4})\b', re.I), 'mon_y'),
+    (re.compile(r'\b(\d{1,2})[-/.](\d{4})\b'), 'my'),
+]
+_BATCH = re.compile(r'\b(?:LOT|BATCH|L)\s*(?:NO\.?|#)?[\s:.]*([A-Z0-9][A-Z0-9-]{2,})\b', re.I)
+
+
+def _year(value: str) -> int:
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+
+def _month_end(year: int, month: int) -> date:
+    return (date(year + month // 12, month % 12 + 1, 1) - date.resolution)
+
+
+def _to_date(groups: tuple, kind: str):
+    try:
+        if kind == 'ymd':
+            return date(int(groups[0]), int(groups[1]), int(groups[2]))
+        if kind == 'dmy':
+            day, month, year = int(groups[0]), int(groups[1]), _year(groups[2])
+            if month > 12 >= day:  # US-style MM/DD/YYYY
+                day, month = month, day
+            return date(year, month, day)
+        if kind == 'd_mon_y':
+            month = _MONTHS.get(groups[1][:3].upper())
+            return date(_year(groups[2]), month, int(groups[0])) if month else None
+        if kind == 'mon_y':
+            month = _MONTHS.get(groups[0][:3].upper())
+            return _month_end(int(groups[1]), month) if month else None
+        if kind == 'my':
+            return _month_end(int(groups[1]), int(groups[0]))
+    except ValueError:
+        return None
+    return None
+
+
+def parse_expiry_date(text: str) -> tuple:
+    """
+    (date, matched text) for the expiry date in OCR text, or (None, None).
+
+    A date right after an expiry keyword wins; otherwise the latest date on
+    the label (expiry comes after manufacture) is taken.
+    """
+    found = []
+    for pattern, kind in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parsed = _to_date(match.groups(), kind)
+            if parsed and 2000 <= parsed.year <= 2100:
+                found.append((match.start(), match.end(), parsed, match.group(0)))
+    # Keep the longest match where patterns overlap ('05/2026' inside '12/05/2026')
+    dates = []
+    for start, end, parsed, matched in sorted(found, key=lambda f: (f[0], f[0] - f[1])):
+        if not dates or start >= dates[-1][1]:
+            dates.append((start, end, parsed, matched))
+    if not dates:
+        return None, None
+
+    for keyword in _EXPIRY_KEYWORD.finditer(text):
+        following = [d for d in dates if 0 <= d[0] - keyword.end() <= 3]
+        if following:
+            return following[0][2], following[0][3]
+    latest = max(dates, key=lambda d: d[2])
+    return latest[2], latest[3]
+
+
+def _ocr_text(image: Image.Image) -> str:
+    """Label text via Tesseract, or None when it is not installed"""
+    try:
+        import pytesseract
+    except ImportError:
+        return None
+    ocr_image = image.convert('L')
+    ocr_image.thumbnail((OCR_EDGE, OCR_EDGE))
+    try:
+        return pytesseract.image_to_string(ocr_image)
+    except (pytesseract.TesseractNotFoundError, OSError):
+        return None
+
+
+def score_image(image_path: str, image_type: str = 'package', today: str = None) -> dict:
+    """
+    Score one image file and return RESPONSE_SCHEMA fields plus a 'metrics' dict.
+
+    Runs in a worker process; only takes and returns plain values.
+    """
+    with Image.open(image_path) as opened:
+        opened.draft('RGB', (ANALYSIS_EDGE * 2, ANALYSIS_EDGE * 2))
+        image = ImageOps.exif_transpose(opened).convert('RGB')
+    small = image.copy()
+    small.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+    gray_image = small.convert('L')
+
+    quality = image_quality(small)
+    brightness, sharpness = quality['brightness'], quality['sharpness']
+
+    # Closing (max then min filter) removes dark strokes thinner than 7 px, i.e. print and text
+    closed_image = gray_image.filter(ImageFilter.MaxFilter(7)).filter(ImageFilter.MinFilter(7))
+    # Background: a blur wide enough to see past large blobs but still follow uneven lighting
+    background = np.asarray(closed_image.filter(ImageFilter.GaussianBlur(ANALYSIS_EDGE // 3)), dtype=np.float32)
+    closed = np.asarray(closed_image, dtype=np.float32)
+    stain_fraction = float(((background - closed) > STAIN_CONTRAST).mean())
+
+    hsv = np.asarray(small.convert('HSV'), dtype=np.int16)
+    hue, saturation, value = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    mould_fraction = float(((hue >= 40) & (hue <= 130) & (saturation >= 30) & (saturation <= 140) & (value >= 50)).mean())
+
+    metrics = {
+        'brightness': round(brightness, 1),
+        'sharpness': round(sharpness, 1),
+        'stainFraction': round(stain_fraction, 4),
+        'mouldFraction': round(mould_fraction, 4)
+    }
+    findings = []
+    unusable = None
+    if brightness < DARK_MEAN:
+        unusable = 'too dark'
+    elif brightness > BRIGHT_MEAN:
+        unusable = 'overexposed'
+    elif sharpness < BLUR_VARIANCE:
+        unusable = 'too blurry'
+
+    severity = next((label for threshold, label in STAIN_SEVERITY if stain_fraction >= threshold), None)
+    damage_detected = severity is not None and unusable is None
+    if damage_detected:
+        findings.append(f"{severity} dark stain/damage over {stain_fraction:.1%} of the image")
+
+    suspected_spoilage = image_type == 'contents' and mould_fraction >= MOULD_FRACTION
+    if suspected_spoilage:
+        findings.append(f"possible mould/discoloration over {mould_fraction:.0%} of the image")
+
+    expiry, expiry_text, batch = None, None, None
+    if image_type in ('label', 'package') and unusable is None:
+        text = _ocr_text(image)
+        metrics['ocr'] = text is not None
+        if text:
+            expiry, expiry_text = parse_expiry_date(text)
+            batch_match = _BATCH.search(text)
+            batch = batch_match.group(1) if batch_match else None
+
+    reference = date.fromisoformat(today) if today else date.today()
+    is_expired = (expiry < reference) if expiry else None
+
+    if unusable:
+        overall, grade, confidence = 'NEEDS_REVIEW', 'C', 40
+        findings.insert(0, f"photo {unusable} to inspect")
+    elif severity in ('moderate', 'severe'):
+        overall, grade, confidence = 'DAMAGED', 'F' if severity == 'severe' else 'C', 75
+    elif suspected_spoilage or (image_type == 'damage' and not damage_detected):
+        # A damage photo with no visible damage, or colours that might be mould: let a person look
+        overall, grade, confidence = 'NEEDS_REVIEW', 'C', 60
+        if not suspected_spoilage:
+            findings.append('damage photo but no damage found by local heuristics')
+    elif image_type == 'label' and expiry is None:
+        overall, grade, confidence = 'NEEDS_REVIEW', 'C', 60
+        findings.append('no expiry date could be read')
+    else:
+        overall, grade = 'OK', 'B' if damage_detected else 'A'
+        confidence = HEURISTIC_MAX_CONFIDENCE if metrics.get('ocr', True) else HEURISTIC_MAX_CONFIDENCE - 5
+
+    return {
+        'damage_detected': damage_detected,
+        'damage_type': 'stain' if damage_detected else 'none',
+        'damage_severity': severity if damage_detected else 'none',
+        'damage_location': None,
+        'seal_intact': None,
+        'tamper_evidence': False,
+        'spoilage_detected': False,
+        'spoilage_type': 'discoloration' if suspected_spoilage else 'none',
+        'expiry_date_text': expiry_text,
+        'expiry_date_iso': expiry.isoformat() if expiry else None,
+        'is_expired': is_expired,
+        'days_until_expiry': (expiry - reference).days if expiry else None,
+        'batch_number': batch,
+        'overall_result': overall,
+        'confidence_score': confidence,
+        'quality_grade': grade,
+        'explanation': '; '.join(findings) or 'no issues found by local heuristics',
+        'metrics': metrics
+    }
+
+
+class LocalInspectionBackend(InspectionBackend):
+    """Offline inspection backend running score_image() in a process pool"""
+
+    name = 'local'
+
+    def __init__(self, workers: int = 2, timeout_seconds: float = 60):
+        self.workers = workers
+        self.timeout_seconds = timeout_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get('INSPECTION_LOCAL_WORKERS', self.workers)
+        self.timeout_seconds = app.config.get('INSPECTION_LOCAL_TIMEOUT', self.timeout_seconds)
+        self.shutdown()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs worker threads and DB connections is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=max(1, self.workers), mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def analyze_image(self, image_path: str, image_type: str = 'package') -> dict:
+        return self.analyze_images([(image_path, image_type)])[0]
+
+    def analyze_images(self, images: list) -> list:
+        """Score the images in parallel in the process pool"""
+        today = date.today().isoformat()
+        try:
+            executor = self._executor()
+            futures = [executor.submit(score_image, image_path, image_type, today) for image_path, image_type in images]
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+        results = []
+        for future in futures:
+            try:
+                ai_result = future.result(timeout=self.timeout_seconds)
+                results.append(self._map_result(ai_result, json.dumps({'backend': self.name, **ai_result})))
+            except BrokenProcessPool:
+                self.shutdown()  # Rebuilt on the next call; the job queue retries this one
+                raise
+            except FutureTimeoutError:
+                results.append(self._fallback_result('ERROR', 0, f"Local analysis timed out after {self.timeout_seconds}s"))
+            except Exception as e:
+                log.error('local_analysis_failed', error_type=type(e).__name__, error=str(e))
+                results.append(self._fallback_result('ERROR', 0, f"Local analysis error: {str(e)}"))
+        return results
+
+    def prompt_version(self, image_type: str) -> str:
+        settings = (
+            f"local/{HEURISTICS_VERSION}/{image_type}/{ANALYSIS_EDGE}/{DARK_MEAN}/{BRIGHT_MEAN}/{BLUR_VARIANCE}/"
+            f"{STAIN_CONTRAST}/{STAIN_SEVERITY}/{MOULD_FRACTION}/{_ocr_available()}"
+        )
+        return hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]
+
+
+@lru_cache(maxsize=1)
+def _ocr_available() -> bool:
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+local_inspection = LocalInspectionBackend()
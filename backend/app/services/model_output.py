@@ -0,0 +1,341 @@
+"""
+ModelOutputParser - turns vision-model replies into validated inspection fields
+
+Replies are parsed in three steps, cheapest first:
+
+1. json.loads on the reply as-is (JSON mode replies are usually clean)
+2. a single-pass tolerant scanner from the first '{' to its matching '}' that
+   repairs what models commonly get wrong: markdown fences, text around the
+   object, single quotes, True/False/None, bare keys and words, comments,
+   trailing commas, raw newlines in strings and output cut off mid-object
+3. validation against INSPECTION_SCHEMA: values are coerced to the declared
+   type ("85%" -> 85, "Yes" -> true, "Moderate" -> "moderate"), enums are
+   checked, bad values fall back to the field default and missing optional
+   fields are filled in. A reply without a usable overall_result or
+   confidence_score is rejected.
+
+Counts (parsed, repaired, failed, invalid - per image, so a batch reply
+counts once per image) and parse time per reply are kept per prompt type
+('package', 'label', ..., 'batch') and reported by stats().
+"""
+
+import json
+import re
+import threading
+import time
+from datetime import date
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+_FENCE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.S | re.I)
+_IDENTIFIER_START = re.compile(r'[A-Za-z_]')
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_\-]*')
+_BARE_VALUE = re.compile(r'[^,}\]\n]*')
+_KEY_AT_END = re.compile(r'[,{]\s*"(?:[^"\\]|\\.)*"$')
+_DANGLING_KEY = re.compile(r',?\s*"(?:[^"\\]|\\.)*"\s*:?$')
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null', 'none': 'null', 'nan': 'null', 'undefined': 'null'}
+
+# field: (type, allowed values or None, default, required)
+INSPECTION_SCHEMA = {
+    'damage_detected': ('bool', None, False, False),
+    'damage_type': ('enum_open', None, 'none', False),
+    'damage_severity': ('enum', ('none', 'minor', 'moderate', 'severe'), 'none', False),
+    'damage_location': ('str', None, None, False),
+    'seal_intact': ('bool', None, None, False),
+    'tamper_evidence': ('bool', None, False, False),
+    'spoilage_detected': ('bool', None, False, False),
+    'spoilage_type': ('enum_open', None, 'none', False),
+    'expiry_date_text': ('str', None, None, False),
+    'expiry_date_iso': ('date', None, None, False),
+    'is_expired': ('bool', None, None, False),
+    'days_until_expiry': ('int', None, None, False),
+    'batch_number': ('str', None, None, False),
+    'overall_result': ('enum', ('OK', 'DAMAGED', 'EXPIRED', 'SPOILED', 'NEEDS_REVIEW'), None, True),
+    'confidence_score': ('number', (0, 100), None, True),
+    'quality_grade': ('enum', ('A', 'B', 'C', 'F'), 'B', False),
+    'explanation': ('str', None, '', False),
+}
+
+
+class ModelOutputError(ValueError):
+    """The reply could not be turned into a valid inspection result"""
+
+
+class ModelOutputInvalid(ModelOutputError):
+    """The reply parsed, but is not an object or lacks a required field"""
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort JSON text for the first object in text (see module docstring).
+
+    Raises ModelOutputError if there is no '{' at all.
+    """
+    fenced = _FENCE.search(text)
+    if fenced and '{' in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find('{')
+    if start < 0:
+        raise ModelOutputError('No JSON object in response')
+
+    out = []
+    stack = []
+    quote = None
+    escaped = False
+    i, length = start, len(text)
+    while i < length:
+        char = text[i]
+        if quote:
+            if escaped:
+                if char == "'":
+                    out.pop()  # \' is not a JSON escape; the quote needs none inside "..."
+                out.append(char)
+                escaped = False
+            elif char == '\\':
+                out.append(char)
+                escaped = True
+            elif char == quote:
+                out.append('"')
+                quote = None
+            elif char == '"':
+                out.append('\\"')  # inside a single-quoted string
+            elif char == '\n':
+                out.append('\\n')
+            elif char in '\r\t':
+                out.append(' ')
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in '"\'':
+            quote = char
+            out.append('"')
+        elif char == '/' and text.startswith('//', i):
+            newline = text.find('\n', i)
+            i = length if newline < 0 else newline
+            continue
+        elif char == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+            continue
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            out.append(char)
+        elif char in '}]':
+            _drop_trailing_comma(out)
+            if stack and stack[-1] == char:
+                stack.pop()
+            out.append(char)
+            if not stack:
+                break  # End of the object; ignore whatever follows
+        elif _IDENTIFIER_START.match(char):
+            word = _IDENTIFIER.match(text, i).group(0)
+            i += len(word)
+            literal = _LITERALS.get(word.lower())
+            following = text[i:].lstrip()[:1]
+            if following == ':':
+                out.append(json.dumps(word))  # Bare key
+            elif literal is not None:
+                out.append(literal)
+            else:
+                # Bare text value: runs to the next delimiter
+                rest = _BARE_VALUE.match(text, i).group(0)
+                i += len(rest)
+                out.append(json.dumps((word + rest).strip()))
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    # Output cut off: close the open string, drop a dangling key or comma, close brackets
+    if quote:
+        out.append('"')
+    if stack:
+        repaired = ''.join(out).rstrip()
+        if repaired.endswith(':') or (stack[-1] == '}' and _KEY_AT_END.search(repaired)):
+            repaired = _DANGLING_KEY.sub('', repaired)
+        return repaired.rstrip().rstrip(',') + ''.join(reversed(stack))
+    return ''.join(out)
+
+
+def _drop_trailing_comma(out: list):
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ',':
+        del out[index]
+
+
+def _coerce(value, kind: str, allowed):
+    """Value converted to kind, or raise ValueError"""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in ('null', 'none', 'n/a', 'unknown', '') and kind not in ('enum', 'enum_open'):
+            return None
+    if value is None:
+        return None
+
+    if kind == 'bool':
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)):
+            return bool(value)
+        lowered = str(value).lower()
+        if lowered in ('true', 'yes', 'y', '1'):
+            return True
+        if lowered in ('false', 'no', 'n', '0'):
+            return False
+        raise ValueError(f"not a boolean: {value!r}")
+    if kind in ('number', 'int'):
+        if isinstance(value, bool):
+            raise ValueError(f"not a number: {value!r}")
+        number = float(str(value).rstrip('%').strip()) if isinstance(value, str) else float(value)
+        if allowed:
+            number = min(max(number, allowed[0]), allowed[1])
+        return int(round(number)) if kind == 'int' or number.is_integer() else number
+    if kind == 'enum':
+        text = str(value).strip()
+        for option in allowed:
+            if text.lower() == option.lower():
+                return option
+        raise ValueError(f"not one of {', '.join(allowed)}: {value!r}")
+    if kind == 'enum_open':
+        return re.sub(r'[\s-]+', '_', str(value).strip().lower()) or 'none'
+    if kind == 'date':
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    return str(value)
+
+
+def validate_inspection(data: dict, schema: dict = INSPECTION_SCHEMA) -> tuple:
+    """
+    (clean dict, list of issues) for a parsed inspection object.
+
+    Raises ModelOutputInvalid if a required field is missing or unusable.
+    """
+    if not isinstance(data, dict):
+        raise ModelOutputInvalid(f"Expected a JSON object, got {type(data).__name__}")
+    clean = {key: value for key, value in data.items() if key not in schema}
+    issues = []
+    for field, (kind, allowed, default, required) in schema.items():
+        value = data.get(field)
+        try:
+            value = _coerce(value, kind, allowed)
+        except (TypeError, ValueError) as e:
+            issues.append(f"{field}: {str(e)}")
+            value = None
+        if value is None:
+            if required:
+                raise ModelOutputInvalid(f"Missing or invalid {field}")
+            value = default
+        clean[field] = value
+    return clean, issues
+
+
+class ModelOutputParser:
+    """Parses and validates model replies, counting outcomes per prompt type"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def parse_object(self, raw: str, prompt_type: str) -> tuple:
+        """(object, repaired) for the first JSON object in raw; raises ModelOutputError"""
+        started = time.perf_counter()
+        try:
+            try:
+                return json.loads(raw.strip()), False
+            except (json.JSONDecodeError, AttributeError):
+                pass
+            try:
+                return json.loads(repair_json(raw or '')), True
+            except json.JSONDecodeError as e:
+                raise ModelOutputError(f"Unrepairable JSON: {str(e)}")
+        finally:
+            self._record(prompt_type, 'replies')
+            self._record(prompt_type, 'parseSeconds', time.perf_counter() - started)
+
+    def parse_inspection(self, raw: str, prompt_type: str) -> dict:
+        """Validated inspection fields from a single-image reply; raises ModelOutputError"""
+        try:
+            data, repaired = self.parse_object(raw, prompt_type)
+            result, issues = validate_inspection(data)
+        except ModelOutputError as e:
+            self._record(prompt_type, 'invalid' if isinstance(e, ModelOutputInvalid) else 'failed')
+            raise
+        self._count_success(prompt_type, repaired, issues)
+        return result
+
+    def parse_batch(self, raw: str, count: int) -> list:
+        """
+        Validated entries (or None where missing/invalid) for images 1..count of a batch reply.
+
+        Entries are matched by image_index, falling back to position. Raises
+        ModelOutputError if the reply has no usable 'images' list at all.
+        """
+        try:
+            data, repaired = self.parse_object(raw, 'batch')
+            entries = data.get('images') if isinstance(data, dict) else data
+            if not isinstance(entries, list):
+                raise ModelOutputError("Batch response has no 'images' list")
+        except ModelOutputError:
+            self._record('batch', 'failed', count)
+            raise
+
+        by_index = {}
+        for position, entry in enumerate(entries, start=1):
+            if isinstance(entry, dict):
+                try:
+                    index = int(entry.get('image_index', position))
+                except (TypeError, ValueError):
+                    index = position
+                by_index.setdefault(index, entry)
+
+        results, issues = [], []
+        for index in range(1, count + 1):
+            entry = by_index.get(index)
+            try:
+                result, entry_issues = validate_inspection(entry) if entry is not None else (None, [])
+                issues.extend(entry_issues)
+            except ModelOutputError:
+                result = None
+            results.append(result)
+        valid = sum(1 for result in results if result is not None)
+        if valid < count:
+            self._record('batch', 'invalid', count - valid)
+        self._count_success('batch', repaired, issues, valid)
+        return results
+
+    def _count_success(self, prompt_type: str, repaired: bool, issues: list, parsed: int = 1):
+        self._record(prompt_type, 'parsed', parsed)
+        if repaired:
+            self._record(prompt_type, 'repaired')
+        if issues:
+            self._record(prompt_type, 'fieldIssues', len(issues))
+            log.debug('model_output_field_issues', sampled=True, prompt_type=prompt_type, issues='; '.join(issues))
+
+    def _record(self, prompt_type: str, counter: str, amount=1):
+        with self._lock:
+            counts = self._stats.setdefault(prompt_type, {
+                'replies': 0, 'parsed': 0, 'repaired': 0, 'failed': 0, 'invalid': 0, 'fieldIssues': 0,
+                'parseSeconds': 0.0
+            })
+            counts[counter] += amount
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {prompt_type: dict(counts) for prompt_type, counts in self._stats.items()}
+        report = {}
+        for prompt_type, counts in snapshot.items():
+            # Per image: a batch reply counts once per image it should have covered
+            images = counts['parsed'] + counts['failed'] + counts['invalid']
+            report[prompt_type] = {
+                **{key: value for key, value in counts.items() if key != 'parseSeconds'},
+                'failureRate': round((counts['failed'] + counts['invalid']) / images, 4) if images else 0.0,
+                'avgParseMs': round(counts['parseSeconds'] * 1000 / counts['replies'], 3) if counts['replies'] else 0.0
+            }
+        return report
+
+
+model_output = ModelOutputParser()
@@ -0,0 +1,87 @@
+"""
+RecommendationCache - per-process LRU of computed sourcing recommendations
+
+Keyed by (product_id, quantity, delivery city, strategy, availability
+version). The availability version comes from AvailabilityIndex and changes
+whenever a Stock/SupplierStock row for the product (or any Warehouse or
+Supplier) is committed, so a stale entry is simply never looked up again and
+ages out of the LRU. Entries also expire after the availability index TTL,
+which bounds staleness from writes made in other worker processes.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from app.services.availability import availability_index
+from app.services.transit import normalize_city
+
+
+class RecommendationCache:
+    """Recommendation key -> recommendation dict, least recently used evicted first"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (stored_at, recommendation)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_size = app.config.get('RECOMMENDATION_CACHE_SIZE', self.max_size)
+        self.clear()
+
+    @staticmethod
+    def key(product_request, strategy_name: str) -> tuple:
+        """Cache key for a request; capture it before loading availability"""
+        return (
+            product_request.product_id,
+            product_request.quantity,
+            normalize_city(product_request.delivery_city),
+            strategy_name,
+            availability_index.version(product_request.product_id)
+        )
+
+    def get(self, key):
+        """Cached recommendation or None. The returned dict is shared and must not be mutated."""
+        ttl = availability_index.ttl_seconds
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (not ttl or time.monotonic() - entry[0] < ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, recommendation: dict):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), recommendation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+recommendation_cache = RecommendationCache()
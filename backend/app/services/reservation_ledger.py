@@ -0,0 +1,598 @@
+"""
+ReservationLedger - append-only record of reserved stock
+
+Every path that reserves or releases warehouse stock goes through this
+service, which appends a signed delta to reservation_ledger. Local
+reservations are released from the batches recorded in
+reservation_batches when they were made. How the
+delta reaches Stock.reserved_quantity depends on RESERVATION_MODE:
+
+- locking / optimistic: the stock row is updated in place as before and
+  the entry is written with stock_applied=True (audit trail only)
+- ledger: the stock row is not touched. Availability is
+  quantity - reserved_quantity - pending unapplied deltas, and compact()
+  periodically folds those deltas into the row: in ledger mode a daemon
+  thread compacts every RESERVATION_LEDGER_COMPACT_SECONDS (0 = off),
+  starting with the first HTTP request or from inspection_worker.py.
+
+compact() also folds every entry into reservation_balances, the
+materialised reserved quantity per (warehouse, product). rebuild() and
+audit() replay the full ledger to recreate or check those balances.
+"""
+
+import threading
+import time
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import case, func, insert, text, tuple_
+from app import db
+from app.models.ledger import ReservationLedgerEntry, ReservationBalance, LedgerReason
+from app.models.warehouse import Stock
+from app.models.request import ProductRequest, Reservation, ReservationBatch, RequestStatus
+from app.services.availability import availability_index
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+# Namespace for pg_advisory_xact_lock(namespace, stock_id)
+ADVISORY_LOCK_NAMESPACE = 7301
+
+
+class ReservationLedger:
+    """Record, derive and compact reserved quantities"""
+
+    def __init__(self, compact_seconds: float = 30):
+        self.compact_seconds = compact_seconds
+        self.compactions = 0
+        self.compacted_entries = 0
+        self.last_compacted_at = None
+        self.last_entries = 0
+        self.last_duration_ms = 0.0
+        self._app = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self._app = app
+        self.compact_seconds = app.config.get('RESERVATION_LEDGER_COMPACT_SECONDS', self.compact_seconds)
+        if self.compact_seconds > 0 and app.config.get('RESERVATION_MODE') == 'ledger':
+            app.before_request(self.start)
+
+    def start(self):
+        """Start the compaction thread in ledger mode (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None or self.compact_seconds <= 0 or self._app is None \
+                    or self._app.config.get('RESERVATION_MODE') != 'ledger':
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='ledger-compactor', daemon=True)
+            self._thread.start()
+            log.info('ledger_compactor_started', interval_seconds=self.compact_seconds)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join(timeout)
+
+    def _run(self):
+        with self._app.app_context():
+            while not self._stopping.wait(self.compact_seconds):
+                started = time.perf_counter()
+                try:
+                    totals = self.compact()
+                except Exception as e:
+                    log.error('ledger_compaction_failed', error=str(e))
+                    db.session.rollback()
+                    continue
+                finally:
+                    db.session.remove()
+                duration_ms = (time.perf_counter() - started) * 1000
+                with self._lock:
+                    self.compactions += 1
+                    self.compacted_entries += totals['entries']
+                    self.last_entries = totals['entries']
+                    self.last_compacted_at = datetime.utcnow()
+                    self.last_duration_ms = duration_ms
+                if totals['entries']:
+                    log.info('ledger_compacted', duration_ms=round(duration_ms), **totals)
+                else:
+                    log.debug('ledger_compaction_idle', sampled=True, duration_ms=round(duration_ms))
+
+    @staticmethod
+    def ledger_mode() -> bool:
+        return has_app_context() and current_app.config.get('RESERVATION_MODE') == 'ledger'
+
+    def reserve(self, stock: Stock, quantity: int, reason: LedgerReason, request_id: int = None):
+        """Reserve quantity on a stock row"""
+        self._record(stock, quantity, reason, request_id)
+
+    def release(self, stock: Stock, quantity: int, reason: LedgerReason, request_id: int = None):
+        """Release up to quantity from a stock row (never below zero)"""
+        self._record(stock, -min(quantity, self.reserved(stock)), reason, request_id)
+
+    def set_reserved(self, stock: Stock, reserved_quantity: int, reason: LedgerReason = LedgerReason.ADJUST):
+        """Set a stock row's reserved quantity to an absolute value"""
+        self._record(stock, reserved_quantity - self.reserved(stock), reason, None)
+
+    def release_reservation(self, reservation, product_id: int, reason: LedgerReason, quantity: int = None) -> list:
+        """
+        Release a local reservation's stock (all of it, or quantity units).
+
+        Uses the batches recorded when the reservation was made, in order,
+        and adds what was released to their released_quantity. Reservations made before
+        batch tracking fall back to the warehouse's first stock row.
+
+        Returns [(stock, quantity)] for each stock row the units came from.
+        """
+        remaining = reservation.quantity if quantity is None else quantity
+        taken = []
+
+        if reservation.batches:
+            for batch in reservation.batches:
+                if remaining <= 0:
+                    break
+                batch_qty = min(batch.quantity - (batch.released_quantity or 0), remaining)
+                if batch_qty <= 0:
+                    continue
+                if batch.stock is not None:
+                    self.release(batch.stock, batch_qty, reason, reservation.request_id)
+                    taken.append((batch.stock, batch_qty))
+                batch.released_quantity = (batch.released_quantity or 0) + batch_qty
+                remaining -= batch_qty
+            return taken
+
+        stock = Stock.query.filter_by(
+            warehouse_id=reservation.warehouse_id,
+            product_id=product_id
+        ).first()
+        if stock:
+            self.release(stock, remaining, reason, reservation.request_id)
+            taken.append((stock, remaining))
+        return taken
+
+    def reserve_reservation(self, reservation, product_id: int, reason: LedgerReason) -> list:
+        """
+        Reserve a new local reservation's quantity from its warehouse,
+        first-expiry-first-out over unexpired batches, recording a
+        ReservationBatch for each. In ledger mode the stock rows are
+        serialised with lock_stocks() first, as for dealer reservations.
+
+        Raises ValueError if the warehouse cannot cover the quantity.
+        Returns [(stock, quantity)].
+        """
+        stocks = Stock.query.filter(
+            Stock.warehouse_id == reservation.warehouse_id,
+            Stock.product_id == product_id,
+            db.or_(Stock.expiry_date.is_(None), Stock.expiry_date >= datetime.utcnow().date())
+        ).order_by(Stock.expiry_date.asc().nulls_last(), Stock.id).all()
+        if not stocks:
+            stocks = Stock.query.filter_by(warehouse_id=reservation.warehouse_id, product_id=product_id).limit(1).all()
+        if not stocks:
+            raise ValueError(f"No stock for product {product_id} at warehouse {reservation.warehouse_id}")
+
+        if self.ledger_mode():
+            self.lock_stocks([stock.id for stock in stocks])
+            available = self.available_quantities([stock.id for stock in stocks])
+        else:
+            available = {stock.id: stock.quantity - stock.reserved_quantity for stock in stocks}
+
+        taken = {}
+        remaining = reservation.quantity
+        for stock in stocks:
+            batch_qty = min(max(0, available.get(stock.id, 0)), remaining)
+            if batch_qty > 0:
+                taken[stock.id] = batch_qty
+                remaining -= batch_qty
+        if remaining > 0:
+            raise ValueError(f"Insufficient stock available at warehouse {reservation.warehouse_id}. "
+                             f"Requested: {reservation.quantity}, Available: {reservation.quantity - remaining}")
+
+        result = []
+        for stock in stocks:
+            if stock.id not in taken:
+                continue
+            self.reserve(stock, taken[stock.id], reason, reservation.request_id)
+            reservation.batches.append(ReservationBatch(
+                stock=stock,
+                batch_number=stock.batch_number,
+                expiry_date=stock.expiry_date,
+                quantity=taken[stock.id],
+                released_quantity=0
+            ))
+            result.append((stock, taken[stock.id]))
+        return result
+
+    def reserved(self, stock: Stock) -> int:
+        """Current reserved quantity of a stock row, including deltas not yet compacted"""
+        reserved_quantity = stock.reserved_quantity or 0
+        if self.ledger_mode() and stock.id is not None:
+            reserved_quantity += db.session.execute(
+                db.select(func.coalesce(func.sum(ReservationLedgerEntry.delta), 0)).where(
+                    ReservationLedgerEntry.stock_id == stock.id,
+                    ReservationLedgerEntry.stock_applied == False,
+                    ReservationLedgerEntry.compacted_at.is_(None)
+                )
+            ).scalar()
+        return max(0, reserved_quantity)
+
+    def _record(self, stock: Stock, delta: int, reason: LedgerReason, request_id: int):
+        if not delta:
+            return
+        applied = not self.ledger_mode()
+        if applied:
+            stock.reserved_quantity = (stock.reserved_quantity or 0) + delta
+        else:
+            # The stock row is not flushed, so tell the index directly
+            availability_index.track(db.session, {stock.product_id})
+
+        db.session.add(ReservationLedgerEntry(
+            warehouse_id=stock.warehouse_id,
+            product_id=stock.product_id,
+            stock=stock,
+            request_id=request_id,
+            delta=delta,
+            reason=reason,
+            stock_applied=applied
+        ))
+
+    @staticmethod
+    def append_many(rows: list):
+        """
+        Insert many entries with one executemany.
+
+        Each row needs warehouse_id, product_id, stock_id, request_id, delta,
+        reason and stock_applied. The caller is responsible for the stock rows.
+        """
+        if rows:
+            db.session.execute(insert(ReservationLedgerEntry), rows)
+
+    @staticmethod
+    def pending_by_stock():
+        """Subquery of (stock_id, delta): unapplied deltas not yet compacted into the stock row"""
+        return db.select(
+            ReservationLedgerEntry.stock_id.label('stock_id'),
+            func.sum(ReservationLedgerEntry.delta).label('delta')
+        ).where(
+            ReservationLedgerEntry.stock_applied == False,
+            ReservationLedgerEntry.compacted_at.is_(None),
+            ReservationLedgerEntry.stock_id.isnot(None)
+        ).group_by(ReservationLedgerEntry.stock_id).subquery()
+
+    def available_quantities(self, stock_ids) -> dict:
+        """Stock id -> quantity minus reserved, with pending ledger deltas, read in one statement"""
+        pending = self.pending_by_stock()
+        rows = db.session.execute(
+            db.select(Stock.id, Stock.quantity - Stock.reserved_quantity - func.coalesce(pending.c.delta, 0))
+            .outerjoin(pending, pending.c.stock_id == Stock.id)
+            .where(Stock.id.in_(list(stock_ids)))
+        ).all()
+        return {stock_id: available for stock_id, available in rows}
+
+    @staticmethod
+    def lock_stocks(stock_ids):
+        """
+        Serialise ledger reservations per stock row without writing to it.
+
+        Uses transaction-scoped advisory locks on PostgreSQL (released on
+        commit/rollback); other databases rely on their own write locking.
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return
+        for stock_id in sorted(stock_ids):
+            db.session.execute(
+                text('SELECT pg_advisory_xact_lock(:namespace, :stock_id)'),
+                {'namespace': ADVISORY_LOCK_NAMESPACE, 'stock_id': stock_id}
+            )
+
+    def balances(self, keys=None) -> dict:
+        """
+        (warehouse_id, product_id) -> reserved quantity, from the materialised
+        balance plus entries not yet compacted.
+        """
+        result = {}
+        query = ReservationBalance.query
+        if keys is not None:
+            keys = list(keys)
+            if not keys:
+                return result
+            query = query.filter(tuple_(ReservationBalance.warehouse_id, ReservationBalance.product_id).in_(keys))
+        for balance in query.all():
+            result[(balance.warehouse_id, balance.product_id)] = balance.reserved_quantity
+
+        pending = db.select(
+            ReservationLedgerEntry.warehouse_id,
+            ReservationLedgerEntry.product_id,
+            func.sum(ReservationLedgerEntry.delta)
+        ).where(ReservationLedgerEntry.compacted_at.is_(None)).group_by(
+            ReservationLedgerEntry.warehouse_id, ReservationLedgerEntry.product_id
+        )
+        if keys is not None:
+            pending = pending.where(
+                tuple_(ReservationLedgerEntry.warehouse_id, ReservationLedgerEntry.product_id).in_(keys)
+            )
+        for warehouse_id, product_id, delta in db.session.execute(pending).all():
+            result[(warehouse_id, product_id)] = result.get((warehouse_id, product_id), 0) + delta
+        return result
+
+    def compact(self, batch_size: int = None) -> dict:
+        """
+        Fold entries not yet compacted into reservation_balances and, for
+        ledger-mode entries, into Stock.reserved_quantity.
+
+        Works in batches of batch_size entries (RESERVATION_LEDGER_COMPACT_BATCH),
+        one transaction each. On PostgreSQL entries are claimed with
+        FOR UPDATE SKIP LOCKED, so compaction can run alongside reservations
+        and other compactors.
+        """
+        if batch_size is None:
+            batch_size = current_app.config.get('RESERVATION_LEDGER_COMPACT_BATCH', 5000)
+
+        totals = {'entries': 0, 'balances': 0, 'stocks': 0, 'batches': 0}
+        while True:
+            entries = db.session.execute(
+                db.select(
+                    ReservationLedgerEntry.id,
+                    ReservationLedgerEntry.warehouse_id,
+                    ReservationLedgerEntry.product_id,
+                    ReservationLedgerEntry.stock_id,
+                    ReservationLedgerEntry.delta,
+                    ReservationLedgerEntry.stock_applied
+                ).where(ReservationLedgerEntry.compacted_at.is_(None))
+                .order_by(ReservationLedgerEntry.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not entries:
+                break
+
+            key_deltas = {}
+            key_last_ids = {}
+            stock_deltas = {}
+            for entry_id, warehouse_id, product_id, stock_id, delta, stock_applied in entries:
+                key = (warehouse_id, product_id)
+                key_deltas[key] = key_deltas.get(key, 0) + delta
+                key_last_ids[key] = max(key_last_ids.get(key, 0), entry_id)
+                if not stock_applied and stock_id is not None:
+                    stock_deltas[stock_id] = stock_deltas.get(stock_id, 0) + delta
+
+            existing = {
+                (b.warehouse_id, b.product_id): b
+                for b in ReservationBalance.query.filter(
+                    tuple_(ReservationBalance.warehouse_id, ReservationBalance.product_id).in_(list(key_deltas))
+                ).with_for_update().all()
+            }
+            for key, delta in key_deltas.items():
+                balance = existing.get(key)
+                if balance is None:
+                    balance = ReservationBalance(warehouse_id=key[0], product_id=key[1], reserved_quantity=0)
+                    db.session.add(balance)
+                balance.reserved_quantity = (balance.reserved_quantity or 0) + delta
+                balance.last_entry_id = max(balance.last_entry_id or 0, key_last_ids[key])
+
+            # Availability is unchanged (pending moves into the row), so the index stays valid
+            stocks_table = Stock.__table__
+            if stock_deltas:
+                db.session.execute(
+                    stocks_table.update()
+                    .where(stocks_table.c.id.in_(list(stock_deltas)))
+                    .values(
+                        reserved_quantity=stocks_table.c.reserved_quantity + case(stock_deltas, value=stocks_table.c.id),
+                        version=stocks_table.c.version + 1
+                    )
+                )
+
+            entry_ids = [entry[0] for entry in entries]
+            db.session.execute(
+                ReservationLedgerEntry.__table__.update()
+                .where(ReservationLedgerEntry.__table__.c.id.in_(entry_ids))
+                .values(compacted_at=datetime.utcnow())
+            )
+            db.session.commit()
+
+            totals['entries'] += len(entries)
+            totals['balances'] += len(key_deltas)
+            totals['stocks'] += len(stock_deltas)
+            totals['batches'] += 1
+            if len(entries) < batch_size:
+                break
+
+        return totals
+
+    def initialize(self) -> int:
+        """
+        Record OPENING entries for reserved stock that predates the ledger.
+
+        Every local reservation whose request has no ledger entries yet gets
+        one entry per batch still outstanding; reservations made before batch
+        tracking count their whole quantity on the warehouse's first stock
+        row unless the request is COMPLETED or CANCELLED. Stock rows with no
+        ledger entries at all then get one more entry for any reserved
+        quantity those reservations do not explain (manual adjustments).
+
+        Can be run again after reservations have started writing entries:
+        requests and stock rows already in the ledger are skipped.
+        Returns entries written.
+        """
+        ledgered_stock_ids = {
+            stock_id for (stock_id,) in db.session.execute(
+                db.select(ReservationLedgerEntry.stock_id).where(ReservationLedgerEntry.stock_id.isnot(None)).distinct()
+            )
+        }
+        ledgered_requests = db.select(ReservationLedgerEntry.request_id).where(
+            ReservationLedgerEntry.request_id.isnot(None)
+        )
+        reservations = Reservation.query.join(ProductRequest).options(
+            db.selectinload(Reservation.batches).joinedload(ReservationBatch.stock)
+        ).filter(
+            Reservation.warehouse_id.isnot(None),
+            Reservation.quantity > 0,
+            Reservation.request_id.notin_(ledgered_requests)
+        ).order_by(Reservation.id).all()
+
+        rows = []
+        opened = {}
+
+        def opening(stock, quantity, request_id):
+            if stock is None or quantity <= 0:
+                return
+            rows.append({
+                'warehouse_id': stock.warehouse_id,
+                'product_id': stock.product_id,
+                'stock_id': stock.id,
+                'request_id': request_id,
+                'delta': quantity,
+                'reason': LedgerReason.OPENING,
+                'stock_applied': True
+            })
+            opened[stock.id] = opened.get(stock.id, 0) + quantity
+
+        for reservation in reservations:
+            if reservation.batches:
+                for batch in reservation.batches:
+                    opening(batch.stock, batch.quantity - (batch.released_quantity or 0), reservation.request_id)
+            elif reservation.request.status not in (RequestStatus.COMPLETED, RequestStatus.CANCELLED):
+                stock = Stock.query.filter_by(
+                    warehouse_id=reservation.warehouse_id,
+                    product_id=reservation.request.product_id
+                ).order_by(Stock.id).first()
+                opening(stock, reservation.quantity, reservation.request_id)
+
+        for stock in Stock.query.filter(Stock.reserved_quantity > 0).order_by(Stock.id).all():
+            if stock.id not in ledgered_stock_ids:
+                opening(stock, stock.reserved_quantity - opened.get(stock.id, 0), None)
+
+        self.append_many(rows)
+        db.session.commit()
+        return len(rows)
+
+    def replay(self) -> tuple:
+        """
+        Replay the whole ledger.
+
+        Returns ({(warehouse_id, product_id): reserved}, {stock_id: reserved}).
+        """
+        key_totals = {}
+        stock_totals = {}
+        rows = db.session.execute(
+            db.select(
+                ReservationLedgerEntry.warehouse_id,
+                ReservationLedgerEntry.product_id,
+                ReservationLedgerEntry.stock_id,
+                func.sum(ReservationLedgerEntry.delta)
+            ).group_by(
+                ReservationLedgerEntry.warehouse_id,
+                ReservationLedgerEntry.product_id,
+                ReservationLedgerEntry.stock_id
+            )
+        ).all()
+        for warehouse_id, product_id, stock_id, delta in rows:
+            key_totals[(warehouse_id, product_id)] = key_totals.get((warehouse_id, product_id), 0) + delta
+            if stock_id is not None:
+                stock_totals[stock_id] = stock_totals.get(stock_id, 0) + delta
+        return key_totals, stock_totals
+
+    def audit(self) -> list:
+        """
+        Compare replayed ledger totals with reservation_balances (plus
+        pending entries) and with each stock row's reserved quantity.
+
+        Returns a list of discrepancies; empty means consistent.
+        """
+        key_totals, stock_totals = self.replay()
+        problems = []
+
+        balances = self.balances()
+        for key in sorted(set(key_totals) | set(balances)):
+            expected = key_totals.get(key, 0)
+            actual = balances.get(key, 0)
+            if expected != actual:
+                problems.append({
+                    'type': 'balance',
+                    'warehouseId': key[0],
+                    'productId': key[1],
+                    'ledger': expected,
+                    'balance': actual
+                })
+
+        pending = self.pending_by_stock()
+        rows = db.session.execute(
+            db.select(Stock.id, Stock.warehouse_id, Stock.product_id,
+                      Stock.reserved_quantity + func.coalesce(pending.c.delta, 0))
+            .outerjoin(pending, pending.c.stock_id == Stock.id)
+        ).all()
+        for stock_id, warehouse_id, product_id, reserved_quantity in rows:
+            expected = stock_totals.get(stock_id, 0)
+            if expected != (reserved_quantity or 0):
+                problems.append({
+                    'type': 'stock',
+                    'stockId': stock_id,
+                    'warehouseId': warehouse_id,
+                    'productId': product_id,
+                    'ledger': expected,
+                    'stock': reserved_quantity or 0
+                })
+
+        return problems
+
+    def rebuild(self, stocks: bool = False) -> dict:
+        """
+        Recreate reservation_balances from the full ledger. With stocks=True,
+        also reset Stock.reserved_quantity on every row to its replayed total.
+
+        Pending entries are compacted first. Run with reservations paused:
+        entries written while the rebuild runs would be counted twice.
+        """
+        self.compact()
+        key_totals, stock_totals = self.replay()
+        last_ids = {
+            (warehouse_id, product_id): last_id
+            for warehouse_id, product_id, last_id in db.session.execute(
+                db.select(
+                    ReservationLedgerEntry.warehouse_id,
+                    ReservationLedgerEntry.product_id,
+                    func.max(ReservationLedgerEntry.id)
+                ).group_by(ReservationLedgerEntry.warehouse_id, ReservationLedgerEntry.product_id)
+            ).all()
+        }
+
+        ReservationBalance.query.delete()
+        if key_totals:
+            db.session.execute(insert(ReservationBalance), [{
+                'warehouse_id': key[0],
+                'product_id': key[1],
+                'reserved_quantity': total,
+                'last_entry_id': last_ids[key]
+            } for key, total in key_totals.items()])
+
+        stocks_updated = 0
+        if stocks:
+            stocks_table = Stock.__table__
+            reserved = case(stock_totals, value=stocks_table.c.id, else_=0) if stock_totals else 0
+            stocks_updated = db.session.execute(
+                stocks_table.update().values(reserved_quantity=reserved, version=stocks_table.c.version + 1)
+            ).rowcount
+            availability_index.track(db.session)
+
+        db.session.commit()
+        return {'balances': len(key_totals), 'stocks': stocks_updated}
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'intervalSeconds': self.compact_seconds,
+                'compactions': self.compactions,
+                'entries': self.compacted_entries,
+                'lastEntries': self.last_entries,
+                'lastCompactedAt': self.last_compacted_at.isoformat() if self.last_compacted_at else None,
+                'lastDurationMs': round(self.last_duration_ms, 1)
+            }
+
+
+reservation_ledger = ReservationLedger()
@@ -2,16 +2,43 @@
 SourceCompletionService - Core service for Joint Wait model
 
 This service checks if ALL sources (warehouses + suppliers) for a request 
-are complete before transitioning to logistics.
+are complete before transitioning to logistics. The check reads the
+request's sources_ready/sources_total counters, which a flush listener in
+app.models.request updates whenever a reservation's readiness flips, so it
+no longer reloads every reservation.
+
+All changes go through one unit of work (transaction()): the mark_* methods,
+the completion check and the caller's own reservation/request edits are
+flushed together and committed once, instead of a commit per step.
 
 A source is complete when:
 - Warehouse: picked + AI confirmed (OK or procurement-approved)
 - Supplier: confirmed availability + ready for dispatch
 """
 
+from contextlib import contextmanager
 from datetime import datetime
+from sqlalchemy import and_, case, select
 from app import db
 from app.models.request import ProductRequest, Reservation, RequestStatus, ReservationStatus
+from app.models.warehouse import Warehouse
+from app.models.supplier import Supplier
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+_DEPTH_KEY = 'joint_wait_depth'
+
+# Request statuses from which a request moves to READY_FOR_ALLOCATION once all sources are ready
+COMPLETION_STATUSES = [
+    RequestStatus.PICKING,
+    RequestStatus.INSPECTION_PENDING,
+    RequestStatus.PARTIALLY_BLOCKED,
+    RequestStatus.WAITING_FOR_ALL_PICKUPS,
+    RequestStatus.RESOLVED_PARTIAL,
+    RequestStatus.IMPORT_APPROVED
+]
 
 
 class SourceCompletionService:
@@ -22,134 +49,94 @@ class SourceCompletionService:
     System WAITS for ALL sources to complete before transitioning.
     """
     
-    def check_all_sources_ready(self, request_id: int) -> bool:
+    @contextmanager
+    def transaction(self):
         """
-        Check if all warehouse and supplier reservations are ready.
+        Unit of work for Joint Wait state changes.
         
-        Returns True if request was transitioned to READY_FOR_ALLOCATION.
-        Returns False if still waiting for some sources.
+        Everything done inside - by the caller or by the methods below - is
+        committed once when the outermost block exits, or rolled back if it
+        raises. Nested blocks (from any SourceCompletionService instance)
+        join the outer one; the depth is kept on the session.
         """
-        product_request = ProductRequest.query.get(request_id)
-        if not product_request:
-            print(f"[SOURCE_COMPLETION] Request {request_id} not found")
-            return False
-        
-        # Only check if request is in appropriate status
-        valid_statuses = [
-            RequestStatus.PICKING,
-            RequestStatus.INSPECTION_PENDING,
-            RequestStatus.PARTIALLY_BLOCKED,
-            RequestStatus.WAITING_FOR_ALL_PICKUPS,
-            RequestStatus.RESOLVED_PARTIAL,
-            RequestStatus.IMPORT_APPROVED
-        ]
-        
-        if product_request.status not in valid_statuses:
-            print(f"[SOURCE_COMPLETION] Request {request_id} status {product_request.status.value} not eligible for completion check")
-            return False
-        
-        # Get all active reservations (not blocked/replaced)
-        reservations = Reservation.query.filter_by(request_id=request_id).all()
-        
-        if not reservations:
-            print(f"[SOURCE_COMPLETION] Request {request_id} has no reservations")
-            return False
-        
-        all_ready = True
-        summary = []
-        
-        for res in reservations:
-            # Skip zero-quantity (fully replaced) reservations
-            if res.quantity <= 0:
-                continue
-
-            is_ready = self._is_reservation_ready(res)
-            source_type = "Warehouse" if res.warehouse_id else "Supplier"
-            source_id = res.warehouse_id or res.supplier_id
-            
-            summary.append({
-                'reservation_id': res.id,
-                'source_type': source_type,
-                'source_id': source_id,
-                'quantity': res.quantity,
-                'is_ready': is_ready,
-                'status': res.reservation_status.value if res.reservation_status else 'UNKNOWN'
-            })
-            
-            if not is_ready:
-                all_ready = False
-        
-        # Log summary
-        ready_count = sum(1 for s in summary if s['is_ready'])
-        total_count = len(summary)
-        print(f"[SOURCE_COMPLETION] Request {request_id}: {ready_count}/{total_count} sources ready")
-        for s in summary:
-            status_icon = "✓" if s['is_ready'] else "✗"
-            print(f"  {status_icon} {s['source_type']} {s['source_id']}: {s['status']} (qty: {s['quantity']})")
-        
-        if all_ready:
-            return self._transition_to_logistics(product_request)
-        else:
-            # Keep or set WAITING_FOR_ALL_PICKUPS status
-            if product_request.status not in [RequestStatus.PICKING, RequestStatus.INSPECTION_PENDING]:
-                product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+        info = db.session.info
+        depth = info.get(_DEPTH_KEY, 0)
+        info[_DEPTH_KEY] = depth + 1
+        try:
+            yield self
+            if depth == 0:
                 db.session.commit()
-                print(f"[SOURCE_COMPLETION] Request {request_id} set to WAITING_FOR_ALL_PICKUPS")
-            return False
+        except Exception:
+            if depth == 0:
+                db.session.rollback()
+            raise
+        finally:
+            info[_DEPTH_KEY] = depth
     
-    def _is_reservation_ready(self, reservation: Reservation) -> bool:
+    def check_all_sources_ready(self, request_id: int) -> bool:
         """
-        Check if a single reservation/source is ready.
-        
-        Warehouse source is ready when:
-        - is_picked = True AND
-        - (ai_confirmed = True OR procurement_resolved = True) AND
-        - is_blocked = False
+        Check if all warehouse and supplier reservations are ready.
         
-        Supplier source is ready when:
-        - reservation_status in [SUPPLIER_CONFIRMED, READY]
+        Returns True if request was transitioned to READY_FOR_ALLOCATION.
+        Returns False if still waiting for some sources.
         """
-        # Blocked reservations are not ready (they need replacement)
-        if reservation.is_blocked:
-            return False
-        
-        # Warehouse source
-        if reservation.warehouse_id:
-            # Must be picked
-            if not reservation.is_picked:
+        with self.transaction():
+            product_request = ProductRequest.query.get(request_id)
+            if not product_request:
+                log.warning('request_not_found', request_id=request_id)
                 return False
             
-            # Must have AI confirmation or procurement resolution
-            if reservation.ai_confirmed or reservation.procurement_resolved:
-                return True
+            # Only check if request is in appropriate status
+            if product_request.status not in COMPLETION_STATUSES:
+                log.debug('check_skipped', sampled=True, request_id=request_id, status=product_request.status.value)
+                return False
             
-            # Check reservation status
-            if reservation.reservation_status in [
-                ReservationStatus.AI_CONFIRMED,
-                ReservationStatus.READY,
-                ReservationStatus.PROCUREMENT_RESOLVED
-            ]:
-                return True
+            db.session.flush()  # Apply pending reservation changes to the counters
+            if product_request.sources_total is None or product_request.sources_ready is None:
+                # Counters not backfilled yet (see migrate_source_counters.py)
+                self.recount_sources(product_request)
             
-            return False
-        
-        # Supplier source
-        if reservation.supplier_id:
-            # Supplier must confirm availability
-            if reservation.reservation_status in [
-                ReservationStatus.SUPPLIER_CONFIRMED,
-                ReservationStatus.READY
-            ]:
-                return True
+            total_count = product_request.sources_total
+            if not total_count:
+                # Only zero-quantity (fully replaced) reservations left: nothing to wait for
+                if db.session.query(Reservation.query.filter_by(request_id=request_id).exists()).scalar():
+                    return self._transition_to_logistics(product_request)
+                log.info('no_sources', request_id=request_id)
+                return False
             
-            # Legacy check for older reservations
-            if reservation.procurement_resolved:
-                return True
+            log.debug('sources_checked', sampled=True, request_id=request_id,
+                      ready=product_request.sources_ready, total=total_count)
             
-            return False
+            if product_request.sources_pending == 0:
+                return self._transition_to_logistics(product_request)
+            else:
+                # Keep or set WAITING_FOR_ALL_PICKUPS status
+                if product_request.status not in [RequestStatus.PICKING, RequestStatus.INSPECTION_PENDING,
+                                                  RequestStatus.WAITING_FOR_ALL_PICKUPS]:
+                    product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+                    log.info('waiting_for_sources', request_id=request_id,
+                             ready=product_request.sources_ready, total=total_count)
+                return False
+    
+    def _is_reservation_ready(self, reservation: Reservation) -> bool:
+        """Check if a single reservation/source is ready (see Reservation.is_source_ready)"""
+        return reservation.is_source_ready()
+    
+    def recount_sources(self, product_request: ProductRequest):
+        """
+        Rebuild a request's source counters from its reservations.
         
-        # Unknown source type
-        return False
+        The flush listener keeps them current afterwards; this is only needed
+        for rows written before the counters existed or by bulk statements.
+        """
+        total_count = ready_count = 0
+        for res in Reservation.query.filter_by(request_id=product_request.id).all():
+            res.counted_as_ready = res.source_contribution()
+            if res.counted_as_ready is not None:
+                total_count += 1
+                ready_count += res.counted_as_ready
+        product_request.sources_total = total_count
+        product_request.sources_ready = ready_count
     
     def mark_source_ready(self, reservation_id: int, reason: str = None) -> bool:
         """
@@ -164,18 +151,16 @@ class SourceCompletionService:
         """
         reservation = Reservation.query.get(reservation_id)
         if not reservation:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} not found")
+            log.warning('reservation_not_found', reservation_id=reservation_id)
             return False
         
         # Update reservation status to READY
         reservation.reservation_status = ReservationStatus.READY
         reservation.updated_at = datetime.utcnow()
         
-        db.session.commit()
+        log.info('source_marked_ready', reservation_id=reservation_id, reason=reason or 'Not specified')
         
-        print(f"[SOURCE_COMPLETION] Reservation {reservation_id} marked as READY. Reason: {reason or 'Not specified'}")
-        
-        # Trigger completion check for the parent request
+        # Trigger completion check for the parent request (commits the change above with it)
         return self.check_all_sources_ready(reservation.request_id)
     
     def mark_warehouse_ai_confirmed(self, reservation_id: int, ai_result: str) -> bool:
@@ -191,11 +176,11 @@ class SourceCompletionService:
         """
         reservation = Reservation.query.get(reservation_id)
         if not reservation:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} not found")
+            log.warning('reservation_not_found', reservation_id=reservation_id)
             return False
         
         if not reservation.warehouse_id:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} is not a warehouse source")
+            log.warning('not_a_warehouse_source', reservation_id=reservation_id)
             return False
         
         # Update AI confirmation flags
@@ -203,11 +188,9 @@ class SourceCompletionService:
         reservation.ai_confirmation_date = datetime.utcnow()
         reservation.reservation_status = ReservationStatus.AI_CONFIRMED
         
-        db.session.commit()
-        
-        print(f"[SOURCE_COMPLETION] Warehouse reservation {reservation_id} AI confirmed: {ai_result}")
+        log.info('warehouse_source_confirmed', reservation_id=reservation_id, ai_result=ai_result)
         
-        # Trigger completion check
+        # Trigger completion check (commits the change above with it)
         return self.check_all_sources_ready(reservation.request_id)
     
     def mark_procurement_resolved(self, reservation_id: int, resolution_notes: str = None) -> bool:
@@ -225,7 +208,7 @@ class SourceCompletionService:
         """
         reservation = Reservation.query.get(reservation_id)
         if not reservation:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} not found")
+            log.warning('reservation_not_found', reservation_id=reservation_id)
             return False
         
         # Mark as procurement resolved
@@ -235,11 +218,9 @@ class SourceCompletionService:
         reservation.reservation_status = ReservationStatus.PROCUREMENT_RESOLVED
         reservation.is_blocked = False  # Unblock the reservation
         
-        db.session.commit()
+        log.info('source_procurement_resolved', reservation_id=reservation_id, notes=resolution_notes)
         
-        print(f"[SOURCE_COMPLETION] Reservation {reservation_id} procurement resolved. Notes: {resolution_notes or 'None'}")
-        
-        # Trigger completion check
+        # Trigger completion check (commits the change above with it)
         return self.check_all_sources_ready(reservation.request_id)
     
     def mark_supplier_confirmed(self, reservation_id: int) -> bool:
@@ -253,22 +234,20 @@ class SourceCompletionService:
         """
         reservation = Reservation.query.get(reservation_id)
         if not reservation:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} not found")
+            log.warning('reservation_not_found', reservation_id=reservation_id)
             return False
         
         if not reservation.supplier_id:
-            print(f"[SOURCE_COMPLETION] Reservation {reservation_id} is not a supplier source")
+            log.warning('not_a_supplier_source', reservation_id=reservation_id)
             return False
         
         # Update supplier confirmation
         reservation.reservation_status = ReservationStatus.SUPPLIER_CONFIRMED
         reservation.updated_at = datetime.utcnow()
         
-        db.session.commit()
-        
-        print(f"[SOURCE_COMPLETION] Supplier reservation {reservation_id} confirmed")
+        log.info('supplier_source_confirmed', reservation_id=reservation_id)
         
-        # Trigger completion check
+        # Trigger completion check (commits the change above with it)
         return self.check_all_sources_ready(reservation.request_id)
     
     def _transition_to_logistics(self, product_request: ProductRequest) -> bool:
@@ -277,15 +256,11 @@ class SourceCompletionService:
         
         This is the ONLY place where we transition to logistics stage.
         """
-        print(f"[SOURCE_COMPLETION] *** ALL SOURCES READY for request {product_request.id} ***")
-        print(f"[SOURCE_COMPLETION] Transitioning from {product_request.status.value} to READY_FOR_ALLOCATION")
+        log.info('ready_for_allocation', request_id=product_request.id, from_status=product_request.status.value,
+                 sources=product_request.sources_total)
         
         product_request.status = RequestStatus.READY_FOR_ALLOCATION
         product_request.updated_at = datetime.utcnow()
-        
-        db.session.commit()
-        
-        print(f"[SOURCE_COMPLETION] Request {product_request.id} is now READY_FOR_ALLOCATION")
         return True
     
     def get_completion_status(self, request_id: int) -> dict:
@@ -297,50 +272,70 @@ class SourceCompletionService:
         - sources: list of source statuses
         - summary: human-readable summary
         """
-        product_request = ProductRequest.query.get(request_id)
-        if not product_request:
-            return {'error': 'Request not found'}
-        
-        reservations = Reservation.query.filter_by(request_id=request_id).all()
+        return self.get_completion_status_many([request_id]).get(request_id, {'error': 'Request not found'})
+    
+    def get_completion_status_many(self, request_ids: list) -> dict:
+        """
+        Completion status for many requests, keyed by request id.
         
-        sources = []
-        for res in reservations:
-            # Skip zero-quantity (fully replaced) reservations
-            if res.quantity <= 0:
+        One query: requests outer-joined to their quantity > 0 reservations
+        and the warehouse/supplier names, with readiness evaluated in SQL
+        (Reservation.source_ready_clause). Unknown ids are left out.
+        """
+        if not request_ids:
+            return {}
+        rows = db.session.execute(
+            select(
+                ProductRequest.id, ProductRequest.status,
+                Reservation.id, Reservation.warehouse_id, Reservation.supplier_id, Reservation.quantity,
+                Reservation.reservation_status, Reservation.is_picked, Reservation.ai_confirmed,
+                Reservation.procurement_resolved, Reservation.is_blocked,
+                case((Reservation.source_ready_clause(), True), else_=False),
+                Warehouse.name, Supplier.name
+            )
+            .outerjoin(Reservation, and_(Reservation.request_id == ProductRequest.id, Reservation.quantity > 0))
+            .outerjoin(Warehouse, Warehouse.id == Reservation.warehouse_id)
+            .outerjoin(Supplier, Supplier.id == Reservation.supplier_id)
+            .where(ProductRequest.id.in_(set(request_ids)))
+            .order_by(ProductRequest.id, Reservation.id)
+        ).all()
+        
+        statuses = {}
+        for (request_id, request_status, reservation_id, warehouse_id, supplier_id, quantity, reservation_status,
+             is_picked, ai_confirmed, procurement_resolved, is_blocked, is_ready, warehouse_name, supplier_name) in rows:
+            status = statuses.get(request_id)
+            if status is None:
+                status = statuses[request_id] = {
+                    'requestId': request_id,
+                    'requestStatus': request_status.value,
+                    'sources': []
+                }
+            if reservation_id is None:
                 continue
-
-            source_type = "Warehouse" if res.warehouse_id else "Supplier"
-            source_name = None
-            
-            if res.warehouse_id and res.warehouse:
-                source_name = res.warehouse.name
-            elif res.supplier_id and res.supplier:
-                source_name = res.supplier.name
-            
-            sources.append({
-                'reservationId': res.id,
-                'sourceType': source_type,
-                'sourceId': res.warehouse_id or res.supplier_id,
-                'sourceName': source_name,
-                'quantity': res.quantity,
-                'isReady': self._is_reservation_ready(res),
-                'status': res.reservation_status.value if res.reservation_status else 'PENDING',
-                'isPicked': res.is_picked,
-                'aiConfirmed': res.ai_confirmed,
-                'procurementResolved': res.procurement_resolved,
-                'isBlocked': res.is_blocked
+            status['sources'].append({
+                'reservationId': reservation_id,
+                'sourceType': "Warehouse" if warehouse_id else "Supplier",
+                'sourceId': warehouse_id or supplier_id,
+                'sourceName': warehouse_name if warehouse_id else supplier_name,
+                'quantity': quantity,
+                'isReady': bool(is_ready),
+                'status': reservation_status.value if reservation_status else 'PENDING',
+                'isPicked': is_picked,
+                'aiConfirmed': ai_confirmed,
+                'procurementResolved': procurement_resolved,
+                'isBlocked': is_blocked
             })
         
-        ready_count = sum(1 for s in sources if s['isReady'])
-        total_count = len(sources)
-        all_ready = ready_count == total_count and total_count > 0
-        
-        return {
-            'requestId': request_id,
-            'requestStatus': product_request.status.value,
-            'isComplete': all_ready,
-            'readyCount': ready_count,
-            'totalCount': total_count,
-            'sources': sources,
-            'summary': f"{ready_count}/{total_count} sources ready" if not all_ready else "All sources ready for logistics"
-        }
+        for status in statuses.values():
+            sources = status.pop('sources')
+            ready_count = sum(1 for s in sources if s['isReady'])
+            total_count = len(sources)
+            all_ready = ready_count == total_count and total_count > 0
+            status.update({
+                'isComplete': all_ready,
+                'readyCount': ready_count,
+                'totalCount': total_count,
+                'sources': sources,
+                'summary': f"{ready_count}/{total_count} sources ready" if not all_ready else "All sources ready for logistics"
+            })
+        return statuses
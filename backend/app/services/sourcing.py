@@ -1,13 +1,91 @@
+import random
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import case, insert, tuple_
 from app import db
-from app.models.request import ProductRequest, Reservation, RequestStatus, SourceType, ReservationStatus
+from app.models.request import ProductRequest, Reservation, ReservationBatch, SourceType, ReservationStatus
 from app.models.warehouse import Warehouse, Stock
 from app.models.supplier import Supplier, SupplierStock
 from app.services.source_completion import SourceCompletionService
+from app.services.availability import availability_index
+from app.services.allocation import get_strategy
+from app.services.transit import transit_matrix
+from app.services.recommendation_cache import recommendation_cache
+from app.services.reservation_ledger import reservation_ledger
+from app.models.ledger import LedgerReason
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+# Stand-in for a ProductRequest when planning lines that are never persisted
+SimulatedLine = namedtuple('SimulatedLine', ['id', 'product_id', 'quantity', 'delivery_city'])
+
+
+class ReservationMetrics:
+    """
+    Per-process reservation counters, keyed by mode.
+
+    attempts counts planning rounds, so attempts - committed - exhausted is
+    the work thrown away to contention.
+    """
+
+    COUNTERS = ('attempts', 'committed', 'conflicts', 'retries', 'exhausted')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._attempts_per_commit = {}
+
+    def record(self, mode: str, counter: str, attempt: int = None):
+        with self._lock:
+            counters = self._counters.setdefault(mode, dict.fromkeys(self.COUNTERS, 0))
+            counters[counter] += 1
+            if attempt is not None:
+                histogram = self._attempts_per_commit.setdefault(mode, {})
+                histogram[attempt] = histogram.get(attempt, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for mode, counters in self._counters.items():
+                attempts = counters['attempts']
+                result[mode] = dict(
+                    counters,
+                    contentionRate=round(counters['conflicts'] / attempts, 4) if attempts else 0.0,
+                    attemptsPerCommit={str(k): v for k, v in sorted(self._attempts_per_commit.get(mode, {}).items())}
+                )
+            return result
+
+
+reservation_metrics = ReservationMetrics()
+
+
+class StaleAvailability(ValueError):
+    """A locked stock row no longer covers the plan built from the availability index"""
 
 
 class SourcingService:
     """Service for sourcing recommendations and reservation creation"""
 
+    def __init__(self, strategy=None):
+        """
+        Args:
+            strategy: AllocationStrategy instance or registered name; defaults
+                to the SOURCING_STRATEGY config value ('greedy')
+        """
+        if strategy is None and has_app_context():
+            strategy = current_app.config.get('SOURCING_STRATEGY')
+        if strategy is None or isinstance(strategy, str):
+            strategy = get_strategy(strategy)
+        self.strategy = strategy
+
     def get_recommendation(self, product_request: ProductRequest) -> dict:
         """
         Generate sourcing recommendation for a product request.
@@ -17,134 +95,308 @@ class SourcingService:
         - If local stock available but supplier is faster -> IMPORT
         - If all suppliers slower than local -> LOCAL
         - If partial local stock -> compare remaining with imports
-        """
-        requested_qty = product_request.quantity
-        product_id = product_request.product_id
 
-        # Get available local stock across all warehouses
-        local_stocks = Stock.query.filter_by(product_id=product_id).filter(
-            (Stock.quantity - Stock.reserved_quantity) > 0
-        ).order_by((Stock.quantity - Stock.reserved_quantity).desc()).all()
+        Warehouse delivery times come from the transit matrix for the
+        request's delivery city when it is known. Results are cached until
+        the product's availability version changes.
+        """
+        cache_key = recommendation_cache.key(product_request, self.strategy.name)
+        recommendation = recommendation_cache.get(cache_key)
+        if recommendation is not None:
+            return recommendation
+
+        local_options, import_options = availability_index.get(product_request.product_id, self._load_availability)
+        recommendation = self._build_recommendation(
+            product_request.quantity, local_options, import_options, product_request.delivery_city
+        )
+        recommendation_cache.put(cache_key, recommendation)
+        return recommendation
 
-        total_local_available = sum(s.available_quantity for s in local_stocks)
+    def get_recommendations(self, product_requests: list, sequential: bool = False) -> dict:
+        """
+        Generate sourcing recommendations for many requests at once.
 
-        # Get import options
-        supplier_stocks = SupplierStock.query.filter_by(
-            product_id=product_id,
-            is_active=True
-        ).join(SupplierStock.supplier).filter(SupplierStock.available_quantity > 0).order_by(SupplierStock.lead_time_days.asc()).all()
+        Availability for all involved products comes from the in-memory index;
+        products not yet indexed are loaded together in a single pass. Every
+        allocation plan is then computed in memory and is identical to what
+        get_recommendation() returns.
 
-        total_import_available = sum(s.available_quantity for s in supplier_stocks)
+        With sequential=True, each plan consumes the availability it allocates,
+        so later requests for the same product are planned against what is left.
 
-        # Calculate local vs import lead times
-        local_max_days = float('inf')
-        if local_stocks:
-            # Find maximum local delivery time across all warehouses
-            local_max_days = max(
-                stock.warehouse.local_delivery_days if stock.warehouse else 1
-                for stock in local_stocks
+        Returns a dict mapping request id -> recommendation.
+        """
+        product_ids = {r.product_id for r in product_requests}
+        availability = availability_index.get_many(product_ids, self._load_availability)
+        return self._plan(product_requests, availability, sequential)
+
+    def _plan(self, product_requests: list, availability: dict, sequential: bool) -> dict:
+        """Build recommendations from an availability snapshot (never mutated)"""
+        availability = dict(availability)
+        recommendations = {}
+        for product_request in product_requests:
+            local_options, import_options = availability.get(product_request.product_id, ([], []))
+            recommendation = self._build_recommendation(
+                product_request.quantity, local_options, import_options, product_request.delivery_city
             )
+            recommendations[product_request.id] = recommendation
+            if sequential:
+                availability[product_request.product_id] = self._consume(
+                    local_options, import_options, recommendation['allocationPlan']
+                )
+        return recommendations
+
+    def simulate(self, lines: list) -> dict:
+        """
+        What-if sourcing for lines that are not persisted.
 
-        import_min_days = min(
-            (s.lead_time_days for s in supplier_stocks),
-            default=float('inf')
-        )
+        Each line is a dict with productId, quantity and optional city. The
+        lines are planned in order against one availability snapshot, each
+        consuming what it allocates, exactly as a batch of confirmed requests
+        would be. Nothing is written to the database.
 
-        # Priority 1: Speed comparison
-        prefer_import_due_to_speed = (
-            import_min_days < local_max_days and
-            total_import_available >= requested_qty
-        )
+        Returns per-line plans with ETA and import cost, plus batch totals.
+        """
+        started = time.perf_counter()
+        simulated = [
+            SimulatedLine(index, line['productId'], line['quantity'], line.get('city'))
+            for index, line in enumerate(lines)
+        ]
+        availability = availability_index.get_many({line.product_id for line in simulated}, self._load_availability)
+        recommendations = self._plan(simulated, availability, sequential=True)
+
+        today = datetime.utcnow().date()
+        results = []
+        total_cost = {}
+        allocated_total = 0
+        max_eta = 0
+        for line in simulated:
+            recommendation = recommendations[line.id]
+            plan = recommendation['allocationPlan']
+            eta_days = max((a['estimatedDays'] for a in plan), default=None)
+            allocated = sum(a['quantity'] for a in plan)
+
+            cost = {}
+            for alloc in plan:
+                if alloc['source'] == 'import' and alloc.get('currency'):
+                    cost[alloc['currency']] = cost.get(alloc['currency'], 0) + alloc['quantity'] * (alloc['unitPrice'] or 0)
+            for currency, amount in cost.items():
+                total_cost[currency] = total_cost.get(currency, 0) + amount
+
+            allocated_total += allocated
+            if eta_days is not None:
+                max_eta = max(max_eta, eta_days)
+
+            results.append({
+                'line': line.id,
+                'productId': line.product_id,
+                'quantity': line.quantity,
+                'city': line.delivery_city,
+                'sourceType': recommendation['source_type'],
+                'explanation': recommendation['explanation'],
+                'canFulfill': recommendation['canFulfill'],
+                'allocatedQuantity': allocated,
+                'allocationPlan': plan,
+                'etaDays': eta_days,
+                'estimatedDeliveryDate': (today + timedelta(days=eta_days)).isoformat() if eta_days is not None else None,
+                'importCost': {currency: round(amount, 2) for currency, amount in cost.items()}
+            })
+
+        requested_total = sum(line.quantity for line in simulated)
+        return {
+            'allocationStrategy': self.strategy.name,
+            'lines': results,
+            'summary': {
+                'lines': len(results),
+                'requestedQuantity': requested_total,
+                'allocatedQuantity': allocated_total,
+                'shortfall': requested_total - allocated_total,
+                'unfulfilledLines': sum(1 for r in results if not r['canFulfill']),
+                'etaDays': max_eta if results else None,
+                'importCostByCurrency': {currency: round(amount, 2) for currency, amount in total_cost.items()},
+                'elapsedMs': round((time.perf_counter() - started) * 1000, 2)
+            }
+        }
 
-        # Build allocation plan based on preference
-        allocation_plan = []
-        remaining_qty = requested_qty
+    @staticmethod
+    def _consume(local_options: list, import_options: list, allocation_plan: list) -> tuple:
+        """Return copies of the option lists with the plan's quantities taken out"""
+        taken_local = {}
+        taken_import = {}
+        for alloc in allocation_plan:
+            if alloc['source'] == 'local':
+                for batch in alloc['batches']:
+                    taken_local[batch['stockId']] = taken_local.get(batch['stockId'], 0) + batch['quantity']
+            else:
+                taken_import[alloc['supplierId']] = taken_import.get(alloc['supplierId'], 0) + alloc['quantity']
+
+        remaining_local = []
+        for option in local_options:
+            if not any(batch['stockId'] in taken_local for batch in option['batches']):
+                remaining_local.append(option)
+                continue
+            batches = []
+            for batch in option['batches']:
+                available = batch['available'] - taken_local.get(batch['stockId'], 0)
+                if available > 0:
+                    batches.append(dict(batch, available=available))
+            if batches:
+                remaining_local.append(dict(option, available=sum(b['available'] for b in batches), batches=batches))
+        # Keep the loader's ordering: most available first
+        remaining_local.sort(key=lambda o: (-o['available'], o['warehouseId']))
+
+        remaining_import = []
+        for option in import_options:
+            available = option['available'] - taken_import.get(option['supplierId'], 0)
+            if available > 0:
+                remaining_import.append(dict(option, available=available))
+
+        return remaining_local, remaining_import
+
+    def _load_availability(self, product_ids) -> dict:
+        """
+        Load available local and import options for the given products.
 
-        if prefer_import_due_to_speed:
-            # Import is faster, use import even if local stock available
-            source_type = SourceType.IMPORT
-            explanation = f"Import preferred: supplier delivery ({import_min_days} days) is faster than local ({local_max_days} days)."
+        Returns a dict mapping product id -> (local_options, import_options).
+        There is one local option per warehouse holding all of its unexpired
+        batches, earliest expiry first (undated batches last). Local options
+        are sorted by available quantity (desc), import options by lead time
+        (asc), matching the order the allocation walk expects.
+        """
+        product_ids = list(product_ids)
+        availability = {product_id: ([], []) for product_id in product_ids}
+        if not product_ids:
+            return availability
 
-            for supplier_stock in supplier_stocks:
-                if remaining_qty <= 0:
-                    break
-                alloc_qty = min(supplier_stock.available_quantity, remaining_qty)
-                allocation_plan.append({
-                    'source': 'import',
-                    'supplierId': supplier_stock.supplier_id,
-                    'supplierName': supplier_stock.supplier.name if supplier_stock.supplier else None,
-                    'supplierCountry': supplier_stock.supplier.country if supplier_stock.supplier else None,
-                    'quantity': alloc_qty,
-                    'estimatedDays': supplier_stock.lead_time_days
-                })
-                remaining_qty -= alloc_qty
-        else:
-            # Local is viable, allocate from specific warehouses (Madurai and Coimbatore) with fixed quantities
-            # First, try to allocate 50 to Madurai warehouse
-            madurai_stock = next((stock for stock in local_stocks if stock.warehouse and stock.warehouse.city.lower() == 'madurai'), None)
-            if madurai_stock and remaining_qty > 0:
-                alloc_qty = min(50, madurai_stock.available_quantity, remaining_qty)
-                if alloc_qty > 0:
-                    allocation_plan.append({
-                        'source': 'local',
-                        'warehouseId': madurai_stock.warehouse_id,
-                        'warehouseName': madurai_stock.warehouse.name,
-                        'warehouseCity': madurai_stock.warehouse.city,
-                        'quantity': alloc_qty,
-                        'estimatedDays': madurai_stock.warehouse.local_delivery_days
-                    })
-                    remaining_qty -= alloc_qty
-
-            # Then, try to allocate 50 to Coimbatore warehouse
-            coimbatore_stock = next((stock for stock in local_stocks if stock.warehouse and stock.warehouse.city.lower() == 'coimbatore'), None)
-            if coimbatore_stock and remaining_qty > 0:
-                alloc_qty = min(50, coimbatore_stock.available_quantity, remaining_qty)
-                if alloc_qty > 0:
-                    allocation_plan.append({
-                        'source': 'local',
-                        'warehouseId': coimbatore_stock.warehouse_id,
-                        'warehouseName': coimbatore_stock.warehouse.name,
-                        'warehouseCity': coimbatore_stock.warehouse.city,
-                        'quantity': alloc_qty,
-                        'estimatedDays': coimbatore_stock.warehouse.local_delivery_days
-                    })
-                    remaining_qty -= alloc_qty
-
-            # If still remaining quantity after allocating to Madurai and Coimbatore, allocate from other warehouses
-            if remaining_qty > 0:
-                for stock in local_stocks:
-                    # Skip Madurai and Coimbatore as we already allocated to them
-                    if stock.warehouse and stock.warehouse.city.lower() in ['madurai', 'coimbatore']:
-                        continue
-                    if remaining_qty <= 0:
-                        break
-                    alloc_qty = min(stock.available_quantity, remaining_qty)
-                    if alloc_qty > 0:
-                        allocation_plan.append({
-                            'source': 'local',
-                            'warehouseId': stock.warehouse_id,
-                            'warehouseName': stock.warehouse.name if stock.warehouse else None,
-                            'warehouseCity': stock.warehouse.city if stock.warehouse else None,
-                            'quantity': alloc_qty,
-                            'estimatedDays': stock.warehouse.local_delivery_days if stock.warehouse else 1
-                        })
-                        remaining_qty -= alloc_qty
-
-            # If still remaining, allocate from suppliers
-            if remaining_qty > 0:
-                for supplier_stock in supplier_stocks:
-                    if remaining_qty <= 0:
-                        break
-                    alloc_qty = min(supplier_stock.available_quantity, remaining_qty)
-                    allocation_plan.append({
-                        'source': 'import',
-                        'supplierId': supplier_stock.supplier_id,
-                        'supplierName': supplier_stock.supplier.name if supplier_stock.supplier else None,
-                        'supplierCountry': supplier_stock.supplier.country if supplier_stock.supplier else None,
-                        'quantity': alloc_qty,
-                        'estimatedDays': supplier_stock.lead_time_days
-                    })
-                    remaining_qty -= alloc_qty
+        # Get available local stock across all warehouses
+        available_expr = Stock.quantity - Stock.reserved_quantity
+        pending = None
+        if reservation_ledger.ledger_mode():
+            # Ledger mode: subtract reservations not yet compacted into the row
+            pending = reservation_ledger.pending_by_stock()
+            available_expr = available_expr - db.func.coalesce(pending.c.delta, 0)
+
+        query = db.session.query(Stock, available_expr).options(db.joinedload(Stock.warehouse))
+        if pending is not None:
+            query = query.outerjoin(pending, pending.c.stock_id == Stock.id)
+
+        # Walks ix_stocks_product_expiry: batches come back per product in FEFO order
+        local_stocks = query.filter(
+            Stock.product_id.in_(product_ids),
+            available_expr > 0,
+            db.or_(Stock.expiry_date.is_(None), Stock.expiry_date >= datetime.utcnow().date())
+        ).order_by(Stock.product_id, Stock.expiry_date.asc().nulls_last(), Stock.id).all()
+
+        warehouse_options = {}
+        for stock, available in local_stocks:
+            option = warehouse_options.get((stock.product_id, stock.warehouse_id))
+            if option is None:
+                option = self._local_option(stock)
+                warehouse_options[(stock.product_id, stock.warehouse_id)] = option
+                availability[stock.product_id][0].append(option)
+            option['batches'].append(self._batch_option(stock, available))
+            option['available'] += available
+
+        for local_options, _ in availability.values():
+            local_options.sort(key=lambda o: (-o['available'], o['warehouseId']))
+
+        # Get import options
+        supplier_stocks = SupplierStock.query.join(SupplierStock.supplier).options(
+            db.contains_eager(SupplierStock.supplier)
+        ).filter(
+            SupplierStock.product_id.in_(product_ids),
+            SupplierStock.is_active == True,
+            SupplierStock.available_quantity > 0
+        ).order_by(SupplierStock.lead_time_days.asc(), SupplierStock.id).all()
+
+        for supplier_stock in supplier_stocks:
+            availability[supplier_stock.product_id][1].append(self._import_option(supplier_stock))
+
+        return availability
+
+    @staticmethod
+    def _local_option(stock: Stock) -> dict:
+        """Empty allocation candidate for a Stock row's warehouse; batches are added by the loader"""
+        warehouse = stock.warehouse
+        delivery_days = warehouse.local_delivery_days if warehouse else 1
+        return {
+            'warehouseId': stock.warehouse_id,
+            'warehouseCode': warehouse.code if warehouse else None,
+            'warehouseName': warehouse.name if warehouse else None,
+            'warehouseCity': warehouse.city if warehouse else None,
+            'available': 0,
+            'deliveryDays': delivery_days,
+            'defaultDeliveryDays': delivery_days,
+            'transitDays': None,
+            'batches': []
+        }
+
+    @staticmethod
+    def _batch_option(stock: Stock, available: int) -> dict:
+        """One Stock batch within a local option"""
+        return {
+            'stockId': stock.id,
+            'batchNumber': stock.batch_number,
+            'expiryDate': stock.expiry_date.isoformat() if stock.expiry_date else None,
+            'available': available,
+            'version': stock.version
+        }
+
+    @staticmethod
+    def _import_option(supplier_stock: SupplierStock) -> dict:
+        """Flatten a SupplierStock row (and its supplier) into a plain allocation candidate"""
+        supplier = supplier_stock.supplier
+        return {
+            'supplierStockId': supplier_stock.id,
+            'supplierId': supplier_stock.supplier_id,
+            'productId': supplier_stock.product_id,
+            'supplierName': supplier.name if supplier else None,
+            'supplierCountry': supplier.country if supplier else None,
+            'available': supplier_stock.available_quantity,
+            'leadTimeDays': supplier_stock.lead_time_days,
+            'unitPrice': float(supplier_stock.unit_price) if supplier_stock.unit_price else 0,
+            'currency': supplier_stock.currency,
+            'reliability': float(supplier.reliability_score) if supplier and supplier.reliability_score else 0.8,
+            'version': supplier_stock.version
+        }
+
+    @staticmethod
+    def _localize(local_options: list, delivery_city: str) -> list:
+        """
+        Copies of the local options with deliveryDays taken from the transit
+        matrix for delivery_city, nearest warehouse first. Options are
+        returned unchanged when the city is not in the matrix.
+        """
+        if not local_options or not delivery_city or not transit_matrix.knows_city(delivery_city):
+            return local_options
+
+        localized = []
+        for option in local_options:
+            transit_days = transit_matrix.days(option['warehouseCode'], delivery_city)
+            localized.append(dict(
+                option,
+                transitDays=transit_days,
+                deliveryDays=transit_days if transit_days is not None else option['defaultDeliveryDays']
+            ))
+        localized.sort(key=lambda o: (o['deliveryDays'], -o['available'], o['warehouseId']))
+        return localized
+
+    def _build_recommendation(self, requested_qty: int, local_stocks: list, supplier_stocks: list,
+                              delivery_city: str = None) -> dict:
+        """Compute the recommendation for one request from pre-loaded local/import options"""
+        local_stocks = self._localize(local_stocks, delivery_city)
+        distance_aware = any(s.get('transitDays') is not None for s in local_stocks)
+
+        total_local_available = sum(s['available'] for s in local_stocks)
+        total_import_available = sum(s['available'] for s in supplier_stocks)
+
+        # Calculate local vs import lead times
+        local_max_days = max((s['deliveryDays'] for s in local_stocks), default=float('inf'))
+        import_min_days = min((s['leadTimeDays'] for s in supplier_stocks), default=float('inf'))
+
+        allocation_plan, prefer_import_due_to_speed = self.strategy.allocate(
+            requested_qty, local_stocks, supplier_stocks
+        )
 
         # Determine source type
         local_allocated = sum(a['quantity'] for a in allocation_plan if a['source'] == 'local')
@@ -174,6 +426,9 @@ class SourcingService:
             'requestedQuantity': requested_qty,
             'canFulfill': (local_allocated + import_allocated) >= requested_qty,
             'allocationPlan': allocation_plan,
+            'allocationStrategy': self.strategy.name,
+            'deliveryCity': delivery_city,
+            'distanceAware': distance_aware,
             'preferImportSpeed': prefer_import_due_to_speed,
             'localMaxDays': local_max_days if local_max_days != float('inf') else None,
             'importMinDays': import_min_days if import_min_days != float('inf') else None
@@ -181,72 +436,386 @@ class SourcingService:
     
     def create_reservations(self, product_request: ProductRequest) -> list:
         """Create reservations based on the sourcing recommendation with overbooking prevention"""
-        recommendation = self.get_recommendation(product_request)
-        reservations = []
-
-        try:
-            # Use database transaction for atomicity
-            for alloc in recommendation['allocationPlan']:
-                if alloc['source'] == 'local':
-                    # Atomic stock reservation with conflict detection
-                    stock = Stock.query.filter_by(
-                        warehouse_id=alloc['warehouseId'],
-                        product_id=product_request.product_id
-                    ).with_for_update().first()
-
-                    if not stock:
-                        raise ValueError(f"Stock not found for warehouse {alloc['warehouseId']}")
-
-                    available_qty = stock.quantity - stock.reserved_quantity
-                    if available_qty < alloc['quantity']:
-                        raise ValueError(f"Insufficient stock available at warehouse {alloc['warehouseId']}. "
-                                       f"Requested: {alloc['quantity']}, Available: {available_qty}")
-
-                    # Create local reservation
-                    reservation = Reservation(
-                        request_id=product_request.id,
-                        warehouse_id=alloc['warehouseId'],
-                        quantity=alloc['quantity'],
-                        is_local=True
-                    )
-
-                    # Update stock reservation
-                    stock.reserved_quantity += alloc['quantity']
+        return self.create_reservations_bulk([product_request])[product_request.id]
 
-                else:
-                    # For imports, just check if supplier has stock (no reservation updates)
-                    supplier_stock = SupplierStock.query.filter_by(
-                        supplier_id=alloc['supplierId'],
-                        product_id=product_request.product_id
-                    ).with_for_update().first()
+    def create_reservations_bulk(self, product_requests: list, mode: str = None) -> dict:
+        """
+        Create reservations for many requests in one transaction.
 
-                    if not supplier_stock or supplier_stock.available_quantity < alloc['quantity']:
-                        raise ValueError(f"Insufficient import stock from supplier {alloc['supplierId']}")
+        Args:
+            mode: 'locking' (SELECT ... FOR UPDATE), 'optimistic' (version
+                compare-and-swap with retries) or 'ledger' (append-only
+                ledger, no stock row writes); defaults to the
+                RESERVATION_MODE config value
 
-                    # Create import reservation
-                    reservation = Reservation(
-                        request_id=product_request.id,
-                        supplier_id=alloc['supplierId'],
-                        quantity=alloc['quantity'],
-                        is_local=False,
-                        # AUTO-CONFIRM IMPORT: Direct to logistics
-                        reservation_status=ReservationStatus.SUPPLIER_CONFIRMED
-                    )
+        Returns a dict mapping request id -> list of created reservations.
+        """
+        if mode is None and has_app_context():
+            mode = current_app.config.get('RESERVATION_MODE')
+        mode = mode or 'locking'
+
+        if mode == 'optimistic':
+            return self._create_reservations_retrying(product_requests, mode, self._compare_and_swap)
+        if mode == 'ledger':
+            return self._create_reservations_retrying(product_requests, mode, self._append_to_ledger)
+        if mode != 'locking':
+            raise ValueError(f"Unknown reservation mode: {mode}")
+        return self._create_reservations_locking(product_requests)
+
+    def _create_reservations_locking(self, product_requests: list) -> dict:
+        """
+        Pessimistic path.
+
+        All Stock and SupplierStock rows the allocation plans touch are locked
+        with a single SELECT ... FOR UPDATE each, always in primary-key order
+        (stocks before supplier stocks) so concurrent callers cannot deadlock.
+        The reserved_quantity increments are then applied with one UPDATE and
+        every Reservation row is inserted with one executemany.
+
+        The first plan comes from the availability index. If the locked rows
+        no longer cover it (another process reserved the stock since the
+        index was loaded), the products are dropped from the index, all of
+        their rows are locked and the batch is planned once more from those
+        locked rows.
+        """
+        product_ids = {r.product_id for r in product_requests}
+        reservation_metrics.record('locking', 'attempts')
+        recommendations = self.get_recommendations(product_requests, sequential=True)
 
-                db.session.add(reservation)
-                reservations.append(reservation)
+        try:
+            try:
+                reservations = self._reserve_locked(product_requests, recommendations)
+                attempt = 1
+            except StaleAvailability:
+                db.session.rollback()
+                availability_index.invalidate(product_ids)
+                reservation_metrics.record('locking', 'conflicts')
+                reservation_metrics.record('locking', 'retries')
+                reservation_metrics.record('locking', 'attempts')
+
+                self._lock_products(product_ids)
+                recommendations = self._plan(product_requests, self._load_availability(product_ids), sequential=True)
+                reservations = self._reserve_locked(product_requests, recommendations)
+                attempt = 2
 
             db.session.commit()
+            reservation_metrics.record('locking', 'committed', attempt=attempt)
             return reservations
 
         except Exception as e:
             # Rollback on any error
             db.session.rollback()
+            if isinstance(e, StaleAvailability):
+                reservation_metrics.record('locking', 'exhausted')
             # Re-raise with meaningful message
             if "could not serialize access" in str(e).lower():
+                reservation_metrics.record('locking', 'conflicts')
                 raise ValueError("Concurrent reservation conflict - please try again") from e
             raise
 
+    @staticmethod
+    def _lock_products(product_ids: set):
+        """Lock every Stock and SupplierStock row of the products, in primary-key order"""
+        Stock.query.filter(
+            Stock.product_id.in_(sorted(product_ids))
+        ).order_by(Stock.id).with_for_update().populate_existing().all()
+        SupplierStock.query.filter(
+            SupplierStock.product_id.in_(sorted(product_ids))
+        ).order_by(SupplierStock.id).with_for_update().populate_existing().all()
+
+    def _reserve_locked(self, product_requests: list, recommendations: dict) -> dict:
+        """
+        Lock the rows the plans use, check them and write the reservations.
+
+        Raises StaleAvailability when a locked row cannot cover its plan line.
+        Does not commit.
+        """
+        stock_ids = set()
+        import_keys = set()
+        for product_request in product_requests:
+            for alloc in recommendations[product_request.id]['allocationPlan']:
+                if alloc['source'] == 'local':
+                    stock_ids.update(batch['stockId'] for batch in alloc['batches'])
+                else:
+                    import_keys.add((alloc['supplierId'], product_request.product_id))
+
+        stocks = []
+        if stock_ids:
+            stocks = Stock.query.filter(
+                Stock.id.in_(sorted(stock_ids))
+            ).order_by(Stock.id).with_for_update().populate_existing().all()
+
+        supplier_stocks = []
+        if import_keys:
+            supplier_stocks = SupplierStock.query.filter(
+                tuple_(SupplierStock.supplier_id, SupplierStock.product_id).in_(sorted(import_keys))
+            ).order_by(SupplierStock.id).with_for_update().populate_existing().all()
+
+        # Remaining availability per locked row, consumed as allocations are applied
+        stock_available = {s.id: s.quantity - s.reserved_quantity for s in stocks}
+        supplier_stock_by_key = {(s.supplier_id, s.product_id): s for s in supplier_stocks}
+
+        increments = {}
+        planned = []
+
+        for product_request in product_requests:
+            for alloc in recommendations[product_request.id]['allocationPlan']:
+                if alloc['source'] == 'local':
+                    for batch in alloc['batches']:
+                        stock_id = batch['stockId']
+                        if stock_id not in stock_available:
+                            raise StaleAvailability(f"Stock not found for warehouse {alloc['warehouseId']}")
+
+                        available_qty = stock_available[stock_id]
+                        if available_qty < batch['quantity']:
+                            raise StaleAvailability(f"Insufficient stock available at warehouse {alloc['warehouseId']}. "
+                                                    f"Requested: {batch['quantity']}, Available: {available_qty}")
+
+                        stock_available[stock_id] -= batch['quantity']
+                        increments[stock_id] = increments.get(stock_id, 0) + batch['quantity']
+
+                else:
+                    # For imports, just check if supplier has stock (no reservation updates)
+                    supplier_stock = supplier_stock_by_key.get((alloc['supplierId'], product_request.product_id))
+                    if not supplier_stock or supplier_stock.available_quantity < alloc['quantity']:
+                        raise StaleAvailability(f"Insufficient import stock from supplier {alloc['supplierId']}")
+
+                planned.append((product_request, alloc))
+
+        if increments:
+            stocks_table = Stock.__table__
+            db.session.execute(
+                stocks_table.update()
+                .where(stocks_table.c.id.in_(list(increments)))
+                .values(
+                    reserved_quantity=stocks_table.c.reserved_quantity + case(increments, value=stocks_table.c.id),
+                    version=stocks_table.c.version + 1
+                )
+            )
+            for stock in stocks:
+                if stock.id in increments:
+                    db.session.expire(stock, ['reserved_quantity', 'version'])
+            availability_index.track(db.session, {stock.product_id for stock in stocks})
+
+        reservation_ledger.append_many(self._ledger_rows(planned, stock_applied=True))
+        return self._insert_reservations(product_requests, planned)
+
+    def _create_reservations_retrying(self, product_requests: list, mode: str, apply) -> dict:
+        """
+        Plan without locks, apply, and re-plan on conflict.
+
+        apply(planned, availability) writes the stock side of the
+        (product_request, plan line) pairs and returns False if the snapshot
+        the plan was built from is no longer valid. The transaction is then rolled back,
+        the products are dropped from the availability index and the whole
+        batch is re-planned against fresh rows, up to RESERVATION_MAX_ATTEMPTS
+        times with full-jitter exponential backoff.
+        """
+        max_attempts = 5
+        base_delay_ms = 20
+        max_delay_ms = 500
+        if has_app_context():
+            max_attempts = current_app.config.get('RESERVATION_MAX_ATTEMPTS', max_attempts)
+            base_delay_ms = current_app.config.get('RESERVATION_RETRY_BASE_MS', base_delay_ms)
+            max_delay_ms = current_app.config.get('RESERVATION_RETRY_MAX_MS', max_delay_ms)
+
+        product_ids = {r.product_id for r in product_requests}
+
+        for attempt in range(1, max(1, max_attempts) + 1):
+            reservation_metrics.record(mode, 'attempts')
+            availability = availability_index.get_many(product_ids, self._load_availability)
+            recommendations = self._plan(product_requests, availability, sequential=True)
+
+            planned = [
+                (product_request, alloc)
+                for product_request in product_requests
+                for alloc in recommendations[product_request.id]['allocationPlan']
+            ]
+
+            try:
+                if apply(planned, availability):
+                    reservations = self._insert_reservations(product_requests, planned)
+                    db.session.commit()
+                    reservation_metrics.record(mode, 'committed', attempt=attempt)
+                    return reservations
+            except Exception:
+                db.session.rollback()
+                raise
+
+            # Lost the race: discard the work and re-plan from fresh rows
+            db.session.rollback()
+            reservation_metrics.record(mode, 'conflicts')
+            availability_index.invalidate(product_ids)
+
+            if attempt < max_attempts:
+                reservation_metrics.record(mode, 'retries')
+                delay_ms = min(max_delay_ms, base_delay_ms * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, delay_ms) / 1000.0)
+
+        reservation_metrics.record(mode, 'exhausted')
+        raise ValueError("Concurrent reservation conflict - please try again")
+
+    def _compare_and_swap(self, planned: list, availability: dict) -> bool:
+        """
+        Apply the plans' stock increments if every row is still at the
+        version the plans were computed from. Returns False on a conflict.
+        """
+        stock_versions = {}
+        supplier_stock_versions = {}
+        for local_options, import_options in availability.values():
+            stock_versions.update((b['stockId'], b['version']) for o in local_options for b in o['batches'])
+            supplier_stock_versions.update(((o['supplierId'], o['productId']), (o['supplierStockId'], o['version']))
+                                           for o in import_options)
+
+        increments = self._batch_increments(planned)
+        expected_supplier_stocks = {
+            supplier_stock_versions[(alloc['supplierId'], product_request.product_id)]
+            for product_request, alloc in planned
+            if alloc['source'] == 'import'
+        }
+
+        # Supplier availability is not decremented by reservations; only make
+        # sure the rows the plan used have not changed since the snapshot
+        if expected_supplier_stocks:
+            unchanged = db.session.execute(
+                db.select(db.func.count()).select_from(SupplierStock).where(
+                    tuple_(SupplierStock.id, SupplierStock.version).in_(sorted(expected_supplier_stocks))
+                )
+            ).scalar()
+            if unchanged != len(expected_supplier_stocks):
+                return False
+
+        if increments:
+            stocks_table = Stock.__table__
+            increment = case(increments, value=stocks_table.c.id)
+            result = db.session.execute(
+                stocks_table.update()
+                .where(tuple_(stocks_table.c.id, stocks_table.c.version).in_(
+                    sorted((stock_id, stock_versions[stock_id]) for stock_id in increments)
+                ))
+                .where(stocks_table.c.quantity - stocks_table.c.reserved_quantity >= increment)
+                .values(
+                    reserved_quantity=stocks_table.c.reserved_quantity + increment,
+                    version=stocks_table.c.version + 1
+                )
+            )
+            if result.rowcount != len(increments):
+                return False
+
+            for stock in db.session.identity_map.values():
+                if isinstance(stock, Stock) and stock.id in increments:
+                    db.session.expire(stock, ['reserved_quantity', 'version'])
+            availability_index.track(db.session, {product_request.product_id for product_request, _ in planned})
+
+        reservation_ledger.append_many(self._ledger_rows(planned, stock_applied=True))
+        return True
+
+    def _append_to_ledger(self, planned: list, availability: dict) -> bool:
+        """
+        Ledger mode: record the plans as ledger entries without writing to
+        the stock rows, then re-read availability (stock row minus pending
+        entries, including our own) in one statement. Returns False if any
+        row went negative, i.e. the plan was built from a stale snapshot.
+        """
+        stock_ids = set(self._batch_increments(planned))
+        if not stock_ids:
+            return True
+
+        reservation_ledger.lock_stocks(stock_ids)
+        reservation_ledger.append_many(self._ledger_rows(planned, stock_applied=False))
+        availability_index.track(db.session, {product_request.product_id for product_request, _ in planned})
+
+        available = reservation_ledger.available_quantities(stock_ids)
+        return len(available) == len(stock_ids) and all(qty >= 0 for qty in available.values())
+
+    @staticmethod
+    def _batch_increments(planned: list) -> dict:
+        """Stock id -> quantity the local plan lines take from that batch"""
+        increments = {}
+        for _, alloc in planned:
+            if alloc['source'] == 'local':
+                for batch in alloc['batches']:
+                    increments[batch['stockId']] = increments.get(batch['stockId'], 0) + batch['quantity']
+        return increments
+
+    @staticmethod
+    def _ledger_rows(planned: list, stock_applied: bool) -> list:
+        """Ledger INSERT parameters, one per batch of each local plan line"""
+        return [{
+            'warehouse_id': alloc['warehouseId'],
+            'product_id': product_request.product_id,
+            'stock_id': batch['stockId'],
+            'request_id': product_request.id,
+            'delta': batch['quantity'],
+            'reason': LedgerReason.RESERVE,
+            'stock_applied': stock_applied
+        } for product_request, alloc in planned
+            if alloc['source'] == 'local'
+            for batch in alloc['batches']]
+
+    @staticmethod
+    def _reservation_row(product_request: ProductRequest, alloc: dict) -> dict:
+        """Reservation INSERT parameters for one allocation plan line"""
+        if alloc['source'] == 'local':
+            return {
+                'request_id': product_request.id,
+                'warehouse_id': alloc['warehouseId'],
+                'supplier_id': None,
+                'quantity': alloc['quantity'],
+                'is_local': True,
+                'reservation_status': ReservationStatus.PENDING,
+                'counted_as_ready': False
+            }
+        return {
+            'request_id': product_request.id,
+            'warehouse_id': None,
+            'supplier_id': alloc['supplierId'],
+            'quantity': alloc['quantity'],
+            'is_local': False,
+            # AUTO-CONFIRM IMPORT: Direct to logistics
+            'reservation_status': ReservationStatus.SUPPLIER_CONFIRMED,
+            'counted_as_ready': True
+        }
+
+    def _insert_reservations(self, product_requests: list, planned: list) -> dict:
+        """
+        Insert a Reservation per plan line with one executemany, then the
+        ReservationBatch rows of the local lines with another. Returns the
+        reservations grouped by request id.
+        """
+        created = []
+        if planned:
+            created = db.session.scalars(
+                insert(Reservation).returning(Reservation, sort_by_parameter_order=True),
+                [self._reservation_row(product_request, alloc) for product_request, alloc in planned],
+                execution_options={'render_nulls': True}
+            ).all()
+
+        batch_rows = [{
+            'reservation_id': reservation.id,
+            'stock_id': batch['stockId'],
+            'batch_number': batch['batchNumber'],
+            'expiry_date': date.fromisoformat(batch['expiryDate']) if batch['expiryDate'] else None,
+            'quantity': batch['quantity'],
+            'released_quantity': 0
+        } for reservation, (_, alloc) in zip(created, planned)
+            if alloc['source'] == 'local'
+            for batch in alloc['batches']]
+        if batch_rows:
+            db.session.execute(insert(ReservationBatch), batch_rows)
+
+        reservations = {product_request.id: [] for product_request in product_requests}
+        for reservation in created:
+            reservations[reservation.request_id].append(reservation)
+
+        # The INSERT bypasses the flush listener, so count the new sources here
+        for product_request in product_requests:
+            created_here = reservations[product_request.id]
+            product_request.sources_total = (product_request.sources_total or 0) + len(created_here)
+            product_request.sources_ready = (product_request.sources_ready or 0) + sum(
+                1 for reservation in created_here if reservation.counted_as_ready)
+        return reservations
+
     def create_manual_supplier_reservation(self, product_request: ProductRequest, supplier_id: int, quantity: int) -> Reservation:
         """
         Create a supplier reservation with intelligent status assignment.
@@ -285,14 +854,13 @@ class SourcingService:
             reservation_status=ReservationStatus.SUPPLIER_CONFIRMED
         )
 
-        db.session.add(reservation)
-        db.session.commit()
-
-        # Trigger source completion check immediately
+        # Trigger source completion check immediately, in the same transaction
         source_completion = SourceCompletionService()
-        all_ready = source_completion.check_all_sources_ready(product_request.id)
+        with source_completion.transaction():
+            db.session.add(reservation)
+            all_ready = source_completion.check_all_sources_ready(product_request.id)
         if all_ready:
-            print(f"[AUTO-CONFIRM] Supplier {supplier.name} auto-confirmed. Request {product_request.id} ready for logistics.")
+            log.info('supplier_auto_confirmed', supplier_id=supplier.id, request_id=product_request.id)
 
         return reservation
 
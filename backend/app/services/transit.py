@@ -0,0 +1,98 @@
+"""
+TransitMatrix - warehouse-to-city transit times
+
+Loaded once from a CSV (warehouse_code,city,transit_days; TRANSIT_MATRIX_PATH,
+default app/data/transit_times.csv) into a dict keyed by
+(warehouse code, normalised city), so every lookup is a single hash probe.
+Pairs missing from the file return None and callers fall back to
+Warehouse.local_delivery_days.
+"""
+
+import csv
+import os
+import threading
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'transit_times.csv')
+
+# Common alternative spellings, mapped to the name used in the CSV
+CITY_ALIASES = {
+    'bengaluru': 'bangalore',
+    'trichy': 'tiruchirappalli',
+    'pondicherry': 'puducherry',
+    'mysore': 'mysuru',
+    'tuticorin': 'thoothukudi',
+    'trivandrum': 'thiruvananthapuram',
+    'cochin': 'kochi',
+    'new delhi': 'delhi',
+    'bombay': 'mumbai',
+    'calcutta': 'kolkata',
+    'vizag': 'visakhapatnam',
+}
+
+
+def normalize_city(city: str) -> str:
+    """Lower-case, trim and resolve aliases"""
+    if not city:
+        return None
+    key = ' '.join(city.strip().lower().split())
+    return CITY_ALIASES.get(key, key)
+
+
+class TransitMatrix:
+    """(warehouse code, city) -> transit days"""
+
+    def __init__(self, path: str = None):
+        self.path = path or DEFAULT_PATH
+        self._days = None
+        self._cities = frozenset()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.path = app.config.get('TRANSIT_MATRIX_PATH') or self.path
+        self._days = None
+
+    def _ensure_loaded(self):
+        if self._days is None:
+            with self._lock:
+                if self._days is None:
+                    self._load()
+
+    def _load(self):
+        days = {}
+        if os.path.exists(self.path):
+            with open(self.path, newline='') as f:
+                for row in csv.DictReader(f):
+                    try:
+                        days[(row['warehouse_code'].strip().upper(), normalize_city(row['city']))] = int(row['transit_days'])
+                    except (KeyError, TypeError, ValueError):
+                        log.warning('transit_row_skipped', path=self.path, row=row)
+        else:
+            log.warning('transit_matrix_missing', path=self.path)
+        self._cities = frozenset(city for _, city in days)
+        self._days = days
+
+    def reload(self):
+        """Re-read the CSV on next lookup"""
+        with self._lock:
+            self._days = None
+
+    def days(self, warehouse_code: str, city: str):
+        """Transit days from a warehouse to a city, or None if unknown"""
+        self._ensure_loaded()
+        if not warehouse_code or not city:
+            return None
+        return self._days.get((warehouse_code.upper(), normalize_city(city)))
+
+    def knows_city(self, city: str) -> bool:
+        self._ensure_loaded()
+        return normalize_city(city) in self._cities
+
+    def stats(self) -> dict:
+        self._ensure_loaded()
+        return {'pairs': len(self._days), 'cities': len(self._cities), 'path': self.path}
+
+
+transit_matrix = TransitMatrix()
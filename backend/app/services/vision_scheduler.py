@@ -0,0 +1,358 @@
+"""
+VisionScheduler - rate limiting, retries and a circuit breaker for vision-model calls
+
+Every Groq vision call made by GroqAIService goes through call():
+
+- A token bucket per API key (VISION_RATE_PER_MINUTE, bursts of
+  VISION_BURST) spaces calls out so a busy queue does not run into Groq's
+  rate limits. A 429 pauses the key's bucket for the retry-after period the
+  API reported, so every worker thread waits, not just the one that was
+  refused.
+- 429s, 5xx responses, timeouts and connection errors are retried up to
+  VISION_MAX_RETRIES times, waiting retry-after when the API sends it and
+  exponential backoff with jitter otherwise.
+- A circuit breaker per API key opens after VISION_BREAKER_THRESHOLD
+  consecutive server/connection failures. While it is open (for
+  VISION_BREAKER_RESET_SECONDS) calls fail fast; after that one trial call is
+  let through and closes it again on success.
+
+When a call cannot be made now - breaker open, no token within
+VISION_MAX_WAIT_SECONDS or retries used up on a retryable error - call()
+raises VisionUnavailable with a retry_after hint. The inspection job queue
+puts the job back in the queue for that long instead of recording an ERROR
+result, so reservations resume on their own once the API recovers.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from app.utils.log import get_logger
+
+log = get_logger(__name__)
+
+
+class VisionUnavailable(Exception):
+    """The vision API cannot take this call now; retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at rate tokens per second, holding up to capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it (0 = now)"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def release(self):
+        """Give back a reserved token that will not be used"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        """Hold all calls for seconds (e.g. after a 429) and empty the bucket"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+
+def key_label(api_key: str) -> str:
+    """Stable label for an API key that reveals none of it (for stats and logs)"""
+    return 'key-' + hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+class CircuitBreaker:
+    """CLOSED -> OPEN after threshold consecutive failures -> HALF_OPEN after reset_seconds -> CLOSED on success"""
+
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, threshold: int, reset_seconds: float, name: str = None):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> float:
+        """0 if a call may go ahead, otherwise seconds until the breaker lets a trial call through"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._trial_running:
+                return min(self.reset_seconds, 5.0)
+            self.state = self.HALF_OPEN
+            self._trial_running = True
+            return 0.0
+
+    def open_for(self) -> float:
+        """Seconds until an open breaker lets a trial call through (0 if not open)"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info('breaker_closed', breaker=self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+                log.warning('breaker_opened', breaker=self.name, failures=self.failures,
+                            reset_seconds=self.reset_seconds)
+            self._trial_running = False
+
+    def release(self):
+        """End a trial call that neither succeeded nor failed (e.g. a 400)"""
+        with self._lock:
+            self._trial_running = False
+
+
+class VisionScheduler:
+    """Per-API-key token bucket and circuit breaker around vision-model calls, with call metrics"""
+
+    def __init__(self):
+        self.rate_per_minute = 30
+        self.burst = 5
+        self.max_retries = 3
+        self.backoff_base = 1.0
+        self.backoff_max = 30.0
+        self.breaker_threshold = 5
+        self.breaker_reset_seconds = 60.0
+        self.max_wait_seconds = 30.0
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._reset_metrics()
+
+    def init_app(self, app):
+        self.rate_per_minute = app.config.get('VISION_RATE_PER_MINUTE', self.rate_per_minute)
+        self.burst = app.config.get('VISION_BURST', self.burst)
+        self.max_retries = app.config.get('VISION_MAX_RETRIES', self.max_retries)
+        self.backoff_base = app.config.get('VISION_BACKOFF_BASE', self.backoff_base)
+        self.backoff_max = app.config.get('VISION_BACKOFF_MAX', self.backoff_max)
+        self.breaker_threshold = app.config.get('VISION_BREAKER_THRESHOLD', self.breaker_threshold)
+        self.breaker_reset_seconds = app.config.get('VISION_BREAKER_RESET_SECONDS', self.breaker_reset_seconds)
+        self.max_wait_seconds = app.config.get('VISION_MAX_WAIT_SECONDS', self.max_wait_seconds)
+        with self._lock:
+            self._buckets = {}
+            self._breakers = {}
+        self._reset_metrics()
+
+    def longest_call(self, request_seconds: float) -> float:
+        """
+        Upper bound on how long call() can take when one request can take
+        request_seconds: every attempt may wait up to max_wait_seconds for a
+        token and as long again before its retry.
+        """
+        return (self.max_retries + 1) * (2 * self.max_wait_seconds + request_seconds)
+
+    def _reset_metrics(self):
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.succeeded = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.deferred = 0
+        self.failed = 0
+        self._latencies = deque(maxlen=500)
+        self._waits = deque(maxlen=500)
+
+    def _add(self, counter: str, delta: int = 1):
+        with self._metrics_lock:
+            setattr(self, counter, getattr(self, counter) + delta)
+
+    def _limits(self, api_key: str) -> tuple:
+        with self._lock:
+            if api_key not in self._buckets:
+                self._buckets[api_key] = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+                self._breakers[api_key] = CircuitBreaker(self.breaker_threshold, self.breaker_reset_seconds,
+                                                        key_label(api_key))
+            return self._buckets[api_key], self._breakers[api_key]
+
+    def call(self, api_key: str, fn):
+        """
+        Run fn() (one model request) under the key's rate limit and circuit breaker.
+
+        Returns fn()'s result. Non-retryable API errors (bad request,
+        authentication, ...) are raised as-is; retryable ones that persist
+        raise VisionUnavailable.
+        """
+        bucket, breaker = self._limits(api_key)
+        self._add('calls')
+        attempt = 0
+        while True:
+            blocked_for = breaker.allow()
+            if blocked_for:
+                self._add('deferred')
+                raise VisionUnavailable(f"Vision API circuit open, retry in {blocked_for:.0f}s", blocked_for)
+
+            wait = bucket.reserve()
+            if wait > self.max_wait_seconds:
+                bucket.release()
+                breaker.release()
+                self._add('deferred')
+                raise VisionUnavailable(f"Vision API rate limit, next slot in {wait:.0f}s", wait)
+            if wait > 0:
+                self._add('waiting')
+                try:
+                    time.sleep(wait)
+                finally:
+                    self._add('waiting', -1)
+            self._waits.append(wait)
+
+            started = time.monotonic()
+            self._add('in_flight')
+            try:
+                result = fn()
+            except Exception as e:
+                kind, retry_after = self._classify(e)
+                if kind is None:
+                    breaker.release()
+                    self._add('failed')
+                    raise
+                if kind == 'rate_limited':
+                    self._add('rate_limited')
+                    breaker.release()
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+                    bucket.pause(delay)
+                else:
+                    breaker.record_failure()
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+
+                attempt += 1
+                if attempt > self.max_retries or delay > self.max_wait_seconds:
+                    self._add('deferred')
+                    raise VisionUnavailable(f"Vision API unavailable after {attempt} attempt(s): {str(e)}",
+                                            max(delay, self.backoff_base, breaker.open_for()))
+                self._add('retries')
+                log.warning('vision_retry', breaker=breaker.name, error_type=type(e).__name__, attempt=attempt,
+                            max_retries=self.max_retries, delay_seconds=round(delay, 2))
+                if kind != 'rate_limited':
+                    time.sleep(delay)  # rate-limited retries wait in bucket.reserve()
+                continue
+            finally:
+                self._add('in_flight', -1)
+
+            breaker.record_success()
+            self._add('succeeded')
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _classify(error: Exception) -> tuple:
+        """('rate_limited' | 'unavailable' | None, retry-after seconds or None) for an exception from the Groq SDK"""
+        import groq
+
+        if isinstance(error, groq.RateLimitError):
+            return 'rate_limited', VisionScheduler._retry_after(error.response)
+        if isinstance(error, groq.APIStatusError):
+            if error.status_code >= 500:
+                return 'unavailable', VisionScheduler._retry_after(error.response)
+            return None, None
+        if isinstance(error, groq.APIConnectionError):  # includes APITimeoutError
+            return 'unavailable', None
+        return None, None
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        """Seconds from retry-after-ms / retry-after (delta or HTTP date) headers, or None"""
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            if headers.get('retry-after-ms'):
+                return float(headers['retry-after-ms']) / 1000
+            value = headers.get('retry-after')
+            if value:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def _percentile(values: list, fraction: float) -> float:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+    def stats(self) -> dict:
+        latencies = list(self._latencies)
+        waits = list(self._waits)
+        with self._lock:
+            breakers = {breaker.name: breaker.state for breaker in self._breakers.values()}
+            opened = sum(breaker.opened for breaker in self._breakers.values())
+        return {
+            'waiting': self.waiting,
+            'inFlight': self.in_flight,
+            'calls': self.calls,
+            'succeeded': self.succeeded,
+            'retries': self.retries,
+            'rateLimited': self.rate_limited,
+            'deferred': self.deferred,
+            'failed': self.failed,
+            'breakers': breakers,
+            'breakerOpened': opened,
+            'latencySeconds': {
+                'p50': self._percentile(latencies, 0.5),
+                'p95': self._percentile(latencies, 0.95),
+                'max': round(max(latencies), 3) if latencies else None
+            },
+            'rateLimitWaitSeconds': {
+                'p50': self._percentile(waits, 0.5),
+                'p95': self._percentile(waits, 0.95)
+            },
+            'ratePerMinute': self.rate_per_minute
+        }
+
+
+vision_scheduler = VisionScheduler()
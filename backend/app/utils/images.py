@@ -0,0 +1,231 @@
+"""
+Image helpers for inspection uploads.
+
+Fingerprints recognise re-uploaded photos: sha256 identifies byte-identical
+files; the 64-bit difference hash (dHash) stays within a few bits for the
+same photo after re-encoding, resizing or small crops, so near-duplicates
+can be matched by Hamming distance.
+
+prepare_for_analysis() shrinks phone photos before they are base64-encoded
+into a vision-model request. image_quality() measures blur and exposure.
+ingest_upload() does all of the above for a new upload while it is written
+to disk, so the file is streamed once and decoded once.
+"""
+
+import hashlib
+import io
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+_EXIF_ORIENTATION = 0x0112
+_FORMAT_MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+_FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+_CHUNK_SIZE = 1024 * 1024
+QUALITY_EDGE = 512  # Blur and exposure are measured at this longest edge, so thresholds do not depend on resolution
+
+IngestedImage = namedtuple(
+    'IngestedImage', ['size', 'sha256', 'mime_type', 'perceptual_hash', 'prepared_path', 'quality']
+)
+
+
+def sniff_image_format(header: bytes) -> str:
+    """'JPEG', 'PNG' or 'WEBP' from a file's first bytes, or None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def sha256_file(path: str, chunk_size: int = _CHUNK_SIZE) -> str:
+    """Hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(path: str, hash_size: int = 8) -> str:
+    """
+    Difference hash of an image as a 16-character hex string (for hash_size 8).
+
+    Returns None if the file cannot be decoded as an image.
+    """
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (hash_size * 4, hash_size * 4))  # JPEG: decode at reduced size
+            return _dhash_image(image, hash_size)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+def _dhash_image(image: Image.Image, hash_size: int = 8) -> str:
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """Number of differing bits between two hex hashes"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def image_quality(image: Image.Image, width: int = None, height: int = None) -> dict:
+    """
+    Blur and exposure measurements for an opened image.
+
+    sharpness is the variance of the Laplacian (low = blurry); brightness is
+    the mean luminance (0-255); darkClipped / brightClipped are the shares of
+    pixels within 16 levels of black / white. width and height default to the
+    image's size (pass the full size when the image was decoded in draft mode).
+    """
+    if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+    # Integer box reduction first: several times cheaper than resampling the full decode
+    gray = image.reduce(max(1, max(image.size) // QUALITY_EDGE)).convert('L')
+    gray.thumbnail((QUALITY_EDGE, QUALITY_EDGE))
+    pixels = np.asarray(gray, dtype=np.float32)
+    laplacian = pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:] - 4 * pixels[1:-1, 1:-1]
+    histogram = np.bincount(np.asarray(gray, dtype=np.uint8).ravel(), minlength=256) / pixels.size
+    return {
+        'width': width or image.size[0],
+        'height': height or image.size[1],
+        'sharpness': round(float(laplacian.var()), 1) if laplacian.size else 0.0,
+        'brightness': round(float(pixels.mean()), 1),
+        'darkClipped': round(float(histogram[:16].sum()), 4),
+        'brightClipped': round(float(histogram[240:].sum()), 4)
+    }
+
+
+def prepared_path(path: str, max_edge: int, image_format: str, quality: int) -> str:
+    """Where ingest_upload() stores the preprocessed copy of an upload for these settings"""
+    image_format = image_format.upper()
+    stem = os.path.splitext(path)[0]
+    return f"{stem}.prepared-{max_edge}-q{quality}.{_FORMAT_EXTENSIONS.get(image_format, image_format.lower())}"
+
+
+def prepare_for_analysis(path: str, max_edge: int = 1280, image_format: str = 'JPEG', quality: int = 85) -> tuple:
+    """
+    Downscale and re-encode an image before sending it to the vision model.
+
+    Applies the EXIF orientation, converts to RGB (transparent areas become
+    white), shrinks so the longest edge is at most max_edge and re-encodes as
+    image_format ('JPEG' or 'WEBP') at the given quality. If nothing needed
+    rotating or shrinking and the original file is already smaller, the
+    original bytes are kept. A copy saved by ingest_upload() is used as-is.
+
+    Returns (bytes, mime_type).
+    """
+    image_format = image_format.upper()
+    cached_path = prepared_path(path, max_edge, image_format, quality)
+    if os.path.exists(cached_path):
+        with open(cached_path, 'rb') as f:
+            return f.read(), _FORMAT_MIME_TYPES[image_format]
+
+    original_size = os.path.getsize(path)
+    with Image.open(path) as image:
+        original_format = image.format
+        encoded, changed = _encode_prepared(image, max_edge, image_format, quality)
+
+    if not changed and original_size <= len(encoded) and original_format in _FORMAT_MIME_TYPES:
+        with open(path, 'rb') as f:
+            return f.read(), _FORMAT_MIME_TYPES[original_format]
+    return encoded, _FORMAT_MIME_TYPES[image_format]
+
+
+def _encode_prepared(image: Image.Image, max_edge: int, image_format: str, quality: int) -> tuple:
+    """Rotate, flatten, shrink and encode an opened image. Returns (bytes, rotated_or_resized)."""
+    full_size = image.size
+    image.draft('RGB', (max_edge, max_edge))  # JPEG: let the decoder downscale by 1/2, 1/4 or 1/8
+    oriented = ImageOps.exif_transpose(image)
+    rotated = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+
+    if oriented.mode in ('RGBA', 'LA') or (oriented.mode == 'P' and 'transparency' in oriented.info):
+        rgba = oriented.convert('RGBA')
+        prepared = Image.new('RGB', rgba.size, (255, 255, 255))
+        prepared.paste(rgba, mask=rgba.getchannel('A'))
+    else:
+        prepared = oriented.convert('RGB')
+
+    if max(prepared.size) > max_edge:
+        prepared.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    prepared.save(buffer, image_format, quality=quality, optimize=True)
+    return buffer.getvalue(), rotated or max(full_size) > max(prepared.size)
+
+
+def ingest_upload(stream, dest_path: str, max_bytes: int = None, max_edge: int = 1280,
+                  image_format: str = 'JPEG', quality: int = 85) -> IngestedImage:
+    """
+    Write an uploaded image to dest_path in one pass and fingerprint it.
+
+    The stream is copied in 1 MB chunks while the SHA-256 and size are
+    updated and the header is checked, so memory stays bounded however large
+    the upload is. The saved file is then decoded once (at reduced size for
+    JPEG) to compute the dHash, the image_quality() measurements and, when
+    max_edge is set, the preprocessed copy the vision model will be sent
+    (see prepare_for_analysis()).
+
+    Raises ValueError (and removes what was written) if the content is not a
+    JPEG, PNG or WEBP image or is larger than max_bytes.
+    """
+    saved_prepared = prepared_path(dest_path, max_edge, image_format, quality) if max_edge else None
+    digest = hashlib.sha256()
+    size = 0
+    source_format = None
+    try:
+        with open(dest_path, 'wb') as f:
+            while True:
+                chunk = stream.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    source_format = sniff_image_format(chunk[:16])
+                    if source_format is None:
+                        raise ValueError('File content is not a PNG, JPEG or WEBP image')
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise ValueError(f'Image is larger than {max_bytes} bytes')
+                digest.update(chunk)
+                f.write(chunk)
+        if size == 0:
+            raise ValueError('File is empty')
+
+        try:
+            with Image.open(dest_path) as image:
+                full_size = image.size
+                if saved_prepared:
+                    encoded, changed = _encode_prepared(image, max_edge, image_format.upper(), quality)
+                    if changed or len(encoded) < size:
+                        with open(saved_prepared, 'wb') as f:
+                            f.write(encoded)
+                    else:
+                        saved_prepared = None
+                else:
+                    image.draft('L', (QUALITY_EDGE, QUALITY_EDGE))
+                # The (draft-mode) decode above is small already; hash and measure what was decoded
+                perceptual_hash = _dhash_image(image)
+                measurements = image_quality(image, *full_size)
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+            raise ValueError(f'Image could not be decoded: {str(e)}')
+
+        return IngestedImage(
+            size, digest.hexdigest(), _FORMAT_MIME_TYPES[source_format], perceptual_hash, saved_prepared, measurements
+        )
+
+    except Exception:
+        for path in (dest_path, saved_prepared):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
@@ -0,0 +1,135 @@
+"""
+Structured event logging for hot paths.
+
+Code logs named events with fields instead of formatted strings:
+
+    log = get_logger(__name__)
+    log.info('request_ready', request_id=7, sources=3)
+    log.debug('stock_rows', sampled=True, warehouse_id=2, rows=480)
+
+Nothing is formatted on the calling thread: a disabled level returns before
+a record is built, sampled events (kept at LOG_SAMPLE_RATE) are dropped
+before that too, and enabled records go onto an in-memory queue. A QueueListener thread formats them and
+writes to stderr, either as logfmt text ("event key=value ...") or as one
+JSON object per line (LOG_FORMAT=json).
+
+Levels come from LOG_LEVEL for everything under the 'app' package, with
+per-module overrides in LOG_LEVELS, e.g.
+"app.routes.warehouses=DEBUG,app.services.source_completion=WARNING".
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+_ROOT = 'app'
+_listener = None
+_sample_rate = 1.0
+
+
+class EventLogger:
+    """Thin wrapper over a stdlib logger that emits (event, fields) records"""
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def event(self, level: int, event: str, sampled: bool = False, **fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sampled and _sample_rate < 1.0:
+            if random.random() >= _sample_rate:
+                return
+            fields['sample_rate'] = _sample_rate
+        self._logger.log(level, event, extra={'fields': fields})
+
+    def debug(self, event: str, sampled: bool = False, **fields):
+        self.event(logging.DEBUG, event, sampled, **fields)
+
+    def info(self, event: str, sampled: bool = False, **fields):
+        self.event(logging.INFO, event, sampled, **fields)
+
+    def warning(self, event: str, sampled: bool = False, **fields):
+        self.event(logging.WARNING, event, sampled, **fields)
+
+    def error(self, event: str, sampled: bool = False, **fields):
+        self.event(logging.ERROR, event, sampled, **fields)
+
+
+def get_logger(name: str) -> EventLogger:
+    return EventLogger(name)
+
+
+class LogfmtFormatter(logging.Formatter):
+    """2024-01-01T00:00:00.000Z INFO app.services.x request_ready request_id=7 sources=3"""
+
+    def format(self, record):
+        parts = [_timestamp(record), record.levelname, record.name, record.getMessage()]
+        for key, value in getattr(record, 'fields', {}).items():
+            text = str(value)
+            if not text or any(c in text for c in ' ="'):
+                text = json.dumps(text)
+            parts.append(f"{key}={text}")
+        return ' '.join(parts)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event and the event's fields"""
+
+    def format(self, record):
+        entry = {'ts': _timestamp(record), 'level': record.levelname, 'logger': record.name, 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+def _timestamp(record) -> str:
+    return datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def parse_levels(spec: str) -> dict:
+    """'a.b=DEBUG,c=WARNING' -> {'a.b': 'DEBUG', 'c': 'WARNING'}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(app):
+    """Route the 'app' loggers through a queue to one background writer"""
+    global _listener, _sample_rate
+
+    _sample_rate = app.config.get('LOG_SAMPLE_RATE', _sample_rate)
+    root = logging.getLogger(_ROOT)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(app.config.get('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if app.config.get('LOG_FORMAT') == 'json' else LogfmtFormatter())
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if app.config.get('LOG_QUEUE', True):
+        log_queue = queue.SimpleQueue()
+        root.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, stream)
+        _listener.start()
+    else:
+        root.addHandler(stream)
+    root.propagate = False
+
+
+@atexit.register
+def _flush_on_exit():
+    if _listener is not None:
+        _listener.stop()
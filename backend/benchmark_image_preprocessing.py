@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark inspection image preprocessing against sending the original file.
+
+For each image, compares the base64 payload sent to the vision model with and
+without prepare_for_analysis() and the time spent preprocessing. With --live
+(and GROQ_API_KEY set) it also measures end-to-end analyze_image() latency
+for both paths.
+
+Run with:
+    python3 benchmark_image_preprocessing.py photo1.jpg photo2.png
+    python3 benchmark_image_preprocessing.py --synthetic 5          # generated 12 MP phone-style JPEGs
+    python3 benchmark_image_preprocessing.py --synthetic 3 --live --repeat 3
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from app import create_app
+from app.utils.images import prepare_for_analysis
+
+
+def synthetic_photos(count: int, directory: str) -> list:
+    """12 MP JPEGs with smooth gradients, shapes and sensor-like noise, tagged with EXIF orientation 6"""
+    rng = np.random.default_rng(42)
+    paths = []
+    height, width = 3024, 4032
+    y, x = np.mgrid[0:height, 0:width]
+    for n in range(count):
+        base = np.stack([
+            (x / width * 200 + 30 * np.sin(y / (150 + 40 * n))),
+            (y / height * 180 + 40),
+            (120 + 60 * np.cos(x / (300 + 25 * n)))
+        ], axis=-1)
+        for _ in range(12):
+            cy, cx, r = rng.integers(300, height - 300), rng.integers(300, width - 300), rng.integers(80, 400)
+            base[(y - cy) ** 2 + (x - cx) ** 2 < r ** 2] = rng.integers(0, 255, 3)
+        base += rng.normal(0, 6, base.shape)
+        image = Image.fromarray(np.clip(base, 0, 255).astype('uint8'))
+        exif = image.getexif()
+        exif[0x0112] = 6  # Rotated 90° CW, as phones store portrait shots
+        path = os.path.join(directory, f"synthetic_{n}.jpg")
+        image.save(path, 'JPEG', quality=92, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspection image preprocessing benchmark')
+    parser.add_argument('paths', nargs='*')
+    parser.add_argument('--synthetic', type=int, default=0, help='Generate N phone-style test photos')
+    parser.add_argument('--max-edge', type=int, default=None)
+    parser.add_argument('--format', default=None, help='JPEG or WEBP')
+    parser.add_argument('--quality', type=int, default=None)
+    parser.add_argument('--live', action='store_true', help='Also time analyze_image() against Groq')
+    parser.add_argument('--repeat', type=int, default=3, help='Live calls per image and path')
+    args = parser.parse_args()
+
+    app = create_app()
+    max_edge = args.max_edge or app.config['INSPECTION_IMAGE_MAX_EDGE'] or 1280
+    image_format = args.format or app.config['INSPECTION_IMAGE_FORMAT']
+    quality = args.quality or app.config['INSPECTION_IMAGE_QUALITY']
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = list(args.paths) + synthetic_photos(args.synthetic, directory)
+        if not paths:
+            parser.error('pass image paths or --synthetic N')
+
+        print(f"Preprocessing: max edge {max_edge}, {image_format} q{quality}\n")
+        print(f"{'image':<28}{'original':>12}{'payload':>12}{'prepared':>12}{'payload':>12}{'saved':>8}{'prep ms':>9}")
+        totals = [0, 0]
+        for path in paths:
+            original_size = os.path.getsize(path)
+            timings = []
+            for _ in range(3):
+                started = time.perf_counter()
+                prepared, _ = prepare_for_analysis(path, max_edge, image_format, quality)
+                timings.append((time.perf_counter() - started) * 1000)
+            original_payload = 4 * ((original_size + 2) // 3)
+            prepared_payload = len(base64.b64encode(prepared))
+            totals[0] += original_payload
+            totals[1] += prepared_payload
+            print(f"{os.path.basename(path)[:27]:<28}{original_size:>12,}{original_payload:>12,}{len(prepared):>12,}"
+                  f"{prepared_payload:>12,}{1 - prepared_payload / original_payload:>8.0%}{statistics.median(timings):>9.0f}")
+        print(f"\nTotal base64 payload: {totals[0]:,} -> {totals[1]:,} bytes ({1 - totals[1] / totals[0]:.0%} smaller)")
+
+        if args.live:
+            if not os.getenv('GROQ_API_KEY'):
+                parser.error('--live needs GROQ_API_KEY')
+            from app.services.groq_ai import GroqAIService
+
+            with app.app_context():
+                service = GroqAIService()
+                results = {}
+                for label, edge in (('original', 0), ('prepared', max_edge)):
+                    service.image_max_edge = edge
+                    latencies = []
+                    for path in paths:
+                        for _ in range(args.repeat):
+                            started = time.perf_counter()
+                            service.analyze_image(path, 'package')
+                            latencies.append(time.perf_counter() - started)
+                    results[label] = latencies
+                print("\nEnd-to-end analyze_image() latency (s):")
+                for label, latencies in results.items():
+                    print(f"  {label:<10} median {statistics.median(latencies):.2f}  "
+                          f"p90 {sorted(latencies)[int(len(latencies) * 0.9) - 1 if len(latencies) > 1 else 0]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark database round trips of the Joint Wait state transitions.
+
+Counts SQL statements and commits (and wall time) for:
+
+- inspection verdict: one processed upload, i.e. InspectionJobQueue.run() for
+  an OK photo, up to the request's completion check
+- accept_damage:      POST /procurement/resolve/<id> accepting a damaged source
+- mark-source-ready:  POST /procurement/mark-source-ready
+
+The vision model is not called; every photo gets a canned OK result.
+Creates requests and reservations, so run it against a scratch database:
+
+    DATABASE_URL=sqlite:////tmp/joint_wait.db python3 seed.py
+    DATABASE_URL=sqlite:////tmp/joint_wait.db python3 benchmark_joint_wait.py --iterations 20
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault('INSPECTION_WORKERS', '0')  # Jobs are run by the benchmark itself
+os.environ.setdefault('GROQ_WARMUP', 'false')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models.inspection import InspectionImage, InspectionResult
+from app.models.request import ProductRequest, Reservation, RequestStatus, ReservationStatus
+from app.models.user import User, Role
+from app.services import inspection_jobs
+from app.services.inspection_backend import InspectionBackend
+from app.services.inspection_jobs import inspection_queue
+from app.services.sourcing import SourcingService
+
+
+class RoundTrips:
+    """Counts statements and commits on the engine while active"""
+
+    def __init__(self, engine):
+        self.statements = 0
+        self.commits = 0
+        self.active = False
+        event.listen(engine, 'before_cursor_execute', self._statement)
+        event.listen(engine, 'commit', self._commit)
+
+    def _statement(self, *args):
+        if self.active:
+            self.statements += 1
+
+    def _commit(self, *args):
+        if self.active:
+            self.commits += 1
+
+    def measure(self, fn) -> tuple:
+        """(statements, commits, milliseconds) for one call of fn"""
+        db.session.expire_all()
+        self.statements = self.commits = 0
+        self.active = True
+        started = time.perf_counter()
+        try:
+            fn()
+        finally:
+            self.active = False
+        return self.statements, self.commits, (time.perf_counter() - started) * 1000
+
+
+def new_request(dealer: User, product_id: int, quantity: int) -> ProductRequest:
+    product_request = ProductRequest(
+        dealer_id=dealer.id,
+        product_id=product_id,
+        quantity=quantity,
+        delivery_location='Benchmark',
+        dealer_notes='benchmark_joint_wait'
+    )
+    product_request.generate_request_number()
+    db.session.add(product_request)
+    db.session.commit()
+    SourcingService().create_reservations(product_request)
+    product_request.status = RequestStatus.PICKING
+    db.session.commit()
+    return product_request
+
+
+def local_reservations(product_request: ProductRequest) -> list:
+    return [r for r in product_request.reservations if r.warehouse_id and r.quantity > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Joint Wait round-trip benchmark')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--product-id', type=int, default=None, help='Product to request (default: first with local stock)')
+    parser.add_argument('--quantity', type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    ok_result = InspectionBackend._fallback_result('OK', 95, '{}')
+    inspection_jobs.analyze_inspections = lambda inspections: [dict(ok_result) for _ in inspections]
+
+    with app.app_context():
+        dealer = User.query.filter_by(role=Role.DEALER).first()
+        manager = User.query.filter_by(role=Role.PROCUREMENT_MANAGER).first()
+        if not dealer or not manager:
+            print("Needs a dealer and a procurement manager - run seed.py first")
+            return
+        headers = {'Authorization': 'Bearer ' + create_access_token(
+            identity=str(manager.id), additional_claims={'username': manager.username, 'role': manager.role.value})}
+
+        product_id = args.product_id
+        if product_id is None:
+            from app.models.warehouse import Stock
+            stock = Stock.query.filter(Stock.quantity - Stock.reserved_quantity >= args.quantity).first()
+            if not stock:
+                print("No product with enough local stock")
+                return
+            product_id = stock.product_id
+
+        counter = RoundTrips(db.engine)
+        client = app.test_client()
+        samples = {'inspection verdict': [], 'accept_damage': [], 'mark-source-ready': []}
+
+        for _ in range(args.iterations):
+            # One processed upload per local source
+            product_request = new_request(dealer, product_id, args.quantity)
+            for reservation in local_reservations(product_request):
+                inspection = InspectionImage(
+                    request_id=product_request.id,
+                    reservation_id=reservation.id,
+                    uploaded_by_id=manager.id,
+                    filename='benchmark.jpg',
+                    file_path='benchmark.jpg',
+                    content_sha256='0' * 64,
+                    image_type='package',
+                    result=InspectionResult.PROCESSING
+                )
+                db.session.add(inspection)
+                job = inspection_queue.enqueue(inspection)
+                db.session.commit()
+                job_id = job.id
+                samples['inspection verdict'].append(counter.measure(lambda: inspection_queue.run([job_id])))
+
+            # Accept a damaged source; the rest are already confirmed
+            product_request = new_request(dealer, product_id, args.quantity)
+            for n, reservation in enumerate(local_reservations(product_request)):
+                reservation.is_picked = True
+                if n == 0:
+                    reservation.is_blocked = True
+                    reservation.block_reason = 'DAMAGED'
+                    reservation.reservation_status = ReservationStatus.AI_DAMAGED
+                else:
+                    reservation.ai_confirmed = True
+                    reservation.reservation_status = ReservationStatus.AI_CONFIRMED
+            product_request.status = RequestStatus.PARTIALLY_BLOCKED
+            db.session.commit()
+            url = f"/procurement/resolve/{product_request.id}"
+            samples['accept_damage'].append(counter.measure(
+                lambda: client.post(url, json={'action': 'accept_damage', 'notes': 'benchmark'}, headers=headers)))
+
+            # Manual override of a single source
+            product_request = new_request(dealer, product_id, args.quantity)
+            reservation_id = local_reservations(product_request)[0].id
+            samples['mark-source-ready'].append(counter.measure(
+                lambda: client.post('/procurement/mark-source-ready', json={'reservationId': reservation_id}, headers=headers)))
+
+        print(f"{'Operation':<20} {'Samples':>7} {'Statements':>11} {'Commits':>8} {'Median ms':>10}")
+        for name, rows in samples.items():
+            if not rows:
+                continue
+            print(f"{name:<20} {len(rows):>7} "
+                  f"{statistics.mean(r[0] for r in rows):>11.1f} "
+                  f"{statistics.mean(r[1] for r in rows):>8.1f} "
+                  f"{statistics.median(r[2] for r in rows):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark request latency of the hot paths that log on every call.
+
+Measures, through the test client:
+
+- warehouse stock: GET /warehouses/<id>/stock for the warehouse with the most
+  stock rows (it used to print one line per row)
+- completion check: SourceCompletionService.check_all_sources_ready() on a
+  request that is still waiting for its sources
+
+While measuring, stdout and stderr (file descriptors 1 and 2, so the queue
+listener's writes count too) go to --log-file, like a service writing its
+log to a file; the results table is printed once they are restored.
+Creates a request and (for --stock-rows) products and stock, so run it
+against a scratch database:
+
+    DATABASE_URL=sqlite:////tmp/logging.db python3 seed.py
+    DATABASE_URL=sqlite:////tmp/logging.db python3 benchmark_logging.py --iterations 500
+    DATABASE_URL=sqlite:////tmp/logging.db LOG_LEVEL=DEBUG LOG_SAMPLE_RATE=1 python3 benchmark_logging.py
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault('INSPECTION_WORKERS', '0')
+os.environ.setdefault('GROQ_WARMUP', 'false')
+os.environ.setdefault('COMPLETION_SWEEP_SECONDS', '0')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func
+
+from app import create_app, db
+from app.models.product import Product
+from app.models.request import ProductRequest, RequestStatus
+from app.models.user import User, Role
+from app.models.warehouse import Stock
+from app.services.source_completion import SourceCompletionService
+from app.services.sourcing import SourcingService
+
+
+class Redirected:
+    """Points file descriptors 1 and 2 at a file for the duration of the block"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved = [os.dup(1), os.dup(2)]
+        self.target = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        os.dup2(self.target, 1)
+        os.dup2(self.target, 2)
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved in zip((1, 2), self.saved):
+            os.dup2(saved, fd)
+            os.close(saved)
+        os.close(self.target)
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot path logging latency benchmark')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--stock-rows', type=int, default=200, help='Top the warehouse up to this many stock rows')
+    parser.add_argument('--log-file', default=os.devnull, help='Where stdout/stderr go while measuring')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        dealer = User.query.filter_by(role=Role.DEALER).first()
+        admin = User.query.filter_by(role=Role.ADMIN).first()
+        row = db.session.query(Stock.warehouse_id, func.count()).group_by(Stock.warehouse_id) \
+            .order_by(func.count().desc()).first()
+        if not dealer or not admin or not row:
+            print("Needs a dealer, an admin and warehouse stock - run seed.py first")
+            return
+        warehouse_id, stock_rows = row
+        for n in range(stock_rows, args.stock_rows):
+            product = Product(sku=f"BENCH-LOG-{warehouse_id}-{n}", name=f"Benchmark item {n}", requires_inspection=False)
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(Stock(warehouse_id=warehouse_id, product_id=product.id, quantity=0))
+        db.session.commit()
+        stock_rows = max(stock_rows, args.stock_rows)
+        headers = {'Authorization': 'Bearer ' + create_access_token(
+            identity=str(admin.id), additional_claims={'username': admin.username, 'role': admin.role.value})}
+
+        stock = Stock.query.filter(Stock.quantity - Stock.reserved_quantity >= 5).first()
+        product_request = ProductRequest(
+            dealer_id=dealer.id,
+            product_id=stock.product_id,
+            quantity=5,
+            delivery_location='Benchmark',
+            dealer_notes='benchmark_logging'
+        )
+        product_request.generate_request_number()
+        db.session.add(product_request)
+        db.session.commit()
+        SourcingService().create_reservations(product_request)
+        product_request.status = RequestStatus.WAITING_FOR_ALL_PICKUPS
+        db.session.commit()
+        request_id = product_request.id
+
+        client = app.test_client()
+        source_completion = SourceCompletionService()
+        url = f"/warehouses/{warehouse_id}/stock"
+        samples = {'warehouse stock': [], 'completion check': []}
+
+        with Redirected(args.log_file):
+            for _ in range(args.iterations):
+                samples['warehouse stock'].append(timed(lambda: client.get(url, headers=headers)))
+                samples['completion check'].append(timed(lambda: source_completion.check_all_sources_ready(request_id)))
+
+        print(f"Warehouse {warehouse_id}: {stock_rows} stock rows, log level {app.config.get('LOG_LEVEL', '-')}")
+        print(f"{'Operation':<18} {'Samples':>7} {'Median ms':>10} {'p95 ms':>8}")
+        for name, rows in samples.items():
+            rows.sort()
+            print(f"{name:<18} {len(rows):>7} {statistics.median(rows):>10.3f} {rows[int(len(rows) * 0.95) - 1]:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
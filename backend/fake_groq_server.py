@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Groq API, for exercising the vision scheduler.
+
+Serves the two endpoints the backend uses (GET /openai/v1/models and
+POST /openai/v1/chat/completions) and answers chat completions with an
+inspection result for every image in the request. It can be told to
+rate-limit (429 + retry-after), fail a fraction of calls with 500s, be down
+(503) for a while, and add latency.
+
+Run with:
+    python3 fake_groq_server.py --port 8089 --rate-limit 20 --error-rate 0.1 --outage 30
+
+then point the backend at it:
+    GROQ_BASE_URL=http://127.0.0.1:8089 GROQ_API_KEY=fake python3 inspection_worker.py --drain
+
+and watch /inspection/jobs/stats (visionScheduler) or the [VISION] log lines.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGroqState:
+    def __init__(self, rate_limit: int, error_rate: float, outage_seconds: float, latency: float, verdict: str):
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.outage_until = time.monotonic() + outage_seconds
+        self.latency = latency
+        self.verdict = verdict
+        self.recent = deque()
+        self.counts = {'ok': 0, 'rate_limited': 0, 'errors': 0, 'outage': 0}
+        self.lock = threading.Lock()
+
+    def admit(self) -> tuple:
+        """(status, retry_after) for the next call"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.outage_until:
+                self.counts['outage'] += 1
+                return 503, None
+            while self.recent and self.recent[0] <= now - 60:
+                self.recent.popleft()
+            if self.rate_limit and len(self.recent) >= self.rate_limit:
+                self.counts['rate_limited'] += 1
+                return 429, max(1, int(self.recent[0] + 60 - now) + 1)
+            if random.random() < self.error_rate:
+                self.counts['errors'] += 1
+                return 500, None
+            self.recent.append(now)
+            self.counts['ok'] += 1
+            return 200, None
+
+
+def inspection_result(verdict: str) -> dict:
+    damaged = verdict == 'DAMAGED'
+    return {
+        'damage_detected': damaged,
+        'damage_type': 'dent' if damaged else 'none',
+        'damage_severity': 'moderate' if damaged else 'none',
+        'damage_location': None,
+        'seal_intact': True,
+        'tamper_evidence': False,
+        'spoilage_detected': False,
+        'spoilage_type': 'none',
+        'expiry_date_text': None,
+        'expiry_date_iso': None,
+        'is_expired': False,
+        'days_until_expiry': None,
+        'batch_number': None,
+        'overall_result': verdict,
+        'confidence_score': 92,
+        'quality_grade': 'B' if damaged else 'A',
+        'explanation': 'Fake Groq server response'
+    }
+
+
+def make_handler(state: FakeGroqState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/openai/v1/models':
+                return self._send(200, {'object': 'list', 'data': [{'id': 'fake-vision', 'object': 'model'}]})
+            self._send(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path.rstrip('/') != '/openai/v1/chat/completions':
+                return self._send(404, {'error': {'message': 'Not found'}})
+
+            status, retry_after = state.admit()
+            if status == 429:
+                return self._send(429, {'error': {'message': 'Rate limit reached', 'type': 'tokens'}},
+                                  {'retry-after': str(retry_after)})
+            if status != 200:
+                return self._send(status, {'error': {'message': 'Service unavailable' if status == 503 else 'Internal error'}})
+
+            time.sleep(state.latency)
+            content = body['messages'][0]['content']
+            image_count = sum(1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url')
+            if image_count > 1:
+                reply = {'images': [{'image_index': n, **inspection_result(state.verdict)} for n in range(1, image_count + 1)]}
+            else:
+                reply = inspection_result(state.verdict)
+
+            self._send(200, {
+                'id': f"chatcmpl-fake-{time.time_ns()}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'fake-vision'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': json.dumps(reply)},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Groq API server')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--rate-limit', type=int, default=0, help='Calls per minute before returning 429 (0 = none)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with 500')
+    parser.add_argument('--outage', type=float, default=0.0, help='Answer 503 for the first N seconds')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds per successful call')
+    parser.add_argument('--verdict', default='OK', choices=['OK', 'DAMAGED', 'EXPIRED', 'NEEDS_REVIEW'])
+    args = parser.parse_args()
+
+    state = FakeGroqState(args.rate_limit, args.error_rate, args.outage, args.latency, args.verdict)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f"Fake Groq API on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Calls: {state.counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Run background inspection jobs outside the web server.
+
+The API enqueues one inspection_jobs row per uploaded image. By default each
+app process also runs INSPECTION_WORKERS threads; set INSPECTION_WORKERS=0 on
+the web servers and run this script to keep vision-model calls off the
+request-serving processes entirely.
+
+Run with:
+    python3 inspection_worker.py                # serve forever with --workers threads
+    python3 inspection_worker.py --drain        # run everything queued, then exit
+    python3 inspection_worker.py --stats        # print queue depth by status
+    python3 inspection_worker.py --purge-cache  # drop expired/excess cached results
+    python3 inspection_worker.py --sweep        # move requests whose sources are all ready, then exit
+
+While serving, the worker also runs the completion sweeper
+(COMPLETION_SWEEP_SECONDS) and, in ledger mode, ledger compaction
+(RESERVATION_LEDGER_COMPACT_SECONDS).
+"""
+
+import argparse
+import time
+
+from app import create_app, db
+from app.services.inspection_jobs import inspection_queue
+from app.services.inspection_cache import inspection_cache
+from app.services.completion_sweeper import completion_sweeper
+from app.services.reservation_ledger import reservation_ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspection job worker')
+    parser.add_argument('--workers', type=int, default=None, help='Worker threads (default INSPECTION_WORKERS or 2)')
+    parser.add_argument('--drain', action='store_true', help='Run queued jobs in this thread and exit')
+    parser.add_argument('--stats', action='store_true', help='Print queue statistics and exit')
+    parser.add_argument('--purge-cache', action='store_true', help='Purge the inspection result cache and exit')
+    parser.add_argument('--sweep', action='store_true', help='Run one completion sweep and exit')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        if args.stats:
+            for status, count in inspection_queue.stats().items():
+                print(f"{status}: {count}")
+            return
+
+        if args.purge_cache:
+            removed = inspection_cache.purge()
+            db.session.commit()
+            print(f"✓ Purged {removed} cached result(s)")
+            return
+
+        if args.sweep:
+            fixed = completion_sweeper.sweep()
+            print(f"✓ Moved {fixed} request(s) to READY_FOR_ALLOCATION")
+            return
+
+        if args.drain:
+            ran = inspection_queue.drain()
+            print(f"✓ Ran {ran} inspection job(s)")
+            return
+
+    inspection_queue.start(args.workers or app.config.get('INSPECTION_WORKERS') or 2)
+    completion_sweeper.start()
+    reservation_ledger.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Stopping workers...")
+        inspection_queue.stop(timeout=30)
+        completion_sweeper.stop(timeout=30)
+        reservation_ledger.stop(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
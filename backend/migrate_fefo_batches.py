@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Database migration script for FEFO batch allocation (PostgreSQL compatible)
+
+- Adds the ix_stocks_product_expiry index on stocks (product_id, expiry_date)
+  used to pick batches first-expiry-first-out
+- Creates the reservation_batches table (which batches each local
+  reservation took stock from)
+
+Run this script to update your database schema:
+    python3 migrate_fefo_batches.py
+"""
+
+from app import create_app, db
+from sqlalchemy import text, inspect
+
+
+def migrate():
+    """Add FEFO index and reservation_batches table"""
+    app = create_app()
+    
+    with app.app_context():
+        print("Starting FEFO batch migration...")
+        
+        inspector = inspect(db.engine)
+        existing_indexes = [index['name'] for index in inspector.get_indexes('stocks')]
+        
+        try:
+            if 'ix_stocks_product_expiry' not in existing_indexes:
+                print("  Adding index: ix_stocks_product_expiry")
+                db.session.execute(text("""
+                    CREATE INDEX ix_stocks_product_expiry ON stocks (product_id, expiry_date)
+                """))
+                db.session.commit()
+                print("  ✓ Added ix_stocks_product_expiry")
+            else:
+                print("  ○ Index ix_stocks_product_expiry already exists, skipping")
+                
+        except Exception as e:
+            print(f"  ✗ Error adding ix_stocks_product_expiry: {e}")
+            db.session.rollback()
+        
+        # create_app() already ran db.create_all(), which creates new tables
+        if 'reservation_batches' in inspect(db.engine).get_table_names():
+            print("  ✓ reservation_batches table present")
+        else:
+            print("  ✗ reservation_batches table missing")
+        
+        print("\n✓ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
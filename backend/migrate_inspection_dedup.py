@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Database migration script for inspection result deduplication (PostgreSQL compatible)
+
+- Adds content_sha256, perceptual_hash and result_cached to inspection_images
+- Adds the ix_inspection_images_content_sha256 index
+- Creates the inspection_result_cache table
+- Backfills hashes for existing images whose files are still on disk
+
+Run this script to update your database schema:
+    python3 migrate_inspection_dedup.py
+"""
+
+import os
+
+from app import create_app, db
+from sqlalchemy import text, inspect
+
+
+def migrate():
+    """Add content hash columns and the inspection result cache table"""
+    app = create_app()
+
+    with app.app_context():
+        print("Starting inspection dedup migration...")
+
+        inspector = inspect(db.engine)
+        existing_columns = [col['name'] for col in inspector.get_columns('inspection_images')]
+        existing_indexes = [index['name'] for index in inspector.get_indexes('inspection_images')]
+
+        columns_to_add = [
+            ("content_sha256", "VARCHAR(64)"),
+            ("perceptual_hash", "VARCHAR(16)"),
+            ("result_cached", "BOOLEAN DEFAULT FALSE"),
+        ]
+
+        for column_name, column_def in columns_to_add:
+            try:
+                if column_name not in existing_columns:
+                    print(f"  Adding column: {column_name}")
+                    db.session.execute(text(f"""
+                        ALTER TABLE inspection_images ADD COLUMN {column_name} {column_def}
+                    """))
+                    db.session.commit()
+                    print(f"  ✓ Added {column_name}")
+                else:
+                    print(f"  ○ Column {column_name} already exists, skipping")
+
+            except Exception as e:
+                print(f"  ✗ Error adding {column_name}: {e}")
+                db.session.rollback()
+
+        try:
+            if 'ix_inspection_images_content_sha256' not in existing_indexes:
+                print("  Adding index: ix_inspection_images_content_sha256")
+                db.session.execute(text("""
+                    CREATE INDEX ix_inspection_images_content_sha256 ON inspection_images (content_sha256)
+                """))
+                db.session.commit()
+                print("  ✓ Added ix_inspection_images_content_sha256")
+            else:
+                print("  ○ Index ix_inspection_images_content_sha256 already exists, skipping")
+
+        except Exception as e:
+            print(f"  ✗ Error adding ix_inspection_images_content_sha256: {e}")
+            db.session.rollback()
+
+        # create_app() already ran db.create_all(), which creates new tables
+        if 'inspection_result_cache' in inspect(db.engine).get_table_names():
+            print("  ✓ inspection_result_cache table present")
+        else:
+            print("  ✗ inspection_result_cache table missing")
+
+        # Backfill hashes so re-uploads of existing photos are recognised
+        from app.models.inspection import InspectionImage
+        from app.utils.images import sha256_file, dhash
+
+        images = InspectionImage.query.filter(InspectionImage.content_sha256.is_(None)).all()
+        hashed = 0
+        for image in images:
+            if image.file_path and os.path.exists(image.file_path):
+                image.content_sha256 = sha256_file(image.file_path)
+                image.perceptual_hash = dhash(image.file_path)
+                hashed += 1
+        db.session.commit()
+        print(f"  ✓ Hashed {hashed} of {len(images)} existing images")
+
+        print("\n✓ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
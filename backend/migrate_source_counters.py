@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Database migration script for Joint Wait source counters (PostgreSQL compatible)
+
+Adds product_requests.sources_total / sources_ready and
+reservations.counted_as_ready, then backfills them from the existing
+reservations. From then on a flush listener keeps the counters current and
+SourceCompletionService reads them instead of re-scanning reservations.
+
+Run this script to update your database schema:
+    python3 migrate_source_counters.py
+"""
+
+from app import create_app, db
+from sqlalchemy import text, inspect
+
+
+COLUMNS = [
+    ('product_requests', 'sources_total', 'INTEGER DEFAULT 0'),
+    ('product_requests', 'sources_ready', 'INTEGER DEFAULT 0'),
+    ('reservations', 'counted_as_ready', 'BOOLEAN'),
+]
+
+
+def migrate():
+    """Add source counter columns and backfill them"""
+    app = create_app()
+    
+    with app.app_context():
+        print("Starting source counter migration...")
+        
+        inspector = inspect(db.engine)
+        
+        for table_name, column_name, column_type in COLUMNS:
+            existing_columns = [col['name'] for col in inspector.get_columns(table_name)]
+            try:
+                if column_name not in existing_columns:
+                    print(f"  Adding column: {table_name}.{column_name}")
+                    db.session.execute(text(f"""
+                        ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}
+                    """))
+                    db.session.commit()
+                    print(f"  ✓ Added {table_name}.{column_name}")
+                else:
+                    print(f"  ○ Column {table_name}.{column_name} already exists, skipping")
+                    
+            except Exception as e:
+                print(f"  ✗ Error adding {table_name}.{column_name}: {e}")
+                db.session.rollback()
+        
+        # Backfill
+        from app.models.request import ProductRequest
+        from app.services.source_completion import SourceCompletionService
+        
+        try:
+            print("\nBackfilling source counters...")
+            source_completion = SourceCompletionService()
+            count = 0
+            for product_request in ProductRequest.query.order_by(ProductRequest.id).all():
+                source_completion.recount_sources(product_request)
+                count += 1
+            db.session.commit()
+            print(f"  ✓ Recounted {count} requests")
+        except Exception as e:
+            print(f"  ✗ Error backfilling counters: {e}")
+            db.session.rollback()
+        
+        print("\n✓ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Database migration script for optimistic reservation mode (PostgreSQL compatible)
+
+Adds a version column to stocks and supplier_stocks. The column is bumped on
+every quantity/reservation change and is used for compare-and-swap updates
+when RESERVATION_MODE=optimistic.
+
+Run this script to update your database schema:
+    python3 migrate_stock_versions.py
+"""
+
+from app import create_app, db
+from sqlalchemy import text, inspect
+
+
+def migrate():
+    """Add version columns to stocks and supplier_stocks"""
+    app = create_app()
+    
+    with app.app_context():
+        print("Starting stock version migration...")
+        
+        inspector = inspect(db.engine)
+        
+        for table_name in ('stocks', 'supplier_stocks'):
+            existing_columns = [col['name'] for col in inspector.get_columns(table_name)]
+            try:
+                if 'version' not in existing_columns:
+                    print(f"  Adding column: {table_name}.version")
+                    db.session.execute(text(f"""
+                        ALTER TABLE {table_name} ADD COLUMN version INTEGER NOT NULL DEFAULT 0
+                    """))
+                    db.session.commit()
+                    print(f"  ✓ Added {table_name}.version")
+                else:
+                    print(f"  ○ Column {table_name}.version already exists, skipping")
+                    
+            except Exception as e:
+                print(f"  ✗ Error adding {table_name}.version: {e}")
+                db.session.rollback()
+        
+        print("\n✓ Migration complete!")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Maintenance tool for the reservation ledger.
+
+Commands:
+    init      Record OPENING entries for reservations (and reserved stock)
+              made before the ledger existed; safe to re-run
+    compact   Fold pending ledger entries into reservation_balances and,
+              in ledger mode, into Stock.reserved_quantity
+              (--loop SECONDS keeps compacting on an interval)
+    audit     Replay the ledger and report balances/stock rows that disagree
+    rebuild   Recreate reservation_balances from the ledger
+              (--stocks also resets Stock.reserved_quantity from the replay)
+
+Run with: python3 reservation_ledger_tool.py <command>
+"""
+
+import argparse
+import sys
+import time
+
+from app import create_app
+from app.services.reservation_ledger import reservation_ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reservation ledger maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('init')
+    compact_parser = subparsers.add_parser('compact')
+    compact_parser.add_argument('--loop', type=float, default=0, help='Seconds between runs (0 = run once)')
+    compact_parser.add_argument('--batch-size', type=int, default=None)
+    subparsers.add_parser('audit')
+    rebuild_parser = subparsers.add_parser('rebuild')
+    rebuild_parser.add_argument('--stocks', action='store_true', help='Also reset Stock.reserved_quantity')
+    args = parser.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'init':
+            written = reservation_ledger.initialize()
+            if written:
+                print(f"✓ Recorded {written} opening entries")
+            else:
+                print("○ Every reservation already has ledger entries, skipping")
+            totals = reservation_ledger.compact()
+            print(f"✓ Compacted {totals['entries']} entries into {totals['balances']} balances")
+
+        elif args.command == 'compact':
+            while True:
+                started = time.monotonic()
+                totals = reservation_ledger.compact(args.batch_size)
+                print(f"[LEDGER] Compacted {totals['entries']} entries in {totals['batches']} batch(es): "
+                      f"{totals['balances']} balances, {totals['stocks']} stock rows "
+                      f"({(time.monotonic() - started) * 1000:.0f} ms)")
+                if not args.loop:
+                    break
+                time.sleep(args.loop)
+
+        elif args.command == 'audit':
+            problems = reservation_ledger.audit()
+            for problem in problems:
+                print(f"  ✗ {problem}")
+            if problems:
+                print(f"\n✗ {len(problems)} discrepancies found")
+                sys.exit(1)
+            print("✓ Ledger, balances and stock rows agree")
+
+        elif args.command == 'rebuild':
+            totals = reservation_ledger.rebuild(stocks=args.stocks)
+            print(f"✓ Rebuilt {totals['balances']} balances, reset {totals['stocks']} stock rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -76,8 +76,14 @@ function UploadPageContent() {
             formData.append('requestId', requestId);
             formData.append('imageType', imageType);
 
-            const result = await api.uploadInspectionImage(formData);
-            setImages([...images, result]);
+            const uploaded = await api.uploadInspectionImage(formData);
+            setImages([...images, uploaded]);
+            setSelectedFile(null);
+            setPreviewUrl(null);
+
+            // Analysis runs in the background; wait for the result before re-checking the request
+            const result = await api.waitForInspectionResult(uploaded.id);
+            setImages((current) => current.map((img) => (img.id === result.id ? result : img)));
 
             // Re-fetch request to check for status updates
             const updatedRequest = await api.getRequest(parseInt(requestId));
@@ -90,9 +96,6 @@ function UploadPageContent() {
                 window.location.href = '/warehouse/completed';
                 return;
             }
-
-            setSelectedFile(null);
-            setPreviewUrl(null);
         } catch (error: any) {
             alert(error.message || 'Upload failed');
         } finally {
@@ -249,6 +249,18 @@ class ApiClient {
         return this.request(`/inspection/${imageId}/result`);
     }
 
+    // Uploads return 202 while the AI analysis runs in the background queue;
+    // poll until the image leaves PENDING/PROCESSING (or give up after timeoutMs)
+    async waitForInspectionResult(imageId: number, intervalMs = 1500, timeoutMs = 120000) {
+        const deadline = Date.now() + timeoutMs;
+        let inspection = await this.getInspectionResult(imageId);
+        while (['PENDING', 'PROCESSING'].includes(inspection.result) && Date.now() < deadline) {
+            await new Promise((resolve) => setTimeout(resolve, intervalMs));
+            inspection = await this.getInspectionResult(imageId);
+        }
+        return inspection;
+    }
+
     async getRequestImages(requestId: number) {
         return this.request(`/inspection/request/${requestId}`);
     }
@@ -363,6 +375,15 @@ class ApiClient {
         return this.request(`/procurement/completion-status/${requestId}`);
     }
 
+    async getCompletionStatuses(options: { ids?: number[]; status?: string[]; limit?: number } = {}) {
+        const params = new URLSearchParams();
+        if (options.ids?.length) params.append('ids', options.ids.join(','));
+        if (options.status?.length) params.append('status', options.status.join(','));
+        if (options.limit) params.append('limit', String(options.limit));
+        const query = params.toString() ? `?${params.toString()}` : '';
+        return this.request(`/procurement/completion-status${query}`);
+    }
+
     // Supplier Confirmation (Joint Wait Model)
     async getMyPendingSupplierReservations() {
         return this.request('/suppliers/my/pending-reservations');
@@ -203,6 +203,7 @@ export interface InspectionImage {
     isExpired: boolean;
     sealIntact?: boolean;
     spoilageDetected: boolean;
+    resultCached?: boolean;
     overridden: boolean;
     overrideResult?: InspectionResult;
     overrideReason?: string;